@@ -0,0 +1,106 @@
+import logging
+import os
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDINGS_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def get_embeddings(cache_folder: str, model_name: str = EMBEDDINGS_MODEL_NAME, backend: str | None = None) -> Embeddings:
+    """
+    Returns the sentence embedding model for the configured backend (EMBEDDINGS_BACKEND):
+    "torch" runs sentence-transformers on PyTorch, "onnx" runs an ONNX export of the same
+    model on onnxruntime and "onnx-int8" runs a dynamically quantized export of it.
+    The ONNX variants are exported once into cache_folder and loaded from there afterwards.
+    """
+    backend = backend or os.getenv("EMBEDDINGS_BACKEND", "torch")
+    if backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            cache_folder=cache_folder,
+            model_kwargs={'device': 'cpu'}
+        )
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbeddings(model_name, cache_folder, quantize=backend == "onnx-int8")
+    raise ValueError(f"Unknown embeddings backend '{backend}'. Use one of {', '.join(EMBEDDINGS_BACKENDS)}.")
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence-transformers model served by onnxruntime on CPU. Reproduces the
+    all-MiniLM-L6-v2 pipeline (mean pooling over the attention mask, then L2
+    normalization), so vectors are interchangeable with the PyTorch backend.
+    """
+
+    def __init__(self, model_name: str, cache_folder: str, quantize: bool = True,
+                 batch_size: int = 32, max_length: int = 256, threads: int | None = None):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.model_dir = export_onnx_model(model_name, cache_folder, quantize)
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads or int(os.getenv("EMBEDDINGS_THREADS", "0"))
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_file = os.path.join(self.model_dir, "model_quantized.onnx" if quantize else "model.onnx")
+        self.session = onnxruntime.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _embed(self, texts: list) -> list:
+        import numpy as np
+
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + self.batch_size], padding=True, truncation=True,
+                max_length=self.max_length, return_tensors="np"
+            )
+            inputs = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+            hidden = self.session.run(None, inputs)[0]
+            mask = encoded["attention_mask"][..., None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+    def embed_documents(self, texts: list) -> list:
+        return self._embed(list(texts))
+
+    def embed_query(self, text: str) -> list:
+        return self._embed([text])[0]
+
+
+def export_onnx_model(model_name: str, cache_folder: str, quantize: bool) -> str:
+    """Exports the model to ONNX (and an int8 copy when asked) under cache_folder, once."""
+    repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    model_dir = os.path.join(cache_folder, "onnx", repo_id.replace("/", "_"))
+    onnx_file = os.path.join(model_dir, "model.onnx")
+    quantized_file = os.path.join(model_dir, "model_quantized.onnx")
+
+    if not os.path.exists(onnx_file):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        logger.info(f"Exporting {repo_id} to ONNX in {model_dir}")
+        model = ORTModelForFeatureExtraction.from_pretrained(repo_id, export=True, cache_dir=cache_folder)
+        model.save_pretrained(model_dir)
+        AutoTokenizer.from_pretrained(repo_id, cache_dir=cache_folder).save_pretrained(model_dir)
+
+    if quantize and not os.path.exists(quantized_file):
+        from optimum.onnxruntime import ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        logger.info(f"Quantizing {onnx_file} to int8")
+        quantizer = ORTQuantizer.from_pretrained(model_dir, file_name="model.onnx")
+        # Dynamic quantization needs no calibration data; avx2 kernels run on any x86-64 CPU we deploy to
+        config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=model_dir, quantization_config=config)
+
+    return model_dir
@@ -0,0 +1,93 @@
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+MIN_SENTENCE_CHARS = 20
+
+
+def split_sentences(text: str) -> list:
+    """
+    Splits a chunk into sentences at end punctuation and blank lines. Fragments shorter than
+    MIN_SENTENCE_CHARS (list markers, headings) are joined to the sentence before them.
+    Ingest and compression must split the same way, so both use this function.
+    """
+    sentences = []
+    for part in SENTENCE_BOUNDARY.split(text):
+        part = " ".join(part.split())
+        if not part:
+            continue
+        if sentences and len(part) < MIN_SENTENCE_CHARS:
+            sentences[-1] = f"{sentences[-1]} {part}"
+        else:
+            sentences.append(part)
+    return sentences
+
+
+def embed_sentences(model, texts: list) -> list:
+    """Embeds the sentences of every text in one model call; returns a (sentences, dim) array per text."""
+    groups = [split_sentences(text) for text in texts]
+    flat = [sentence for group in groups for sentence in group]
+    vectors = np.asarray(model.embed_documents(flat), dtype=np.float32) if flat else np.zeros((0, 0), dtype=np.float32)
+    arrays, start = [], 0
+    for group in groups:
+        arrays.append(vectors[start:start + len(group)])
+        start += len(group)
+    return arrays
+
+
+class SentenceVectorStore:
+    """
+    float16 sentence vectors per chunk id in a SQLite file next to the Chroma data. Written
+    when chunks are ingested and read by rag-mcp's context compression, so answering a
+    question never embeds the sentences of stored chunks again.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # WAL lets the rag-mcp workers read while the writer process or the loader Job writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sentence_vectors (chunk_id TEXT PRIMARY KEY, dim INTEGER, vectors BLOB)"
+        )
+        self._conn.commit()
+
+    def put_many(self, items) -> None:
+        """Stores (chunk_id, vectors) pairs, replacing earlier vectors for the same chunks."""
+        rows = [
+            (chunk_id, vectors.shape[1] if vectors.size else 0, np.asarray(vectors, dtype=np.float16).tobytes())
+            for chunk_id, vectors in items
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO sentence_vectors VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def get_many(self, chunk_ids) -> dict:
+        """Returns chunk_id -> float32 (sentences, dim) array for the chunks that have vectors."""
+        chunk_ids = list(chunk_ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT chunk_id, dim, vectors FROM sentence_vectors WHERE chunk_id IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for chunk_id, dim, blob in rows:
+                    vectors = np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+                    found[chunk_id] = vectors.reshape(-1, dim) if dim else vectors.reshape(0, 0)
+        return found
+
+    def delete(self, chunk_ids) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM sentence_vectors WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sentence_vectors").fetchone()[0]
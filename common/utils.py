@@ -1,3 +1,4 @@
+import hashlib
 import logging
 
 def setup_logging(name: str):
@@ -18,4 +19,36 @@ def validate_id(id_str: str) -> bool:
         int(id_str)
         return True
     except ValueError:
-        return False
\ No newline at end of file
+        return False
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count for English text (about 4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts text to roughly max_tokens, preferring a sentence or word boundary."""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind(". "), cut.rfind("\n"))
+    if boundary < max_chars // 2:
+        boundary = cut.rfind(" ")
+    return cut[:boundary + 1].rstrip() if boundary > 0 else cut
+
+
+def content_hash(data) -> str:
+    """SHA-256 hex digest of text or bytes."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def stable_chunk_id(source: str, text: str, occurrence: int = 0) -> str:
+    """
+    Deterministic vector-store id for a chunk, derived from its source path and content.
+    occurrence tells apart identical chunks within the same source.
+    """
+    return content_hash(f"{source}\0{content_hash(text)}\0{occurrence}")[:32]
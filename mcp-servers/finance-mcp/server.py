@@ -1,12 +1,26 @@
 from fastapi import FastAPI
 from fastmcp import FastMCP
 import httpx
+import numpy as np
 import os
 import logging
 import asyncio
+import base64
+import bisect
+import contextvars
+import difflib
+import functools
+import json
+import re
+import sys
+import sqlite3
+import threading
 import time
+from array import array
+from contextlib import asynccontextmanager, suppress
 from typing import Dict, Any, List
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import websockets
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -26,19 +40,34 @@ class RateLimiter:
     def __init__(self, min_interval: float = 1.0):
         self.min_interval = min_interval
         self.last_call = 0
+        self._lock = asyncio.Lock()  # keeps concurrent callers spaced out, not just sequential ones
     
     async def wait_if_needed(self):
-        now = time.time()
-        elapsed = now - self.last_call
-        if elapsed < self.min_interval:
-            await asyncio.sleep(self.min_interval - elapsed)
-        self.last_call = time.time()
+        async with self._lock:
+            now = time.time()
+            elapsed = now - self.last_call
+            if elapsed < self.min_interval:
+                await asyncio.sleep(self.min_interval - elapsed)
+            self.last_call = time.time()
+
+    async def is_idle(self, quiet_intervals: float = 2.0) -> bool:
+        """True when nobody is waiting and no call was made for `quiet_intervals` spacings."""
+        if self._lock.locked():
+            return False
+        # Read last_call under the same lock callers update it with
+        async with self._lock:
+            return time.time() - self.last_call >= self.min_interval * quiet_intervals
 
 finnhub_limiter = RateLimiter(min_interval=1.2)
 quandl_limiter = RateLimiter(min_interval=0.5)
 
+# Set while the background prefetcher refreshes an entry, so the tools go upstream
+_prefetching = contextvars.ContextVar("prefetching", default=False)
+
 def get_cached_data(key: str) -> Dict[str, Any] | None:
     """Get cached data if it exists and is still valid"""
+    if _prefetching.get():
+        return None
     if key in _cache:
         data, timestamp = _cache[key]
         if time.time() - timestamp < _cache_duration:
@@ -49,7 +78,323 @@ def cache_data(key: str, data: Dict[str, Any]):
     """Cache the data with current timestamp"""
     _cache[key] = (data, time.time())
 
+# Persistent second cache tier for slow-changing data, survives restarts and scale-out
+# Unset (the default outside Kubernetes) disables it; the deployment points it at its volume
+FINANCE_CACHE_DB = os.getenv("FINANCE_CACHE_DB", "")
+FINANCE_CACHE_COMPACT_INTERVAL = int(os.getenv("FINANCE_CACHE_COMPACT_INTERVAL", "3600"))
+PERSISTENT_CACHE_TTLS = {
+    "profile": int(os.getenv("FINANCE_CACHE_TTL_PROFILE", str(7 * 24 * 3600))),
+    "peers": int(os.getenv("FINANCE_CACHE_TTL_PEERS", str(7 * 24 * 3600))),
+    "recommendations": int(os.getenv("FINANCE_CACHE_TTL_RECOMMENDATIONS", str(24 * 3600))),
+}
+
+class PersistentCache:
+    """
+    SQLite-backed cache tier behind `_cache`. The data type is the cache key prefix
+    (e.g. "profile" for "profile_AAPL") and selects the TTL; other types are not stored.
+    """
+    def __init__(self, path: str, ttls: Dict[str, int]):
+        self.path = path
+        self.ttls = ttls
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, data: Dict[str, Any]):
+        kind = key.split("_", 1)[0]
+        ttl = self.ttls.get(kind)
+        if not ttl:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, kind, payload, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, json.dumps(data), now, now + ttl)
+            )
+
+    def load_unexpired(self) -> List[tuple]:
+        """Returns (key, data) for every row that is still valid, for warm loading."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, payload FROM cache WHERE expires_at > ?", (time.time(),)
+            ).fetchall()
+        return [(key, json.loads(payload)) for key, payload in rows]
+
+    def compact(self) -> int:
+        """Deletes expired rows and returns how many were removed."""
+        with self._lock, self._conn:
+            removed = self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        if removed:
+            with self._lock:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+persistent_cache = None  # opened by the lifespan, so importing the module creates no files
+
+def open_persistent_cache():
+    global persistent_cache
+    if not FINANCE_CACHE_DB or persistent_cache is not None:
+        return
+    try:
+        persistent_cache = PersistentCache(os.path.abspath(FINANCE_CACHE_DB), PERSISTENT_CACHE_TTLS)
+    except Exception as e:
+        logger.error(f"Persistent cache disabled, could not open {FINANCE_CACHE_DB}: {e}")
+
+async def get_tiered_data(key: str) -> Dict[str, Any] | None:
+    """Checks the in-memory cache, then the persistent tier, promoting hits into memory."""
+    data = get_cached_data(key)
+    if data is not None or persistent_cache is None or _prefetching.get():
+        return data
+    try:
+        data = await asyncio.to_thread(persistent_cache.get, key)
+    except Exception as e:
+        logger.warning(f"Persistent cache read failed for {key}: {e}")
+        return None
+    if data is not None:
+        cache_data(key, data)
+    return data
+
+async def cache_tiered_data(key: str, data: Dict[str, Any]):
+    """Caches in memory and writes through to the persistent tier."""
+    cache_data(key, data)
+    if persistent_cache is None:
+        return
+    try:
+        await asyncio.to_thread(persistent_cache.set, key, data)
+    except Exception as e:
+        logger.warning(f"Persistent cache write failed for {key}: {e}")
+
+async def warm_persistent_cache():
+    """Loads unexpired persistent rows into memory and compacts expired ones."""
+    removed = await asyncio.to_thread(persistent_cache.compact)
+    rows = await asyncio.to_thread(persistent_cache.load_unexpired)
+    for key, data in rows:
+        cache_data(key, data)
+    logger.info(f"Warm-loaded {len(rows)} cached entries from {persistent_cache.path} ({removed} expired rows removed)")
+
+async def compact_persistent_cache_periodically():
+    while True:
+        await asyncio.sleep(FINANCE_CACHE_COMPACT_INTERVAL)
+        try:
+            removed = await asyncio.to_thread(persistent_cache.compact)
+            if removed:
+                logger.info(f"Compacted persistent cache: {removed} expired rows removed")
+        except Exception as e:
+            logger.warning(f"Persistent cache compaction failed: {e}")
+
+# Optional streaming mode: last trades from the Finnhub WebSocket
+FINNHUB_STREAMING = os.getenv("FINNHUB_STREAMING", "false").lower() == "true"
+FINNHUB_WS_URL = os.getenv("FINNHUB_WS_URL", "wss://ws.finnhub.io")
+FINNHUB_STREAM_SYMBOLS = [s.strip().upper() for s in os.getenv("FINNHUB_STREAM_SYMBOLS", "").split(",") if s.strip()]
+FINNHUB_STREAM_MAX_AGE = float(os.getenv("FINNHUB_STREAM_MAX_AGE", "15"))  # seconds a trade counts as fresh
+FINNHUB_STREAM_MAX_SYMBOLS = int(os.getenv("FINNHUB_STREAM_MAX_SYMBOLS", "50"))  # free tier limit
+FINNHUB_STREAM_IDLE_EVICT = float(os.getenv("FINNHUB_STREAM_IDLE_EVICT", "900"))  # seconds before an unused slot can be reused
+
+class QuoteStream:
+    """
+    Subscribes to the Finnhub trade WebSocket and keeps the last trade per symbol.
+    The price table is a set of parallel arrays indexed by a per-symbol slot, so a
+    lookup is one dict access plus a few array reads. When the table is full, the slot of
+    a symbol nobody asked for in `idle_evict` seconds is reused; the configured symbols
+    are never evicted.
+    """
+    def __init__(self, url: str, token: str, symbols: List[str] = (), max_symbols: int = 50,
+                 idle_evict: float = FINNHUB_STREAM_IDLE_EVICT):
+        self.url = url
+        self.token = token
+        self.max_symbols = max_symbols
+        self.idle_evict = idle_evict
+        self._slots: Dict[str, int] = {}
+        self._prices = array("d")
+        self._volumes = array("d")
+        self._trade_ts = array("q")  # trade time in ms since epoch, as sent by Finnhub
+        self._updated = array("d")  # time.monotonic() of the last trade, 0 if none yet
+        self._used = array("d")  # time.monotonic() of the last subscribe or lookup
+        self._pinned = set()
+        self._ws = None
+        self._pending_sends = set()
+        for symbol in symbols:
+            self.subscribe(symbol)
+        self._pinned = set(self._slots)
+
+    @property
+    def symbols(self) -> List[str]:
+        return list(self._slots)
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None
+
+    def is_subscribed(self, symbol: str) -> bool:
+        return symbol.upper() in self._slots
+
+    def subscribe(self, symbol: str) -> bool:
+        """Adds a symbol to the watchlist, subscribing right away if connected."""
+        symbol = symbol.upper()
+        now = time.monotonic()
+        if symbol in self._slots:
+            self._used[self._slots[symbol]] = now
+            return True
+        if len(self._slots) < self.max_symbols:
+            slot = len(self._prices)
+            for column in (self._prices, self._volumes, self._updated, self._used):
+                column.append(0.0)
+            self._trade_ts.append(0)
+        else:
+            slot = self._evict_idle(now)
+            if slot is None:
+                return False
+        self._slots[symbol] = slot
+        self._used[slot] = now
+        self._send("subscribe", symbol)
+        return True
+
+    def _evict_idle(self, now: float) -> int | None:
+        """Frees the least recently used slot idle for idle_evict seconds and returns it."""
+        idle = [
+            (self._used[slot], symbol) for symbol, slot in self._slots.items()
+            if symbol not in self._pinned and now - self._used[slot] >= self.idle_evict
+        ]
+        if not idle:
+            return None
+        _, symbol = min(idle)
+        slot = self._slots.pop(symbol)
+        self._prices[slot] = self._volumes[slot] = self._updated[slot] = 0.0
+        self._trade_ts[slot] = 0
+        self._send("unsubscribe", symbol)
+        return slot
+
+    def _send(self, action: str, symbol: str):
+        if self._ws is not None:
+            task = asyncio.create_task(self._send_subscribe(self._ws, symbol, action))
+            self._pending_sends.add(task)
+            task.add_done_callback(self._pending_sends.discard)
+
+    def get(self, symbol: str, max_age: float) -> tuple | None:
+        """Returns (price, volume, trade_ts_ms) if a trade arrived within max_age seconds."""
+        slot = self._slots.get(symbol.upper())
+        if slot is None:
+            return None
+        self._used[slot] = time.monotonic()
+        updated = self._updated[slot]
+        if not updated or time.monotonic() - updated > max_age:
+            return None
+        return self._prices[slot], self._volumes[slot], self._trade_ts[slot]
+
+    def handle_message(self, message: str | bytes):
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            logger.warning(f"Ignoring malformed stream message: {message!r:.200}")
+            return
+        if not isinstance(payload, dict) or payload.get("type") != "trade":
+            return
+        trades = payload.get("data")
+        now = time.monotonic()
+        for trade in trades if isinstance(trades, list) else []:
+            if not isinstance(trade, dict):
+                continue
+            slot = self._slots.get(trade.get("s"))
+            if slot is None or trade.get("p") is None:
+                continue
+            try:
+                price, volume, trade_ts = float(trade["p"]), float(trade.get("v") or 0), int(trade.get("t") or 0)
+            except (TypeError, ValueError):
+                logger.warning(f"Ignoring malformed trade: {trade!r:.200}")
+                continue
+            self._prices[slot] = price
+            self._volumes[slot] = volume
+            self._trade_ts[slot] = trade_ts
+            self._updated[slot] = now
+
+    async def _send_subscribe(self, ws, symbol: str, action: str = "subscribe"):
+        try:
+            await ws.send(json.dumps({"type": action, "symbol": symbol}))
+        except Exception as e:
+            logger.warning(f"Failed to {action} {symbol} on quote stream: {e}")
+
+    async def run(self):
+        """Connects, subscribes the watchlist and consumes trades, reconnecting with backoff."""
+        backoff = 1.0
+        while True:
+            try:
+                async with websockets.connect(f"{self.url}?token={self.token}") as ws:
+                    self._ws = ws
+                    logger.info(f"Quote stream connected to {self.url} with {len(self._slots)} symbols")
+                    for symbol in list(self._slots):
+                        await self._send_subscribe(ws, symbol)
+                    backoff = 1.0
+                    async for message in ws:
+                        self.handle_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Quote stream disconnected: {e}")
+            finally:
+                self._ws = None
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+def quote_from_stream(symbol: str, trade: tuple, baseline: Dict[str, Any] | None) -> Dict[str, Any]:
+    """Builds a quote from a streamed trade, using the last REST quote for daily context."""
+    price, volume, trade_ts = trade
+    result = {
+        "status": "success",
+        "source": "Finnhub WebSocket",
+        "symbol": symbol.upper(),
+        "current_price": price,
+        "last_trade_volume": volume,
+        "timestamp": trade_ts // 1000
+    }
+    if baseline and baseline.get("source") == "Finnhub":
+        previous_close = baseline.get("previous_close") or 0
+        result.update({
+            "change": round(price - previous_close, 4) if previous_close else 0,
+            "change_percent": round((price - previous_close) / previous_close * 100, 4) if previous_close else 0,
+            "high": max(baseline.get("high") or price, price),
+            "low": min(baseline.get("low") or price, price),
+            "open": baseline.get("open", 0),
+            "previous_close": previous_close
+        })
+    return result
+
+def learns_symbol(tool):
+    """Counts the symbol of each successful call toward the prefetcher's learned watchlist."""
+    @functools.wraps(tool)
+    async def wrapper(symbol: str) -> dict:
+        result = await tool(symbol)
+        # Typos and delisted symbols fail upstream and are never learned
+        if isinstance(result, dict) and result.get("status") == "success":
+            prefetcher.record(symbol)
+        return result
+    return wrapper
+
+quote_stream = None
+if FINNHUB_STREAMING and os.getenv("FINNHUB_API_KEY"):
+    quote_stream = QuoteStream(
+        FINNHUB_WS_URL,
+        os.getenv("FINNHUB_API_KEY"),
+        FINNHUB_STREAM_SYMBOLS,
+        max_symbols=FINNHUB_STREAM_MAX_SYMBOLS
+    )
+
 @mcp.tool()
+@learns_symbol
 async def get_stock_quote(symbol: str) -> dict:
     """
     Fetches real-time stock quote from Finnhub with Quandl fallback.
@@ -59,6 +404,12 @@ async def get_stock_quote(symbol: str) -> dict:
         A dictionary containing stock quote data.
     """
     cache_key = f"quote_{symbol.upper()}"
+    if quote_stream is not None:
+        trade = quote_stream.get(symbol, FINNHUB_STREAM_MAX_AGE)
+        if trade:
+            baseline = _cache.get(cache_key, (None, 0))[0]
+            return quote_from_stream(symbol, trade, baseline)
+
     cached_data = get_cached_data(cache_key)
     if cached_data:
         logger.info(f"Returning cached quote for {symbol}")
@@ -94,6 +445,9 @@ async def get_stock_quote(symbol: str) -> dict:
                         "timestamp": quote_data.get("t", 0)
                     }
                     cache_data(cache_key, result)
+                    # Grow the watchlist with symbols Finnhub knows (it answers unknown ones with 0)
+                    if quote_stream is not None and result["current_price"]:
+                        quote_stream.subscribe(symbol)
                     return result
                     
         except Exception as e:
@@ -139,6 +493,7 @@ async def get_stock_quote(symbol: str) -> dict:
     }
 
 @mcp.tool()
+@learns_symbol
 async def get_company_profile(symbol: str) -> dict:
     """
     Fetches company profile information from Finnhub.
@@ -148,7 +503,7 @@ async def get_company_profile(symbol: str) -> dict:
         A dictionary containing company profile data.
     """
     cache_key = f"profile_{symbol.upper()}"
-    cached_data = get_cached_data(cache_key)
+    cached_data = await get_tiered_data(cache_key)
     if cached_data:
         return cached_data
     
@@ -183,7 +538,7 @@ async def get_company_profile(symbol: str) -> dict:
                     "phone": profile_data.get("phone"),
                     "ipo_date": profile_data.get("ipo")
                 }
-                cache_data(cache_key, result)
+                await cache_tiered_data(cache_key, result)
                 return result
             else:
                 return {"status": "error", "message": f"No profile data found for {symbol}"}
@@ -192,7 +547,48 @@ async def get_company_profile(symbol: str) -> dict:
         logger.error(f"Error fetching profile for {symbol}: {e}")
         return {"status": "error", "message": f"Error fetching profile: {e}"}
 
+def _round(value, digits: int = 4):
+    return None if value is None or not np.isfinite(value) else round(float(value), digits)
+
+class MetricsTable:
+    """
+    Columnar copy of the metrics parsed by get_stock_metrics: one row per symbol,
+    one float64 column per metric (NaN when missing), grown by doubling.
+    """
+    def __init__(self, capacity: int = 64):
+        self.columns: Dict[str, int] = {}
+        self.rows: Dict[str, int] = {}
+        self.values = np.full((capacity, 0), np.nan)
+        self.updated = np.zeros(capacity)
+
+    def upsert(self, symbol: str, result: Dict[str, Any]):
+        flat = {name: value for group in result.values() if isinstance(group, dict) for name, value in group.items()}
+        new_columns = [name for name in flat if name not in self.columns]
+        if new_columns:
+            for name in new_columns:
+                self.columns[name] = len(self.columns)
+            self.values = np.hstack([self.values, np.full((self.values.shape[0], len(new_columns)), np.nan)])
+        row = self.rows.get(symbol)
+        if row is None:
+            row = len(self.rows)
+            if row == self.values.shape[0]:
+                self.values = np.vstack([self.values, np.full_like(self.values, np.nan)])
+                self.updated = np.concatenate([self.updated, np.zeros_like(self.updated)])
+            self.rows[symbol] = row
+        self.values[row, :] = np.nan
+        for name, value in flat.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.values[row, self.columns[name]] = value
+        self.updated[row] = time.time()
+
+    def is_fresh(self, symbol: str, max_age: float) -> bool:
+        row = self.rows.get(symbol)
+        return row is not None and time.time() - self.updated[row] < max_age
+
+metrics_table = MetricsTable()
+
 @mcp.tool()
+@learns_symbol
 async def get_stock_metrics(symbol: str) -> dict:
     """
     Fetches comprehensive financial metrics from Finnhub.
@@ -269,6 +665,7 @@ async def get_stock_metrics(symbol: str) -> dict:
                     }
                 }
                 cache_data(cache_key, result)
+                metrics_table.upsert(symbol.upper(), result)
                 return result
             else:
                 return {"status": "error", "message": f"No metrics data found for {symbol}"}
@@ -277,148 +674,298 @@ async def get_stock_metrics(symbol: str) -> dict:
         logger.error(f"Error fetching metrics for {symbol}: {e}")
         return {"status": "error", "message": f"Error fetching metrics: {e}"}
 
+_filter_re = re.compile(r"^\s*([A-Za-z0-9_]+)\s*(<=|>=|==|!=|<|>)\s*(-?\d+(?:\.\d+)?(?:[eE]-?\d+)?)\s*$")
+_filter_ops = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal, "==": np.equal, "!=": np.not_equal}
+
+def _percentiles(column: np.ndarray) -> np.ndarray:
+    """Percentile rank (0-100) of each value among the non-NaN values of the column; ties share their mean rank."""
+    result = np.full(column.shape, np.nan)
+    valid = ~np.isnan(column)
+    count = int(valid.sum())
+    if count == 1:
+        result[valid] = 50.0
+    elif count > 1:
+        values = column[valid]
+        ordered = np.sort(values)
+        ranks = (np.searchsorted(ordered, values, "left") + np.searchsorted(ordered, values, "right") - 1) / 2
+        result[valid] = ranks / (count - 1) * 100
+    return result
+
+@mcp.tool()
+async def screen_stocks(
+    symbols: List[str] | None = None,
+    peers_of: str | None = None,
+    filters: List[str] | None = None,
+    rank_by: List[str] | None = None,
+    fields: List[str] | None = None,
+    top_n: int = 5
+) -> dict:
+    """
+    Screens and ranks several stocks at once on the metrics from get_stock_metrics
+    (e.g. pe_ratio, return_on_equity, net_margin, debt_to_equity, beta, dividend_yield).
+    Args:
+        symbols: Stock ticker symbols to screen (max 50).
+        peers_of: Screen this symbol together with its Finnhub peers instead of (or in addition to) `symbols`.
+        filters: Conditions such as "pe_ratio < 30" or "return_on_equity >= 20".
+        rank_by: Ranking criteria such as "pe_ratio:asc" or "return_on_equity:desc"; rows are ordered by their mean percentile score.
+        fields: Extra metric fields to include in each row.
+        top_n: Number of rows to return.
+    Returns:
+        A dictionary containing the top rows with the requested metrics and percentiles.
+    """
+    universe = [s.upper() for s in symbols or []]
+    if peers_of:
+        peers = await get_stock_peers(peers_of)
+        if peers.get("status") != "success":
+            return peers
+        universe = [peers_of.upper()] + [p.upper() for p in peers["peers"]] + universe
+    universe = list(dict.fromkeys(universe))[:50]
+    if not universe:
+        return {"status": "error", "message": "Provide `symbols` or `peers_of`."}
+
+    # Fill symbols that are not in the table yet; the Finnhub limiter spaces the calls
+    missing = [s for s in universe if not metrics_table.is_fresh(s, _cache_duration)]
+    if missing:
+        outcomes = await asyncio.gather(*(get_stock_metrics(s) for s in missing), return_exceptions=True)
+        for symbol, outcome in zip(missing, outcomes):
+            if isinstance(outcome, Exception):
+                logger.warning(f"Screener could not fetch metrics for {symbol}: {outcome}")
+    failed = [s for s in universe if s not in metrics_table.rows]
+    universe = [s for s in universe if s in metrics_table.rows]
+    if not universe:
+        return {"status": "error", "message": "No metrics available for the requested symbols.", "failed": failed}
+
+    parsed_filters = []
+    for expression in filters or []:
+        match = _filter_re.match(expression)
+        if not match:
+            return {"status": "error", "message": f"Invalid filter '{expression}'. Use e.g. 'pe_ratio < 30'."}
+        parsed_filters.append((match.group(1), match.group(2), float(match.group(3))))
+    parsed_ranks = []
+    for criterion in rank_by or []:
+        name, _, direction = criterion.partition(":")
+        direction = (direction or "desc").strip().lower()
+        if direction not in ("asc", "desc"):
+            return {"status": "error", "message": f"Invalid rank direction in '{criterion}'. Use asc or desc."}
+        parsed_ranks.append((name.strip(), direction))
+
+    referenced = [name for name, _, _ in parsed_filters] + [name for name, _ in parsed_ranks] + list(fields or [])
+    unknown = sorted({name for name in referenced if name not in metrics_table.columns})
+    if unknown:
+        return {"status": "error", "message": f"Unknown fields {unknown}.", "available_fields": sorted(metrics_table.columns)}
+
+    table = metrics_table.values[[metrics_table.rows[s] for s in universe]]
+    column = lambda name: table[:, metrics_table.columns[name]]
+
+    # Percentiles are relative to the whole universe, not only the rows passing the filters
+    score_parts = []
+    percentiles = {}
+    for name, direction in parsed_ranks:
+        percentiles[name] = _percentiles(column(name))
+        score_parts.append(percentiles[name] if direction == "desc" else 100 - percentiles[name])
+    with np.errstate(invalid="ignore"):
+        mask = np.ones(len(universe), dtype=bool)
+        for name, op, value in parsed_filters:
+            mask &= _filter_ops[op](column(name), value)
+        if score_parts:
+            stacked = np.vstack(score_parts)
+            counts = (~np.isnan(stacked)).sum(axis=0)
+            scores = np.where(counts > 0, np.nansum(stacked, axis=0) / np.maximum(counts, 1), np.nan)
+        else:
+            scores = np.zeros(len(universe))
+
+    candidates = np.flatnonzero(mask)
+    # NaN scores (no data for any rank field) sort last
+    order = candidates[np.argsort(np.where(np.isnan(scores[candidates]), -np.inf, -scores[candidates]), kind="stable")]
+    shown = list(dict.fromkeys(referenced))
+    rows = []
+    for i in order[:max(1, top_n)]:
+        row = {"symbol": universe[i]}
+        if score_parts:
+            row["score"] = _round(scores[i], 2)
+        row.update({name: _round(column(name)[i]) for name in shown})
+        if percentiles:
+            row["percentiles"] = {name: _round(values[i], 1) for name, values in percentiles.items()}
+        rows.append(row)
+
+    return {
+        "status": "success",
+        "universe_size": len(universe),
+        "matched": int(len(candidates)),
+        "rows": rows,
+        "failed": failed
+    }
+
+# One normalized list per symbol/category is cached; limit, cursor and fields are applied per call
+ARTICLE_FIELDS = ("id", "headline", "summary", "url", "source", "datetime", "category", "image", "related")
+RECOMMENDATION_FIELDS = ("period", "strong_buy", "buy", "hold", "sell", "strong_sell", "total_analysts")
+
+def _normalize_articles(news_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keeps the known article fields, drops duplicate URLs and sorts newest first."""
+    articles = {}
+    for article in news_data:
+        normalized = {field: article.get(field, 0 if field in ("id", "datetime") else "") for field in ARTICLE_FIELDS}
+        articles.setdefault(normalized["url"] or normalized["id"], normalized)
+    return sorted(articles.values(), key=lambda a: (a["datetime"], a["id"]), reverse=True)
+
+PAGE_LIMIT_MAX = 50
+
+def _encode_cursor(position: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def _decode_cursor(cursor: str, like: list) -> list:
+    """Decodes a cursor, checking it has the shape of `like`, a sort key of the paginated list."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    numeric = (int, float)
+    if not isinstance(position, list) or len(position) != len(like) or not all(
+        isinstance(value, numeric) and not isinstance(value, bool) if isinstance(expected, numeric) else type(value) is type(expected)
+        for value, expected in zip(position, like)
+    ):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return position
+
+def paginate(items: List[Dict[str, Any]], sort_key, limit: int, cursor: str | None = None, fields: List[str] | None = None) -> tuple:
+    """
+    Returns (page, next_cursor) from a list sorted descending by `sort_key`, with `limit`
+    clamped to 1..PAGE_LIMIT_MAX. The cursor encodes the sort key of the last item returned,
+    so pages stay consistent when newer items are added to the cached list in between.
+    Raises ValueError for a cursor this list did not produce.
+    """
+    limit = max(1, min(limit, PAGE_LIMIT_MAX))
+    start = 0
+    if cursor and items:
+        after = _decode_cursor(cursor, sort_key(items[0]))
+        start = next((i for i, item in enumerate(items) if sort_key(item) < after), len(items))
+    page = items[start:start + limit]
+    next_cursor = _encode_cursor(sort_key(page[-1])) if page and start + limit < len(items) else None
+    if fields:
+        page = [{field: item.get(field) for field in fields} for item in page]
+    return page, next_cursor
+
+def _article_key(article: Dict[str, Any]) -> list:
+    return [article["datetime"], article["id"]]
+
+def _invalid_fields(fields: List[str] | None, allowed: tuple) -> Dict[str, Any] | None:
+    unknown = sorted(set(fields or []) - set(allowed))
+    if unknown:
+        return {"status": "error", "message": f"Unknown fields {unknown}. Available fields: {list(allowed)}"}
+    return None
+
+async def _fetch_articles(cache_key: str, url: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Returns the cached normalized article list, fetching it from Finnhub on a miss."""
+    cached_data = get_cached_data(cache_key)
+    if cached_data:
+        return cached_data["articles"]
+
+    await finnhub_limiter.wait_if_needed()
+    async with httpx.AsyncClient(timeout=15.0) as client:
+        response = await client.get(url, params=params)
+        response.raise_for_status()
+        news_data = response.json()
+
+    articles = _normalize_articles(news_data) if isinstance(news_data, list) else []
+    cache_data(cache_key, {"articles": articles})
+    return articles
+
 @mcp.tool()
-async def get_stock_news(symbol: str, limit: int = 20) -> dict:
+async def get_stock_news(symbol: str, limit: int = 20, cursor: str | None = None, fields: List[str] | None = None) -> dict:
     """
     Fetches recent news for a stock from Finnhub.
     Args:
         symbol: The stock ticker symbol.
         limit: Number of news articles to return (max 50).
+        cursor: `next_cursor` from a previous call, to fetch the next page.
+        fields: Article fields to return (id, headline, summary, url, source, datetime, category, image, related). All by default.
     Returns:
         A dictionary containing recent news articles.
     """
-    cache_key = f"news_{symbol.upper()}_{limit}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
-        return cached_data
-    
+    invalid = _invalid_fields(fields, ARTICLE_FIELDS)
+    if invalid:
+        return invalid
+
     finnhub_key = os.getenv("FINNHUB_API_KEY")
     if not finnhub_key:
         return {"status": "error", "message": "FINNHUB_API_KEY not found"}
     
-    await finnhub_limiter.wait_if_needed()
-    
     # Get date range (last 30 days)
     end_date = datetime.now()
     start_date = end_date - timedelta(days=30)
     
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(
-                "https://finnhub.io/api/v1/company-news",
-                params={
-                    "symbol": symbol,
-                    "from": start_date.strftime("%Y-%m-%d"),
-                    "to": end_date.strftime("%Y-%m-%d"),
-                    "token": finnhub_key
-                }
-            )
-            response.raise_for_status()
-            news_data = response.json()
-            
-            if isinstance(news_data, list):
-                limited_news = news_data[:min(limit, len(news_data))]
-                
-                formatted_news = []
-                for article in limited_news:
-                    formatted_news.append({
-                        "headline": article.get("headline", ""),
-                        "summary": article.get("summary", ""),
-                        "url": article.get("url", ""),
-                        "source": article.get("source", ""),
-                        "datetime": article.get("datetime", 0),
-                        "category": article.get("category", ""),
-                        "image": article.get("image", "")
-                    })
-                
-                result = {
-                    "status": "success",
-                    "symbol": symbol.upper(),
-                    "news_count": len(formatted_news),
-                    "articles": formatted_news
-                }
-                cache_data(cache_key, result)
-                return result
-            else:
-                return {
-                    "status": "success",
-                    "symbol": symbol.upper(),
-                    "news_count": 0,
-                    "articles": []
-                }
-                
+        articles = await _fetch_articles(
+            f"news_{symbol.upper()}",
+            "https://finnhub.io/api/v1/company-news",
+            {
+                "symbol": symbol,
+                "from": start_date.strftime("%Y-%m-%d"),
+                "to": end_date.strftime("%Y-%m-%d"),
+                "token": finnhub_key
+            }
+        )
     except Exception as e:
         logger.error(f"Error fetching news for {symbol}: {e}")
         return {"status": "error", "message": f"Error fetching news: {e}"}
 
+    try:
+        page, next_cursor = paginate(articles, _article_key, limit, cursor, fields)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    return {
+        "status": "success",
+        "symbol": symbol.upper(),
+        "news_count": len(page),
+        "articles": page,
+        "next_cursor": next_cursor
+    }
+
 @mcp.tool()
-async def get_market_news(category: str = "general", limit: int = 20) -> dict:
+async def get_market_news(category: str = "general", limit: int = 20, cursor: str | None = None, fields: List[str] | None = None) -> dict:
     """
     Fetches general market news from Finnhub.
     Args:
         category: News category (general, forex, crypto, merger).
-        limit: Number of news articles to return.
+        limit: Number of news articles to return (max 50).
+        cursor: `next_cursor` from a previous call, to fetch the next page.
+        fields: Article fields to return (id, headline, summary, url, source, datetime, category, image, related). All by default.
     Returns:
         A dictionary containing market news.
     """
-    cache_key = f"market_news_{category}_{limit}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
-        return cached_data
-    
+    invalid = _invalid_fields(fields, ARTICLE_FIELDS)
+    if invalid:
+        return invalid
+
     finnhub_key = os.getenv("FINNHUB_API_KEY")
     if not finnhub_key:
         return {"status": "error", "message": "FINNHUB_API_KEY not found"}
     
-    await finnhub_limiter.wait_if_needed()
-    
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(
-                "https://finnhub.io/api/v1/news",
-                params={
-                    "category": category,
-                    "token": finnhub_key
-                }
-            )
-            response.raise_for_status()
-            news_data = response.json()
-            
-            if isinstance(news_data, list):
-                limited_news = news_data[:min(limit, len(news_data))]
-                
-                formatted_news = []
-                for article in limited_news:
-                    formatted_news.append({
-                        "headline": article.get("headline", ""),
-                        "summary": article.get("summary", ""),
-                        "url": article.get("url", ""),
-                        "source": article.get("source", ""),
-                        "datetime": article.get("datetime", 0),
-                        "category": article.get("category", ""),
-                        "image": article.get("image", "")
-                    })
-                
-                result = {
-                    "status": "success",
-                    "category": category,
-                    "news_count": len(formatted_news),
-                    "articles": formatted_news
-                }
-                cache_data(cache_key, result)
-                return result
-            else:
-                return {
-                    "status": "success",
-                    "category": category,
-                    "news_count": 0,
-                    "articles": []
-                }
-                
+        articles = await _fetch_articles(
+            f"market_news_{category.lower()}",
+            "https://finnhub.io/api/v1/news",
+            {
+                "category": category,
+                "token": finnhub_key
+            }
+        )
     except Exception as e:
         logger.error(f"Error fetching market news: {e}")
         return {"status": "error", "message": f"Error fetching market news: {e}"}
 
+    try:
+        page, next_cursor = paginate(articles, _article_key, limit, cursor, fields)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    return {
+        "status": "success",
+        "category": category,
+        "news_count": len(page),
+        "articles": page,
+        "next_cursor": next_cursor
+    }
+
 @mcp.tool()
 async def get_stock_peers(symbol: str) -> dict:
     """
@@ -429,7 +976,7 @@ async def get_stock_peers(symbol: str) -> dict:
         A dictionary containing peer companies.
     """
     cache_key = f"peers_{symbol.upper()}"
-    cached_data = get_cached_data(cache_key)
+    cached_data = await get_tiered_data(cache_key)
     if cached_data:
         return cached_data
     
@@ -455,7 +1002,7 @@ async def get_stock_peers(symbol: str) -> dict:
                     "peers": peers_data,
                     "peer_count": len(peers_data)
                 }
-                cache_data(cache_key, result)
+                await cache_tiered_data(cache_key, result)
                 return result
             else:
                 return {"status": "error", "message": f"No peers data found for {symbol}"}
@@ -465,64 +1012,73 @@ async def get_stock_peers(symbol: str) -> dict:
         return {"status": "error", "message": f"Error fetching peers: {e}"}
 
 @mcp.tool()
-async def get_stock_recommendations(symbol: str) -> dict:
+async def get_stock_recommendations(symbol: str, limit: int = 12, cursor: str | None = None, fields: List[str] | None = None) -> dict:
     """
     Fetches analyst recommendations for a stock from Finnhub.
     Args:
         symbol: The stock ticker symbol.
+        limit: Number of historical periods to return in `historical_data` (max 50).
+        cursor: `next_cursor` from a previous call, to fetch older periods.
+        fields: Period fields to return (period, strong_buy, buy, hold, sell, strong_sell, total_analysts). All by default.
     Returns:
         A dictionary containing analyst recommendations.
     """
+    invalid = _invalid_fields(fields, RECOMMENDATION_FIELDS)
+    if invalid:
+        return invalid
+
     cache_key = f"recommendations_{symbol.upper()}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
-        return cached_data
-    
-    finnhub_key = os.getenv("FINNHUB_API_KEY")
-    if not finnhub_key:
-        return {"status": "error", "message": "FINNHUB_API_KEY not found"}
-    
-    await finnhub_limiter.wait_if_needed()
+    cached_data = await get_tiered_data(cache_key)
+    periods = cached_data.get("periods") if cached_data else None
     
+    if periods is None:
+        finnhub_key = os.getenv("FINNHUB_API_KEY")
+        if not finnhub_key:
+            return {"status": "error", "message": "FINNHUB_API_KEY not found"}
+        
+        await finnhub_limiter.wait_if_needed()
+        
+        try:
+            async with httpx.AsyncClient(timeout=15.0) as client:
+                response = await client.get(
+                    "https://finnhub.io/api/v1/stock/recommendation",
+                    params={"symbol": symbol, "token": finnhub_key}
+                )
+                response.raise_for_status()
+                rec_data = response.json()
+        except Exception as e:
+            logger.error(f"Error fetching recommendations for {symbol}: {e}")
+            return {"status": "error", "message": f"Error fetching recommendations: {e}"}
+
+        if not isinstance(rec_data, list) or len(rec_data) == 0:
+            return {"status": "error", "message": f"No recommendations data found for {symbol}"}
+
+        periods = []
+        for rec in rec_data:
+            counts = {
+                "strong_buy": rec.get("strongBuy", 0),
+                "buy": rec.get("buy", 0),
+                "hold": rec.get("hold", 0),
+                "sell": rec.get("sell", 0),
+                "strong_sell": rec.get("strongSell", 0)
+            }
+            periods.append({"period": rec.get("period") or "", **counts, "total_analysts": sum(counts.values())})
+        periods.sort(key=lambda p: p["period"], reverse=True)
+        await cache_tiered_data(cache_key, {"periods": periods})
+
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(
-                "https://finnhub.io/api/v1/stock/recommendation",
-                params={"symbol": symbol, "token": finnhub_key}
-            )
-            response.raise_for_status()
-            rec_data = response.json()
-            
-            if isinstance(rec_data, list) and len(rec_data) > 0:
-                # Get the most recent recommendation
-                latest_rec = rec_data[0]
-                
-                result = {
-                    "status": "success",
-                    "symbol": symbol.upper(),
-                    "period": latest_rec.get("period"),
-                    "strong_buy": latest_rec.get("strongBuy", 0),
-                    "buy": latest_rec.get("buy", 0),
-                    "hold": latest_rec.get("hold", 0),
-                    "sell": latest_rec.get("sell", 0),
-                    "strong_sell": latest_rec.get("strongSell", 0),
-                    "total_analysts": (
-                        latest_rec.get("strongBuy", 0) + 
-                        latest_rec.get("buy", 0) + 
-                        latest_rec.get("hold", 0) + 
-                        latest_rec.get("sell", 0) + 
-                        latest_rec.get("strongSell", 0)
-                    ),
-                    "historical_data": rec_data
-                }
-                cache_data(cache_key, result)
-                return result
-            else:
-                return {"status": "error", "message": f"No recommendations data found for {symbol}"}
-                
-    except Exception as e:
-        logger.error(f"Error fetching recommendations for {symbol}: {e}")
-        return {"status": "error", "message": f"Error fetching recommendations: {e}"}
+        page, next_cursor = paginate(periods, lambda p: [p["period"]], limit, cursor, fields)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+    # Summary fields describe the most recent period
+    return {
+        "status": "success",
+        "symbol": symbol.upper(),
+        **periods[0],
+        "historical_data": page,
+        "next_cursor": next_cursor
+    }
 
 @mcp.tool()
 async def get_market_status() -> dict:
@@ -566,6 +1122,170 @@ async def get_market_status() -> dict:
         logger.error(f"Error fetching market status: {e}")
         return {"status": "error", "message": f"Error fetching market status: {e}"}
 
+# Historical candles: columnar OHLCV arrays per (symbol, resolution), filled incrementally
+CANDLE_RESOLUTION_SECONDS = {"1": 60, "5": 300, "15": 900, "30": 1800, "60": 3600, "D": 86400, "W": 604800, "M": 2592000}
+# Seconds after which the last, possibly still forming, candle is fetched again
+CANDLE_TAIL_REFRESH = int(os.getenv("FINANCE_CANDLE_TAIL_REFRESH", "60"))
+CANDLE_PERIODS_PER_YEAR = {"1": 252 * 390, "5": 252 * 78, "15": 252 * 26, "30": 252 * 13, "60": 252 * 7, "D": 252, "W": 52, "M": 12}
+
+class CandleSeries:
+    """OHLCV columns sorted by timestamp plus the [start, end] range already fetched from upstream."""
+    __slots__ = ("t", "o", "h", "l", "c", "v", "start", "end")
+
+    def __init__(self):
+        self.t = np.empty(0, dtype=np.int64)
+        self.o = self.h = self.l = self.c = self.v = np.empty(0, dtype=np.float64)
+        self.start = self.end = None
+
+    def missing_ranges(self, start: int, end: int, min_gap: int, refresh: int = CANDLE_TAIL_REFRESH) -> List[tuple]:
+        if self.start is None:
+            return [(start, end)]
+        ranges = []
+        if start < self.start - min_gap:
+            ranges.append((start, self.start))
+        if end > self.end + min_gap or end - self.end >= refresh:
+            # Start at the last stored candle, which was still forming when it was fetched
+            tail = int(self.t[-1]) if len(self.t) else self.end
+            ranges.append((min(tail, self.end), end))
+        return ranges
+
+    def merge(self, data: Dict[str, Any], start: int, end: int):
+        """Adds an upstream candle payload; rows for known timestamps are replaced by the new ones."""
+        if data.get("s") == "ok" and data.get("t"):
+            columns = {
+                name: np.concatenate([np.asarray(data[name], dtype=getattr(self, name).dtype), getattr(self, name)])
+                for name in ("t", "o", "h", "l", "c", "v")
+            }
+            # np.unique keeps the first occurrence, i.e. the freshly fetched row
+            _, keep = np.unique(columns["t"], return_index=True)
+            for name, column in columns.items():
+                setattr(self, name, column[keep])
+        self.start = start if self.start is None else min(self.start, start)
+        self.end = end if self.end is None else max(self.end, end)
+
+    def window(self, start: int, end: int) -> slice:
+        return slice(np.searchsorted(self.t, start, "left"), np.searchsorted(self.t, end, "right"))
+
+_candle_store: Dict[tuple, CandleSeries] = {}
+
+def _ema_last(values: np.ndarray, alpha: float) -> float:
+    """Last value of an EMA seeded with the first observation, as one weighted dot product."""
+    n = len(values)
+    weights = alpha * (1 - alpha) ** np.arange(n - 1, -1, -1, dtype=np.float64)
+    weights[0] = (1 - alpha) ** (n - 1)
+    return float(weights @ values)
+
+def _rsi(close: np.ndarray, period: int = 14) -> float | None:
+    if len(close) <= period:
+        return None
+    delta = np.diff(close)
+    # Wilder's smoothing is an EMA with alpha = 1/period
+    avg_gain = _ema_last(np.clip(delta, 0, None), 1 / period)
+    avg_loss = _ema_last(np.clip(-delta, 0, None), 1 / period)
+    if avg_loss == 0:
+        return 100.0
+    return 100 - 100 / (1 + avg_gain / avg_loss)
+
+def summarize_candles(t: np.ndarray, o: np.ndarray, h: np.ndarray, l: np.ndarray, c: np.ndarray, v: np.ndarray, resolution: str) -> Dict[str, Any]:
+    """Computes compact price, indicator, return and risk statistics over candle columns."""
+    def iso(ts) -> str:
+        return datetime.fromtimestamp(int(ts), tz=timezone.utc).strftime("%Y-%m-%d %H:%M" if resolution not in ("D", "W", "M") else "%Y-%m-%d")
+
+    returns = np.diff(c) / c[:-1] if len(c) > 1 else np.empty(0)
+    running_peak = np.maximum.accumulate(c)
+    drawdowns = c / running_peak - 1
+    trough = int(np.argmin(drawdowns))
+    peak = int(np.argmax(c[:trough + 1]))
+    return {
+        "from": iso(t[0]),
+        "to": iso(t[-1]),
+        "candles": int(len(c)),
+        "open": _round(o[0]),
+        "close": _round(c[-1]),
+        "high": _round(h.max()),
+        "low": _round(l.min()),
+        "average_volume": _round(v.mean(), 0),
+        "indicators": {
+            "sma_20": _round(c[-20:].mean()) if len(c) >= 20 else None,
+            "sma_50": _round(c[-50:].mean()) if len(c) >= 50 else None,
+            "ema_20": _round(_ema_last(c, 2 / 21)),
+            "rsi_14": _round(_rsi(c), 2)
+        },
+        "returns": {
+            "total_return": _round(c[-1] / c[0] - 1),
+            "mean_period_return": _round(returns.mean()) if len(returns) else None,
+            "best_period_return": _round(returns.max()) if len(returns) else None,
+            "worst_period_return": _round(returns.min()) if len(returns) else None
+        },
+        "risk": {
+            "volatility_period": _round(returns.std(ddof=1)) if len(returns) > 1 else None,
+            "volatility_annualized": _round(returns.std(ddof=1) * np.sqrt(CANDLE_PERIODS_PER_YEAR[resolution])) if len(returns) > 1 else None,
+            "max_drawdown": _round(drawdowns[trough]),
+            "max_drawdown_peak": iso(t[peak]),
+            "max_drawdown_trough": iso(t[trough])
+        }
+    }
+
+@mcp.tool()
+async def get_stock_candles(symbol: str, resolution: str = "D", days: int = 90) -> dict:
+    """
+    Summarizes historical OHLCV candles with indicators (SMA, EMA, RSI), returns,
+    volatility and max drawdown instead of returning raw rows.
+    Args:
+        symbol: The stock ticker symbol.
+        resolution: Candle size: 1, 5, 15, 30, 60 (minutes), D, W or M.
+        days: How many days of history to cover (max 3650).
+    Returns:
+        A dictionary containing the candle summary.
+    """
+    resolution = resolution.upper()
+    if resolution not in CANDLE_RESOLUTION_SECONDS:
+        return {"status": "error", "message": f"Unsupported resolution '{resolution}'. Use one of {list(CANDLE_RESOLUTION_SECONDS)}"}
+
+    end = int(time.time())
+    start = end - max(1, min(days, 3650)) * 86400
+    series = _candle_store.setdefault((symbol.upper(), resolution), CandleSeries())
+    missing = series.missing_ranges(start, end, min_gap=CANDLE_RESOLUTION_SECONDS[resolution])
+
+    if missing:
+        finnhub_key = os.getenv("FINNHUB_API_KEY")
+        if not finnhub_key:
+            return {"status": "error", "message": "FINNHUB_API_KEY not found"}
+        try:
+            async with httpx.AsyncClient(timeout=15.0) as client:
+                for range_start, range_end in missing:
+                    await finnhub_limiter.wait_if_needed()
+                    response = await client.get(
+                        "https://finnhub.io/api/v1/stock/candle",
+                        params={
+                            "symbol": symbol.upper(),
+                            "resolution": resolution,
+                            "from": range_start,
+                            "to": range_end,
+                            "token": finnhub_key
+                        }
+                    )
+                    response.raise_for_status()
+                    series.merge(response.json(), range_start, range_end)
+        except Exception as e:
+            logger.error(f"Error fetching candles for {symbol}: {e}")
+            return {"status": "error", "message": f"Error fetching candles: {e}"}
+
+    window = series.window(start, end)
+    if window.stop - window.start < 2:
+        return {"status": "error", "message": f"No candle data found for {symbol} at resolution {resolution}"}
+
+    return {
+        "status": "success",
+        "symbol": symbol.upper(),
+        "resolution": resolution,
+        "fetched_ranges": len(missing),
+        **summarize_candles(
+            series.t[window], series.o[window], series.h[window],
+            series.l[window], series.c[window], series.v[window], resolution
+        )
+    }
+
 @mcp.tool()
 async def get_multiple_stocks(symbols: List[str]) -> dict:
     """
@@ -595,24 +1315,206 @@ async def get_multiple_stocks(symbols: List[str]) -> dict:
         "total_symbols": len(symbols)
     }
 
+# Local symbol index so most searches resolve in-process
+FINANCE_SYMBOL_INDEX = os.getenv("FINANCE_SYMBOL_INDEX", "true").lower() == "true"
+FINANCE_SYMBOL_EXCHANGES = [e.strip() for e in os.getenv("FINANCE_SYMBOL_EXCHANGES", "US").split(",") if e.strip()]
+FINANCE_SYMBOL_INDEX_REFRESH = int(os.getenv("FINANCE_SYMBOL_INDEX_REFRESH", str(24 * 3600)))
+# Local matches scoring below this (fuzzy name matches) defer to Finnhub's /search
+FINANCE_SYMBOL_INDEX_MIN_SCORE = float(os.getenv("FINANCE_SYMBOL_INDEX_MIN_SCORE", "60"))
+
+_token_re = re.compile(r"[a-z0-9]+")
+
+def _deep_sizeof(obj, seen=None) -> int:
+    """Approximate retained size of nested built-in containers, in bytes."""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_deep_sizeof(item, seen) for item in obj)
+    return size
+
+class SymbolIndex:
+    """
+    Immutable in-memory index over an exchange symbol list.
+    Tickers and company-name tokens are kept in sorted tuples for bisect prefix
+    lookups; fuzzy name matching only scans tokens sharing the query's first letter.
+    """
+    def __init__(self, entries: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        rows = sorted(
+            {e["symbol"].upper(): e for e in entries if e.get("symbol")}.values(),
+            key=lambda e: e["symbol"].upper()
+        )
+        self.symbols = tuple(e["symbol"].upper() for e in rows)
+        self.descriptions = tuple(e.get("description", "") for e in rows)
+        self.display_symbols = tuple(e.get("displaySymbol", "") for e in rows)
+        self.types = tuple(e.get("type", "") for e in rows)
+        self._exact = {symbol: i for i, symbol in enumerate(self.symbols)}
+        for i, display in enumerate(self.display_symbols):
+            self._exact.setdefault(display.upper(), i)
+
+        pairs = sorted(
+            (sys.intern(token), i)
+            for i, description in enumerate(self.descriptions)
+            for token in set(_token_re.findall(description.lower()))
+        )
+        self._name_tokens = tuple(token for token, _ in pairs)
+        self._name_rows = array("I", (i for _, i in pairs))
+        self._unique_tokens = tuple(sorted(set(self._name_tokens)))
+
+        self.build_seconds = time.perf_counter() - started
+        seen = set()
+        self.memory_bytes = sum(_deep_sizeof(part, seen) for part in (
+            self.symbols, self.descriptions, self.display_symbols, self.types,
+            self._exact, self._name_tokens, self._name_rows, self._unique_tokens
+        ))
+        self.built_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def _ticker_prefix(self, prefix: str) -> range:
+        lo = bisect.bisect_left(self.symbols, prefix)
+        hi = bisect.bisect_left(self.symbols, prefix + "\uffff")
+        return range(lo, hi)
+
+    def _rows_for_token_prefix(self, prefix: str) -> set:
+        lo = bisect.bisect_left(self._name_tokens, prefix)
+        hi = bisect.bisect_left(self._name_tokens, prefix + "\uffff")
+        return set(self._name_rows[lo:hi])
+
+    def _fuzzy_rows(self, token: str) -> tuple[set, float]:
+        lo = bisect.bisect_left(self._unique_tokens, token[0])
+        hi = bisect.bisect_left(self._unique_tokens, token[0] + "\uffff")
+        matches = difflib.get_close_matches(token, self._unique_tokens[lo:hi], n=3, cutoff=0.75)
+        rows = set()
+        for match in matches:
+            lo = bisect.bisect_left(self._name_tokens, match)
+            hi = bisect.bisect_right(self._name_tokens, match)
+            rows.update(self._name_rows[lo:hi])
+        ratio = difflib.SequenceMatcher(None, token, matches[0]).ratio() if matches else 0.0
+        return rows, ratio
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Exact ticker, ticker prefix, company-name prefix and fuzzy name matches, best first.
+        Each result carries its score: 100 for an exact ticker, up to 80 for a ticker prefix,
+        60-70 for a name prefix and at most 40 for a fuzzy name match.
+        """
+        scores: Dict[int, float] = {}
+        ticker = query.strip().upper()
+        if ticker in self._exact:
+            scores[self._exact[ticker]] = 100.0
+        if ticker and " " not in ticker:
+            for i in self._ticker_prefix(ticker)[:200]:
+                scores.setdefault(i, 80.0 - (len(self.symbols[i]) - len(ticker)))
+
+        tokens = _token_re.findall(query.lower())
+        if tokens:
+            matched, fuzzy_ratio = None, 1.0
+            for token in tokens:
+                rows = self._rows_for_token_prefix(token)
+                if not rows and len(token) >= 3:
+                    rows, ratio = self._fuzzy_rows(token)
+                    fuzzy_ratio = min(fuzzy_ratio, ratio)
+                matched = rows if matched is None else matched & rows
+                if not matched:
+                    break
+            base = 60.0 if fuzzy_ratio == 1.0 else 40.0 * fuzzy_ratio
+            lowered = query.strip().lower()
+            for i in matched or ():
+                score = base + (10.0 if self.descriptions[i].lower().startswith(lowered) else 0.0)
+                scores[i] = max(scores.get(i, 0.0), score)
+
+        # Prefer common stock and shorter, primary-listing tickers on ties
+        ranked = sorted(
+            scores.items(),
+            key=lambda item: (-item[1], self.types[item[0]] != "Common Stock", len(self.symbols[item[0]]))
+        )
+        return [{
+            "symbol": self.symbols[i],
+            "description": self.descriptions[i],
+            "display_symbol": self.display_symbols[i],
+            "type": self.types[i],
+            "score": round(score, 1)
+        } for i, score in ranked[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "symbols": len(self),
+            "name_tokens": len(self._name_tokens),
+            "build_seconds": round(self.build_seconds, 4),
+            "memory_bytes": self.memory_bytes,
+            "built_at": int(self.built_at)
+        }
+
+symbol_index: SymbolIndex | None = None
+
+async def refresh_symbol_index():
+    """Downloads the exchange symbol lists and swaps in a freshly built index."""
+    global symbol_index
+    finnhub_key = os.getenv("FINNHUB_API_KEY")
+    if not finnhub_key:
+        return
+    entries = []
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        for exchange in FINANCE_SYMBOL_EXCHANGES:
+            await finnhub_limiter.wait_if_needed()
+            response = await client.get(
+                "https://finnhub.io/api/v1/stock/symbol",
+                params={"exchange": exchange, "token": finnhub_key}
+            )
+            response.raise_for_status()
+            entries.extend(response.json() or [])
+    index = await asyncio.to_thread(SymbolIndex, entries)
+    symbol_index = index
+    logger.info(f"Symbol index built: {index.stats()}")
+
+async def refresh_symbol_index_periodically():
+    while True:
+        try:
+            await refresh_symbol_index()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Symbol index refresh failed: {e}")
+        await asyncio.sleep(FINANCE_SYMBOL_INDEX_REFRESH)
+
 @mcp.tool()
 async def search_stocks(query: str, limit: int = 10) -> dict:
     """
-    Search for stocks by name or symbol using Finnhub.
+    Search for stocks by name or symbol. Answered from the local symbol index when it has
+    a confident match, otherwise from Finnhub's search.
     Args:
         query: Search query (company name or symbol).
         limit: Maximum number of results to return.
     Returns:
         A dictionary containing search results.
     """
-    cache_key = f"search_{query}_{limit}"
+    local_results = symbol_index.search(query, limit) if symbol_index is not None else []
+    local_response = {
+        "status": "success",
+        "source": "local_index",
+        "query": query,
+        "count": len(local_results),
+        "results": local_results
+    }
+    if local_results and local_results[0]["score"] >= FINANCE_SYMBOL_INDEX_MIN_SCORE:
+        return local_response
+
+    cache_key = f"search_{' '.join(query.lower().split())}_{limit}"
     cached_data = get_cached_data(cache_key)
     if cached_data:
         return cached_data
     
     finnhub_key = os.getenv("FINNHUB_API_KEY")
     if not finnhub_key:
-        return {"status": "error", "message": "FINNHUB_API_KEY not found"}
+        # Weak local matches still beat no answer
+        return local_response if local_results else {"status": "error", "message": "FINNHUB_API_KEY not found"}
     
     await finnhub_limiter.wait_if_needed()
     
@@ -645,6 +1547,8 @@ async def search_stocks(query: str, limit: int = 10) -> dict:
                 }
                 cache_data(cache_key, result)
                 return result
+            elif local_results:
+                return local_response
             else:
                 return {
                     "status": "success",
@@ -655,9 +1559,160 @@ async def search_stocks(query: str, limit: int = 10) -> dict:
                 
     except Exception as e:
         logger.error(f"Error searching stocks: {e}")
+        if local_results:
+            return local_response
         return {"status": "error", "message": f"Error searching stocks: {e}"}
 
+# Background cache warming for configured and frequently requested symbols
+# Off by default: every refresh is a Finnhub call against the account's quota
+FINANCE_PREFETCH = os.getenv("FINANCE_PREFETCH", "false").lower() == "true"
+FINANCE_WATCHLIST = [s.strip().upper() for s in os.getenv("FINANCE_WATCHLIST", "AAPL,MSFT,NVDA,AMZN,GOOGL,META,TSLA").split(",") if s.strip()]
+FINANCE_PREFETCH_LEARNED = int(os.getenv("FINANCE_PREFETCH_LEARNED", "20"))  # learned symbols kept warm
+# Refresh intervals in seconds as (market open, market closed)
+PREFETCH_INTERVALS = {
+    "quote": (int(os.getenv("FINANCE_PREFETCH_QUOTE_OPEN", "60")), int(os.getenv("FINANCE_PREFETCH_QUOTE_CLOSED", "3600"))),
+    "metrics": (int(os.getenv("FINANCE_PREFETCH_METRICS_OPEN", "240")), int(os.getenv("FINANCE_PREFETCH_METRICS_CLOSED", "21600"))),
+    "profile": (int(os.getenv("FINANCE_PREFETCH_PROFILE", "86400")),) * 2,
+}
+
+class CachePrefetcher:
+    """
+    Keeps quote, profile and metrics caches warm for the watchlist: the configured
+    symbols plus the most requested ones (counts halve every hour). It only calls
+    Finnhub when the shared limiter has been idle, so live traffic keeps priority.
+    """
+    def __init__(self, watchlist: List[str], learned_size: int):
+        self.configured = list(watchlist)
+        self.learned_size = learned_size
+        self._counts: Dict[str, float] = {}
+        self._last_decay = time.time()
+        self._last_refresh: Dict[tuple, float] = {}
+        self.market_open = False
+        self.refreshed = 0
+
+    def record(self, symbol: str):
+        """Counts a successful live request; prefetch calls are not counted."""
+        if _prefetching.get():
+            return
+        symbol = symbol.upper()
+        self._counts[symbol] = self._counts.get(symbol, 0.0) + 1.0
+
+    def _decay(self):
+        hours = (time.time() - self._last_decay) / 3600
+        if hours >= 1:
+            factor = 0.5 ** hours
+            self._counts = {s: c * factor for s, c in self._counts.items() if c * factor >= 0.05}
+            self._last_decay = time.time()
+
+    def watchlist(self) -> List[str]:
+        self._decay()
+        learned = sorted(self._counts, key=self._counts.get, reverse=True)[:self.learned_size]
+        return list(dict.fromkeys(self.configured + learned))
+
+    def _next_due(self) -> tuple | None:
+        """Returns the most overdue (kind, symbol), or None if nothing is due."""
+        now = time.time()
+        best, best_overdue = None, 0.0
+        for symbol in self.watchlist():
+            for kind, intervals in PREFETCH_INTERVALS.items():
+                if kind == "quote" and quote_stream is not None and quote_stream.is_subscribed(symbol):
+                    continue  # streamed symbols don't need REST quote refreshes
+                interval = intervals[0] if self.market_open else intervals[1]
+                overdue = now - self._last_refresh.get((kind, symbol), 0.0) - interval
+                if overdue >= best_overdue:
+                    best, best_overdue = (kind, symbol), overdue
+        return best
+
+    async def _refresh_market_status(self):
+        status = await get_market_status()
+        if status.get("status") == "success":
+            self.market_open = bool(status.get("is_open"))
+
+    async def _refresh(self, kind: str, symbol: str):
+        token = _prefetching.set(True)
+        try:
+            if kind == "quote":
+                await get_stock_quote(symbol)
+            elif kind == "profile":
+                await get_company_profile(symbol)
+            elif kind == "metrics":
+                await get_stock_metrics(symbol)
+        finally:
+            _prefetching.reset(token)
+            self._last_refresh[(kind, symbol)] = time.time()
+        self.refreshed += 1
+
+    def _stream_watchlist(self):
+        """Subscribes watchlist symbols to the quote stream while it has room for them."""
+        if quote_stream is None:
+            return
+        for symbol in self.watchlist():
+            if not quote_stream.subscribe(symbol):
+                break
+
+    async def run(self):
+        last_status_check = 0.0
+        while True:
+            try:
+                if time.time() - last_status_check >= _cache_duration and await finnhub_limiter.is_idle():
+                    await self._refresh_market_status()
+                    last_status_check = time.time()
+                    continue
+                self._stream_watchlist()
+                due = self._next_due()
+                if due is None or not await finnhub_limiter.is_idle():
+                    await asyncio.sleep(1.0)
+                    continue
+                await self._refresh(*due)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache prefetch failed: {e}")
+                await asyncio.sleep(5.0)
+
+prefetcher = CachePrefetcher(FINANCE_WATCHLIST, FINANCE_PREFETCH_LEARNED)
+
 http_mcp = mcp.http_app(transport="streamable-http")
-app = FastAPI(lifespan=http_mcp.router.lifespan_context)
+
+@asynccontextmanager
+async def combined_lifespan(app: FastAPI):
+    background_tasks = []
+    open_persistent_cache()
+    if persistent_cache is not None:
+        try:
+            await warm_persistent_cache()
+        except Exception as e:
+            logger.error(f"Warm loading the persistent cache failed: {e}")
+        background_tasks.append(asyncio.create_task(compact_persistent_cache_periodically()))
+
+    if quote_stream is not None:
+        logger.info(f"Starting Finnhub quote stream for {quote_stream.symbols}")
+        background_tasks.append(asyncio.create_task(quote_stream.run()))
+
+    if FINANCE_SYMBOL_INDEX:
+        background_tasks.append(asyncio.create_task(refresh_symbol_index_periodically()))
+
+    if FINANCE_PREFETCH and os.getenv("FINNHUB_API_KEY"):
+        logger.info(f"Starting cache prefetcher for {prefetcher.configured}")
+        background_tasks.append(asyncio.create_task(prefetcher.run()))
+
+    async with http_mcp.router.lifespan_context(app) as maybe_state:
+        yield maybe_state
+
+    for task in background_tasks:
+        task.cancel()
+    for task in background_tasks:
+        with suppress(asyncio.CancelledError):
+            await task
+    logger.info("Finance MCP background tasks stopped.")
+
+app = FastAPI(lifespan=combined_lifespan)
+
+@app.get("/stats/symbol-index")
+async def symbol_index_stats():
+    if symbol_index is None:
+        return {"status": "not_ready"}
+    return {"status": "ready", **symbol_index.stats()}
+
 app.mount("/", http_mcp)
 logger.info("Finance MCP server initialized with Finnhub primary and Quandl fallback.")
\ No newline at end of file
@@ -0,0 +1,34 @@
+# mcp-servers/rag-mcp/gunicorn.conf.py
+# Serves rag-mcp with RAG_WORKERS uvicorn worker processes.
+#
+# With more than one worker the app is preloaded: the embedding (and rerank) model loads once
+# in the master and the forked workers share its weights copy-on-write. Each worker then opens
+# Chroma itself in its lifespan; with RAG_VECTOR_STORE=float16 or int8 every worker maps the same
+# compact vector files, so the page cache holds one copy of the index. The first worker to take
+# chroma/writer.lock applies all writes; the others pass theirs on through chroma/write_spool.
+#
+# Chroma itself is single-process: its HNSW index lives in the memory of the process that
+# wrote it, so other workers would keep serving a stale index. The server therefore refuses
+# to start with more than one worker unless RAG_VECTOR_STORE is float16 or int8.
+
+import os
+import sys
+
+workers = int(os.getenv("RAG_WORKERS", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = "0.0.0.0:9000"
+timeout = 120
+# The lifespan waits up to 30 seconds for queued document writes on shutdown
+graceful_timeout = 40
+
+preload_app = workers > 1
+if preload_app:
+    os.environ.setdefault("RAG_PRELOAD", "true")
+    # onnxruntime starts its thread pool with the session, and threads do not survive fork;
+    # with one thread per session the workers scale across cores instead
+    os.environ.setdefault("EMBEDDINGS_THREADS", "1")
+
+
+def post_fork(server, worker):
+    if preload_app:
+        sys.modules["mcp-servers.rag-mcp.server"].init_worker()
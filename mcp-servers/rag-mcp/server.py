@@ -1,17 +1,41 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastmcp import FastMCP
 from langchain_chroma import Chroma
 from langchain_groq import ChatGroq
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain.retrievers import ContextualCompressionRetriever
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.documents import Document, BaseDocumentCompressor
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pydantic import BaseModel
+from contextlib import asynccontextmanager, suppress
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from operator import itemgetter
+import asyncio
+import fcntl
+import hashlib
+import heapq
+import math
 import os
 import logging
 import json
+import re
+import shutil
+import threading
+import time
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
-from common.utils import setup_logging
+from common.utils import setup_logging, estimate_tokens, truncate_to_tokens, content_hash, stable_chunk_id
+from common.embeddings import get_embeddings
+from common.sentence_vectors import SentenceVectorStore, embed_sentences, split_sentences
 setup_logging(__name__)
 
 from dotenv import load_dotenv
@@ -45,26 +69,1023 @@ EMBEDDINGS_CACHE_DIR = os.path.join(PERSIST_DIRECTORY, "sentence_transformers_ca
 # Ensure the embeddings cache directory also exists.
 os.makedirs(EMBEDDINGS_CACHE_DIR, exist_ok=True)
 
-# Initialize HuggingFace Embeddings
-embeddings_model = HuggingFaceEmbeddings(
-    model_name=EMBEDDINGS_MODEL_NAME,
-    cache_folder=EMBEDDINGS_CACHE_DIR,
-    model_kwargs={'device': 'cpu'}
+# Under gunicorn (gunicorn.conf.py) the models load once in the master and are shared with the
+# forked workers copy-on-write; Chroma and the indexes are opened in each worker's lifespan.
+PRELOAD = os.getenv("RAG_PRELOAD", "false").lower() == "true"
+WORKERS = int(os.getenv("RAG_WORKERS", "1"))
+
+# The embedding model runs on the configured backend (EMBEDDINGS_BACKEND: torch, onnx or onnx-int8)
+# and is loaded by RagStartup
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "torch")
+
+# --- Query embedding service ---
+QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "2048"))
+EMBED_BATCH_WINDOW = float(os.getenv("RAG_EMBED_BATCH_WINDOW_MS", "5")) / 1000
+EMBED_MAX_BATCH = int(os.getenv("RAG_EMBED_MAX_BATCH", "32"))
+EMBED_WORKERS = int(os.getenv("RAG_EMBED_WORKERS", "1"))
+
+def normalize_query_text(text: str) -> str:
+    # all-MiniLM-L6-v2 uses an uncased tokenizer, so case and spacing do not change the vector
+    return " ".join(text.split()).lower()
+
+class EmbeddingService(Embeddings):
+    """
+    Wraps the embedding model with an LRU cache of query vectors and micro-batching.
+    Query misses that arrive within EMBED_BATCH_WINDOW share one model call, which runs
+    on a small dedicated executor so inference never blocks the event loop. Documents
+    pass straight through to the model.
+    """
+    def __init__(self, model: Embeddings | None, cache_size: int = QUERY_CACHE_SIZE,
+                 batch_window: float = EMBED_BATCH_WINDOW, max_batch: int = EMBED_MAX_BATCH,
+                 workers: int = EMBED_WORKERS):
+        self.model = model
+        self.cache_size = cache_size
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._queue = []
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed")
+        self.stats = {"hits": 0, "misses": 0, "batches": 0, "batched_queries": 0, "max_batch": 0}
+
+    def _submit(self, text: str) -> tuple:
+        """Returns (vector, None) on a cache hit, otherwise (None, future)."""
+        key = normalize_query_text(text)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._cache[key], None
+            self.stats["misses"] += 1
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = Future()
+                self._queue.append(key)
+                if not self._flush_scheduled:
+                    self._flush_scheduled = True
+                    self._executor.submit(self._flush)
+            return None, future
+
+    def _flush(self) -> None:
+        time.sleep(self.batch_window)
+        with self._lock:
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            if self._queue:
+                self._executor.submit(self._flush)
+            else:
+                self._flush_scheduled = False
+        try:
+            vectors = self.model.embed_documents(batch)
+        except Exception as e:
+            with self._lock:
+                futures = [self._pending.pop(key) for key in batch]
+            for future in futures:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["batched_queries"] += len(batch)
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+            futures = []
+            for key, vector in zip(batch, vectors):
+                self._cache[key] = vector
+                futures.append((self._pending.pop(key), vector))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for future, vector in futures:
+            future.set_result(vector)
+
+    def embed_query(self, text: str) -> list:
+        vector, future = self._submit(text)
+        return vector if future is None else future.result()
+
+    async def aembed_query(self, text: str) -> list:
+        vector, future = self._submit(text)
+        return vector if future is None else await asyncio.wrap_future(future)
+
+    def embed_documents(self, texts: list) -> list:
+        return self.model.embed_documents(texts)
+
+    def report(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "cached": len(self._cache),
+                "capacity": self.cache_size,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+                "avg_batch": round(self.stats["batched_queries"] / self.stats["batches"], 2) if self.stats["batches"] else 0.0
+            }
+
+embedding_service = EmbeddingService(None)
+
+# --- Lexical index and hybrid retrieval ---
+RETRIEVER_MODES = ("dense", "bm25", "hybrid")
+RETRIEVER_MODE = os.getenv("RAG_RETRIEVER_MODE", "dense")
+RETRIEVER_K = int(os.getenv("RAG_RETRIEVER_K", "4"))
+HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+BM25_SYNC_SECONDS = float(os.getenv("RAG_BM25_SYNC_SECONDS", "30"))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._\-][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by do does for from has have how i in is it its of on or that the "
+    "this to was were what when where which who why will with".split()
 )
 
+def tokenize(text: str) -> list:
+    """Lowercased word tokens. Identifiers like ERR-404 or v1.2 are kept whole and also split into parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(re.split(r"[._\-]", token))
+    return tokens
+
+class BM25Index:
+    """
+    In-memory inverted index over the chunks in the Chroma collection, scored with Okapi BM25.
+    Postings are kept per document so chunks can be added and removed without a rebuild.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self.docs = {}  # doc_id -> (text, metadata, length, terms)
+        self.total_length = 0
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, ids: list, texts: list, metadatas: list) -> None:
+        with self._lock:
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                self._remove(doc_id)
+                counts = Counter(tokenize(text or ""))
+                for term, tf in counts.items():
+                    self.postings[term][doc_id] = tf
+                length = sum(counts.values())
+                self.docs[doc_id] = (text or "", metadata or {}, length, tuple(counts))
+                self.total_length += length
+
+    def remove(self, ids) -> None:
+        with self._lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+
+    def set_metadata(self, ids: list, metadatas: list) -> None:
+        """Replaces the metadata of indexed chunks; their text and postings are unchanged."""
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                if doc_id in self.docs:
+                    self.docs[doc_id] = (self.docs[doc_id][0], metadata or {}, *self.docs[doc_id][2:])
+
+    def _remove(self, doc_id: str) -> None:
+        entry = self.docs.pop(doc_id, None)
+        if entry is None:
+            return
+        for term in entry[3]:
+            postings = self.postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= entry[2]
+
+    def sync(self, collection, force: bool = False) -> None:
+        """
+        Brings the index in line with a Chroma collection, fetching text only for chunks it has
+        not seen. Runs at most every BM25_SYNC_SECONDS unless forced. A chunk id changes with
+        its text, so only metadata can change under a known id; it is compared here because
+        in other worker processes the writer's metadata-only upserts arrive no other way.
+        """
+        if not force and time.monotonic() - self._synced_at < BM25_SYNC_SECONDS:
+            return
+        self._synced_at = time.monotonic()
+        stored = collection.get(include=["metadatas"])
+        current = dict(zip(stored["ids"], stored["metadatas"]))
+        with self._lock:
+            known = {doc_id: entry[1] for doc_id, entry in self.docs.items()}
+        if known.keys() - current.keys():
+            self.remove(known.keys() - current.keys())
+        changed = [doc_id for doc_id in known.keys() & current.keys() if (current[doc_id] or {}) != known[doc_id]]
+        self.set_metadata(changed, [current[doc_id] for doc_id in changed])
+        new_ids = list(current.keys() - known.keys())
+        for start in range(0, len(new_ids), 500):
+            batch = collection.get(ids=new_ids[start:start + 500], include=["documents", "metadatas"])
+            self.add(batch["ids"], batch["documents"], batch["metadatas"])
+
+    def search(self, query: str, k: int, filters: dict | None = None) -> list:
+        """Returns up to k (Document, score) pairs that share at least one term with the query."""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not self.docs:
+                return []
+            n = len(self.docs)
+            avgdl = self.total_length / n or 1.0
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    length = self.docs[doc_id][2]
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avgdl))
+            if filters:
+                scores = {
+                    doc_id: score for doc_id, score in scores.items()
+                    if all(self.docs[doc_id][1].get(key) == value for key, value in filters.items())
+                }
+            best = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+            return [
+                (Document(id=doc_id, page_content=self.docs[doc_id][0], metadata=self.docs[doc_id][1]), score)
+                for doc_id, score in best
+            ]
+
+bm25_index = BM25Index()
+
+# --- Compact vector storage ---
+VECTOR_STORE = os.getenv("RAG_VECTOR_STORE", "chroma")  # chroma | float16 | int8
+COMPACT_DIRECTORY = os.path.join(PERSIST_DIRECTORY, "compact_vectors")
+COMPACT_SHORTLIST = int(os.getenv("RAG_COMPACT_SHORTLIST", "64"))
+COMPACT_SYNC_SECONDS = float(os.getenv("RAG_COMPACT_SYNC_SECONDS", "30"))
+COMPACT_BLOCK_ROWS = 8192  # bounds the float32 scratch block per query
+if WORKERS > 1 and VECTOR_STORE == "chroma":
+    # Only the writer would see new chunks in Chroma's in-memory HNSW index; the compact
+    # vectors are re-read from disk by every worker
+    raise ValueError("RAG_WORKERS > 1 needs RAG_VECTOR_STORE=float16 or int8; Chroma serves one process only")
+
+class CompactVectorStore:
+    """
+    Brute-force vector search over quantized embeddings in memory-mapped files.
+    The first pass scores every row in float16, or int8 with a per-vector scale, and keeps a
+    shortlist. The shortlist is then re-scored exactly from a float32 copy that is also
+    memory-mapped, so only the shortlisted rows are ever read from it. Distances match the
+    collection's metric (l2, cosine or ip), so relevance scores equal the Chroma path.
+
+    Files live in a generation directory named by meta.json. The writer appends rows for
+    new chunks, and an entry to the generation's ids.jsonl log for every add or delete;
+    meta.json then commits the new row count and log length, so a write costs the size of
+    the batch. Rows or log entries past the committed lengths were left by a writer that
+    died mid-write and are cut off before the next append. Once a quarter of the rows are
+    dead the writer builds a new generation and switches meta.json to it. Read-only
+    instances (other worker processes) replay the log when meta.json changes, and every
+    process shares the same pages.
+    """
+    def __init__(self, directory: str, dtype: str = "int8", space: str = "l2", read_only: bool = False):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported compact vector dtype '{dtype}'")
+        self.directory = directory
+        self.dtype = dtype
+        self.space = space
+        self.read_only = read_only
+        self.generation = None
+        self.ids = []  # row -> chunk id, None for deleted rows
+        self.row_of = {}
+        self.dim = 0
+        self.live = np.zeros(0, dtype=bool)
+        self.exact = self.compact = self.scales = self.norms = None
+        self._meta_version = None
+        self._log_bytes = 0
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str, generation: str | None = None) -> str:
+        return os.path.join(self.directory, generation or self.generation, name)
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, "meta.json")
+
+    def _current_meta_version(self) -> tuple | None:
+        # meta.json is replaced, never rewritten, so a new inode means new content even within one mtime tick
+        try:
+            stat = os.stat(self._meta_path())
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _files(self) -> dict:
+        """Data file name -> bytes per row."""
+        files = {"exact.f32": 4 * self.dim, f"compact.{self.dtype}": np.dtype(self.dtype).itemsize * self.dim, "norms.f32": 4}
+        if self.dtype == "int8":
+            files["scales.f32"] = 4
+        return files
+
+    def _replay(self, entries: list) -> None:
+        """Applies ids.jsonl entries in place; searches copy ids and live under the lock."""
+        for entry in entries:
+            added = entry.get("add", [])
+            # A re-added id is a rewritten chunk, so its old row dies too
+            dropped = [self.row_of.pop(chunk_id) for chunk_id in entry.get("remove", []) + added if chunk_id in self.row_of]
+            for row in dropped:
+                self.ids[row] = None
+            for chunk_id in added:
+                self.row_of[chunk_id] = len(self.ids)
+                self.ids.append(chunk_id)
+            self.live = np.concatenate([self.live, np.ones(len(added), dtype=bool)])
+            self.live[dropped] = False
+
+    def _open(self) -> None:
+        """Maps the generation in meta.json, replaying only the log entries not seen yet."""
+        self._meta_version = self._current_meta_version()
+        with open(self._meta_path()) as f:
+            meta = json.load(f)
+        if meta["dtype"] != self.dtype:
+            raise ValueError(f"Compact vectors on disk are {meta['dtype']}, not {self.dtype}")
+        if "log_bytes" not in meta:
+            return  # written before the ids log existed; the writer rebuilds the store
+        if meta["generation"] != self.generation or meta["log_bytes"] < self._log_bytes:
+            self.generation, self.ids, self.row_of, self._log_bytes = meta["generation"], [], {}, 0
+            self.live = np.zeros(0, dtype=bool)
+        self.dim = meta["dim"]
+        with open(self._path("ids.jsonl"), "rb") as f:
+            f.seek(self._log_bytes)
+            log = f.read(meta["log_bytes"] - self._log_bytes)
+        self._replay([json.loads(line) for line in log.splitlines()])
+        self._log_bytes = meta["log_bytes"]
+        if not self.read_only:
+            self._truncate()
+        self._map()
+
+    def _truncate(self) -> None:
+        """Cuts rows and log entries a crashed writer appended without committing them."""
+        for name, row_bytes in {**self._files(), "ids.jsonl": None}.items():
+            path = self._path(name)
+            size = self._log_bytes if row_bytes is None else len(self.ids) * row_bytes
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _map(self) -> None:
+        """Maps the committed rows read-only; old maps stay valid for searches still using them."""
+        rows = len(self.ids)
+        if rows == 0:
+            self.exact = self.compact = self.scales = self.norms = None
+            return
+        self.exact = np.memmap(self._path("exact.f32"), dtype=np.float32, mode="r", shape=(rows, self.dim))
+        self.compact = np.memmap(self._path(f"compact.{self.dtype}"), dtype=self.dtype, mode="r", shape=(rows, self.dim))
+        self.norms = np.memmap(self._path("norms.f32"), dtype=np.float32, mode="r", shape=(rows,))
+        if self.dtype == "int8":
+            self.scales = np.memmap(self._path("scales.f32"), dtype=np.float32, mode="r", shape=(rows,))
+
+    def _write_meta(self) -> None:
+        tmp_path = f"{self._meta_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "dtype": self.dtype, "generation": self.generation, "dim": self.dim,
+                "rows": len(self.ids), "log_bytes": self._log_bytes
+            }, f)
+        os.replace(tmp_path, self._meta_path())
+        self._meta_version = self._current_meta_version()
+
+    def _append(self, generation: str, vectors: np.ndarray) -> None:
+        """Appends the encoded vectors to every file of a generation."""
+        blocks = {
+            "exact.f32": vectors,
+            "norms.f32": np.linalg.norm(vectors, axis=1).astype(np.float32)
+        }
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            blocks["compact.int8"] = np.round(vectors / scales[:, None]).astype(np.int8)
+            blocks["scales.f32"] = scales.astype(np.float32)
+        else:
+            blocks["compact.float16"] = vectors.astype(np.float16)
+        for name, block in blocks.items():
+            with open(self._path(name, generation), "ab") as f:
+                f.write(block.tobytes())
+
+    def _log(self, entry: dict) -> None:
+        """Appends an entry to ids.jsonl and commits it, with the rows it refers to, in meta.json."""
+        line = (json.dumps(entry) + "\n").encode()
+        with open(self._path("ids.jsonl"), "ab") as f:
+            f.write(line)
+        self._log_bytes += len(line)
+        self._replay([entry])
+        self._map()
+        self._write_meta()
+
+    def _refresh(self) -> None:
+        """Catches up with meta.json before writing, e.g. after taking over from another writer."""
+        version = self._current_meta_version()
+        if version is not None and version != self._meta_version:
+            self._open()
+        elif self.generation is not None:
+            self._truncate()
+
+    def add(self, ids: list, vectors) -> None:
+        """Appends vectors for new or rewritten chunks."""
+        if not ids:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._refresh()
+            if self.generation is None:
+                self.generation = f"gen-{time.time_ns()}"
+                os.makedirs(os.path.join(self.directory, self.generation))
+            self.dim = self.dim or vectors.shape[1]  # a store rebuilt from an empty collection has no dim yet
+            self._append(self.generation, vectors)
+            self._log({"add": list(ids)})
+
+    def remove(self, ids) -> None:
+        with self._lock:
+            self._refresh()
+            removed = self.row_of.keys() & set(ids)
+            if not removed:
+                return
+            self._log({"remove": sorted(removed)})
+
+    def rebuild(self, collection) -> None:
+        """Writes a new generation from the collection's stored embeddings and switches to it."""
+        generation = f"gen-{time.time_ns()}"
+        os.makedirs(os.path.join(self.directory, generation))
+        ids, dim, offset = [], 0, 0
+        while True:
+            batch = collection.get(include=["embeddings"], limit=2000, offset=offset)
+            if not batch["ids"]:
+                break
+            vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+            self._append(generation, vectors)
+            ids.extend(batch["ids"])
+            dim = vectors.shape[1]
+            offset += len(batch["ids"])
+        line = (json.dumps({"add": ids}) + "\n").encode()
+        with open(self._path("ids.jsonl", generation), "wb") as f:
+            f.write(line)
+        with self._lock:
+            self.generation, self.dim, self.ids, self.row_of, self._log_bytes = generation, dim, [], {}, len(line)
+            self.live = np.zeros(0, dtype=bool)
+            self._replay([{"add": ids}])
+            self._map()
+            self._write_meta()
+        # Other processes may still map old generations; unlinked files stay readable for them
+        for name in os.listdir(self.directory):
+            if name.startswith("gen-") and name != generation:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def sync(self, collection, force: bool = False) -> None:
+        """
+        Read-only instances re-map when meta.json changed. The writer loads the files, then
+        follows chunks added or removed in the collection by other writers such as the loader Job.
+        """
+        if not force and time.monotonic() - self._synced_at < COMPACT_SYNC_SECONDS:
+            return
+        self._synced_at = time.monotonic()
+        version = self._current_meta_version()
+        if version is not None and version != self._meta_version:
+            with self._lock:
+                self._open()
+        if self.read_only:
+            return
+        dead = len(self.ids) - len(self.row_of)
+        if self.generation is None or dead > len(self.ids) / 4:
+            self.rebuild(collection)
+            return
+        ids = set(collection.get(include=[])["ids"])
+        known = set(self.row_of)
+        if known - ids:
+            self.remove(known - ids)
+        new_ids = list(ids - known)
+        for start in range(0, len(new_ids), 2000):
+            batch = collection.get(ids=new_ids[start:start + 2000], include=["embeddings"])
+            self.add(batch["ids"], batch["embeddings"])
+
+    def _distances(self, exact: np.ndarray, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(exact[rows], dtype=np.float32)
+        if self.space == "cosine":
+            return 1.0 - vectors @ query / np.clip(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12, None)
+        if self.space == "ip":
+            return 1.0 - vectors @ query
+        return ((vectors - query) ** 2).sum(axis=1)
+
+    def search(self, query_vector, k: int, allowed_ids: set | None = None, shortlist: int = COMPACT_SHORTLIST) -> list:
+        """Returns up to k (chunk_id, distance) pairs, nearest first."""
+        with self._lock:
+            ids, exact, compact, scales, norms = list(self.ids), self.exact, self.compact, self.scales, self.norms
+            valid = self.live.copy()
+        if compact is None or not len(ids):
+            return []
+        if allowed_ids is not None:
+            allowed = np.zeros(len(ids), dtype=bool)
+            allowed[[row for row, chunk_id in enumerate(ids) if chunk_id in allowed_ids]] = True
+            valid &= allowed
+        query = np.asarray(query_vector, dtype=np.float32)
+        approx = np.empty(len(ids), dtype=np.float32)
+        for start in range(0, len(ids), COMPACT_BLOCK_ROWS):
+            block = np.asarray(compact[start:start + COMPACT_BLOCK_ROWS], dtype=np.float32)
+            dots = block @ query
+            if scales is not None:
+                dots *= scales[start:start + COMPACT_BLOCK_ROWS]
+            block_norms = norms[start:start + COMPACT_BLOCK_ROWS]
+            if self.space == "cosine":
+                dots /= np.clip(block_norms, 1e-12, None)
+            elif self.space == "l2":
+                dots = 2 * dots - block_norms ** 2  # larger means nearer
+            approx[start:start + len(block)] = dots
+        approx[~valid] = -np.inf
+        candidates = min(max(shortlist, k), int(valid.sum()))
+        if candidates == 0:
+            return []
+        rows = np.argpartition(-approx, candidates - 1)[:candidates]
+        rows = np.sort(rows)  # sequential reads from the float32 file
+        distances = self._distances(exact, rows, query)
+        order = np.argsort(distances)[:k]
+        return [(ids[rows[i]], float(distances[i])) for i in order]
+
+    def report(self) -> dict:
+        sizes = {}
+        if self.generation:
+            generation_dir = os.path.join(self.directory, self.generation)
+            sizes = {name: os.path.getsize(os.path.join(generation_dir, name)) for name in os.listdir(generation_dir)}
+        return {
+            "dtype": self.dtype,
+            "generation": self.generation,
+            "read_only": self.read_only,
+            "rows": len(self.ids),
+            "live_rows": len(self.row_of),
+            "compact_mb": round((sizes.get(f"compact.{self.dtype}", 0) + sizes.get("scales.f32", 0) + sizes.get("norms.f32", 0)) / 2**20, 2),
+            "exact_mb": round(sizes.get("exact.f32", 0) / 2**20, 2)
+        }
+
+compact_store = None
+
+def rrf_fuse(ranked_lists: list, k: int, rrf_k: int = RRF_K) -> list:
+    """Reciprocal rank fusion: each list adds 1 / (rrf_k + rank) to a chunk's score."""
+    scores, docs = defaultdict(float), {}
+    for ranked in ranked_lists:
+        for rank, (doc, _) in enumerate(ranked, start=1):
+            key = doc.id or doc.page_content
+            scores[key] += 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    return [(docs[key], score) for key, score in heapq.nlargest(k, scores.items(), key=itemgetter(1))]
+
+def chroma_where(filters: dict | None) -> dict | None:
+    """Turns {"source": "a.pdf", "page": 2} into a Chroma where clause."""
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return dict(filters)
+    return {"$and": [{key: value} for key, value in filters.items()]}
+
+def compact_search(query_vector: list, k: int, filters: dict | None = None) -> list:
+    """Searches the compact store and loads the matching chunks from Chroma; returns (Document, distance)."""
+    compact_store.sync(vectordb._collection)
+    allowed = set(vectordb._collection.get(where=chroma_where(filters), include=[])["ids"]) if filters else None
+    hits = compact_store.search(query_vector, k, allowed)
+    if not hits:
+        return []
+    stored = vectordb._collection.get(ids=[chunk_id for chunk_id, _ in hits], include=["documents", "metadatas"])
+    by_id = {
+        chunk_id: Document(id=chunk_id, page_content=text or "", metadata=metadata or {})
+        for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+    }
+    return [(by_id[chunk_id], distance) for chunk_id, distance in hits if chunk_id in by_id]
+
+def dense_search(query_vector: list, k: int, filters: dict | None = None, score_threshold: float | None = None) -> list:
+    if compact_store is not None:
+        hits = compact_search(query_vector, k, filters)
+    else:
+        hits = vectordb.similarity_search_by_vector_with_relevance_scores(query_vector, k=k, filter=chroma_where(filters))
+    # Both searches return raw distances; convert them the way the text search does
+    relevance = vectordb._select_relevance_score_fn()
+    scored = [(doc, relevance(distance)) for doc, distance in hits]
+    # Squared-L2 relevance can go below 0, so there is no neutral default threshold
+    if score_threshold is None:
+        return scored
+    return [(doc, score) for doc, score in scored if score >= score_threshold]
+
+def lexical_search(query: str, k: int, filters: dict | None = None) -> list:
+    bm25_index.sync(vectordb._collection)
+    return bm25_index.search(query, k, filters)
+
+def search_documents(
+    query: str,
+    k: int = RETRIEVER_K,
+    filters: dict | None = None,
+    score_threshold: float | None = None,
+    mode: str = RETRIEVER_MODE,
+    query_vector: list | None = None
+) -> list:
+    """
+    Returns up to k (Document, score) pairs for the query in the given mode.
+    Scores are vector relevance for dense, BM25 for bm25 and the fused RRF score for hybrid.
+    score_threshold applies to vector relevance only, when given: in hybrid mode it drops weak
+    dense candidates before fusion and leaves BM25 candidates alone; bm25 mode ignores it.
+    """
+    if mode not in RETRIEVER_MODES:
+        raise ValueError(f"Unknown retriever mode '{mode}'. Use one of {', '.join(RETRIEVER_MODES)}.")
+    candidates = max(k, HYBRID_CANDIDATES) if mode == "hybrid" else k
+    dense, lexical = [], []
+    if mode != "bm25":
+        if query_vector is None:
+            query_vector = embedding_service.embed_query(query)
+        dense = dense_search(query_vector, candidates, filters, score_threshold)
+    if mode != "dense":
+        lexical = lexical_search(query, candidates, filters)
+    if mode == "hybrid":
+        return rrf_fuse([dense, lexical], k)
+    return dense if mode == "dense" else lexical
+
+async def asearch_documents(
+    query: str,
+    k: int = RETRIEVER_K,
+    filters: dict | None = None,
+    score_threshold: float | None = None,
+    mode: str = RETRIEVER_MODE
+) -> list:
+    """search_documents with the query embedded on the embedding service and the search off the event loop."""
+    if mode not in RETRIEVER_MODES:
+        raise ValueError(f"Unknown retriever mode '{mode}'. Use one of {', '.join(RETRIEVER_MODES)}.")
+    query_vector = await embedding_service.aembed_query(query) if mode != "bm25" else None
+    return await asyncio.to_thread(search_documents, query, k, filters, score_threshold, mode, query_vector)
+
+# --- Optional cross-encoder rerank ---
+RERANK_ENABLED = os.getenv("RAG_RERANK", "false").lower() == "true"
+RERANK_MODEL_NAME = os.getenv("RAG_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "20"))
+RERANK_TOP_N = int(os.getenv("RAG_RERANK_TOP_N", "3"))
+RERANK_BUDGET = float(os.getenv("RAG_RERANK_BUDGET_MS", "300")) / 1000
+RERANK_MAX_LENGTH = int(os.getenv("RAG_RERANK_MAX_LENGTH", "256"))
+
+class Reranker:
+    """
+    Scores (query, chunk) pairs with a small cross-encoder in one batched CPU pass and keeps
+    the best top_n. If scoring does not finish within the latency budget, or fails, the
+    candidates keep their retrieval order. A timed-out job cannot be interrupted once it is
+    running, so reranking is skipped until it finishes rather than queueing more work behind it.
+    """
+    def __init__(self, model_name: str = RERANK_MODEL_NAME, budget: float = RERANK_BUDGET,
+                 max_length: int = RERANK_MAX_LENGTH):
+        self.model_name = model_name
+        self.budget = budget
+        self.max_length = max_length
+        self._model = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        # The timed-out job still running in the executor, if any
+        self._abandoned = None
+        self.stats = {"reranked": 0, "fallbacks": 0, "errors": 0, "skipped": 0}
+
+    def load(self):
+        """Loads the cross-encoder; RagStartup calls this so the first queries are not charged for it."""
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(
+                self.model_name, max_length=self.max_length, device="cpu", cache_folder=EMBEDDINGS_CACHE_DIR
+            )
+        return self._model
+
+    def _score(self, query: str, docs: list) -> list:
+        pairs = [(query, doc.page_content) for doc in docs]
+        return self.load().predict(pairs, batch_size=len(pairs), show_progress_bar=False).tolist()
+
+    def _submit(self, query: str, scored_docs: list):
+        """Starts scoring, or returns None while an abandoned job still occupies the executor."""
+        if self._abandoned is not None and not self._abandoned.done():
+            self.stats["skipped"] += 1
+            return None
+        return self._executor.submit(self._score, query, [doc for doc, _ in scored_docs])
+
+    def _abandon(self, future):
+        # A job still waiting in the queue is dropped; a running one is remembered
+        if not future.cancel():
+            self._abandoned = future
+
+    def _select(self, scored_docs: list, scores: list | None, top_n: int) -> list:
+        if scores is None:
+            self.stats["fallbacks"] += 1
+            return scored_docs[:top_n]
+        self.stats["reranked"] += 1
+        ranked = sorted(zip((doc for doc, _ in scored_docs), scores), key=itemgetter(1), reverse=True)
+        return [(doc, float(score)) for doc, score in ranked[:top_n]]
+
+    def rerank(self, query: str, scored_docs: list, top_n: int = RERANK_TOP_N) -> list:
+        if len(scored_docs) <= 1:
+            return scored_docs[:top_n]
+        future = self._submit(query, scored_docs)
+        if future is None:
+            return self._select(scored_docs, None, top_n)
+        try:
+            scores = future.result(timeout=self.budget)
+        except FutureTimeoutError:
+            self._abandon(future)
+            scores = None
+        except Exception as e:
+            logger.warning(f"Rerank failed, keeping retrieval order: {e}")
+            self.stats["errors"] += 1
+            scores = None
+        return self._select(scored_docs, scores, top_n)
+
+    async def arerank(self, query: str, scored_docs: list, top_n: int = RERANK_TOP_N) -> list:
+        if len(scored_docs) <= 1:
+            return scored_docs[:top_n]
+        future = self._submit(query, scored_docs)
+        if future is None:
+            return self._select(scored_docs, None, top_n)
+        try:
+            scores = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.budget)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            scores = None
+        except Exception as e:
+            logger.warning(f"Rerank failed, keeping retrieval order: {e}")
+            self.stats["errors"] += 1
+            scores = None
+        return self._select(scored_docs, scores, top_n)
+
+reranker = Reranker() if RERANK_ENABLED else None
+
+class HybridRetriever(BaseRetriever):
+    """Retriever for qa_chain that follows RAG_RETRIEVER_MODE and reranks when RAG_RERANK is on."""
+    mode: str = RETRIEVER_MODE
+    k: int = RETRIEVER_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list:
+        if reranker is None:
+            return [doc for doc, _ in search_documents(query, self.k, mode=self.mode)]
+        candidates = search_documents(query, max(self.k, RERANK_CANDIDATES), mode=self.mode)
+        return [doc for doc, _ in reranker.rerank(query, candidates, min(self.k, RERANK_TOP_N))]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> list:
+        if reranker is None:
+            return [doc for doc, _ in await asearch_documents(query, self.k, mode=self.mode)]
+        candidates = await asearch_documents(query, max(self.k, RERANK_CANDIDATES), mode=self.mode)
+        return [doc for doc, _ in await reranker.arerank(query, candidates, min(self.k, RERANK_TOP_N))]
+
+# Separate collection for fetched web results, so they never mix with curated documents
+WEB_CACHE_COLLECTION = os.getenv("RAG_WEB_CACHE_COLLECTION", "web_cache")
+WEB_CACHE_TTL_HOURS = float(os.getenv("RAG_WEB_CACHE_TTL_HOURS", "72"))
+
+# --- Single writer across worker processes ---
+WRITER_LOCK_PATH = os.path.join(PERSIST_DIRECTORY, "writer.lock")
+SPOOL_DIRECTORY = os.path.join(PERSIST_DIRECTORY, "write_spool")
+WRITER_ELECTION_SECONDS = float(os.getenv("RAG_WRITER_ELECTION_SECONDS", "5"))
+SPOOL_POLL_SECONDS = float(os.getenv("RAG_SPOOL_POLL_MS", "100")) / 1000
+SPOOL_WAIT_SECONDS = float(os.getenv("RAG_SPOOL_WAIT_SECONDS", "30"))
+SPOOL_RESULT_TTL_SECONDS = 600
+
+class WriterLock:
+    """
+    Exclusive flock on a file in the data volume. The process holding it is the only one that
+    writes to Chroma and the compact vectors; the kernel releases it when that process exits,
+    so another worker can take over.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+class WriteSpool:
+    """
+    Directory queue that carries writes, and web cache searches, from the other workers to the
+    writer process. Each operation is one JSON file renamed into place, so the writer never
+    reads a partial one; results go back the same way when the caller waits for them.
+    Operations are removed only after they are applied, and a new writer replays whatever
+    its predecessor left behind.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.results = os.path.join(directory, "results")
+        self._claimed = set()
+        os.makedirs(self.results, exist_ok=True)
+
+    def _write(self, path: str, data: dict) -> None:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def put(self, op: dict) -> str:
+        # Names sort by submission time, which keeps writes to one document in order
+        op_id = f"{time.time_ns()}-{os.getpid()}-{os.urandom(4).hex()}"
+        self._write(os.path.join(self.directory, f"{op_id}.json"), op)
+        return op_id
+
+    def claim(self) -> list:
+        """Returns (op_id, op) for spooled operations not yet handed to the writer, oldest first."""
+        claimed = []
+        for name in sorted(os.listdir(self.directory)):
+            op_id = name[:-len(".json")]
+            if not name.endswith(".json") or op_id in self._claimed:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    claimed.append((op_id, json.load(f)))
+            except ValueError as e:
+                logger.error(f"RAG MCP: setting aside unreadable spooled write {name}: {e}")
+                os.replace(path, f"{path}.bad")
+                continue
+            self._claimed.add(op_id)
+        return claimed
+
+    def complete(self, op_id: str, result: dict | None) -> None:
+        if result is not None:
+            self._write(os.path.join(self.results, f"{op_id}.json"), result)
+        with suppress(FileNotFoundError):
+            os.remove(os.path.join(self.directory, f"{op_id}.json"))
+        self._claimed.discard(op_id)
+
+    def expire_results(self) -> None:
+        """Drops results nobody collected, e.g. after the waiting worker timed out or exited."""
+        cutoff = time.time() - SPOOL_RESULT_TTL_SECONDS
+        for name in os.listdir(self.results):
+            path = os.path.join(self.results, name)
+            with suppress(FileNotFoundError):
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+
+    async def result(self, op_id: str, timeout: float) -> dict | None:
+        path = os.path.join(self.results, f"{op_id}.json")
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.path.exists(path):
+                with open(path) as f:
+                    result = json.load(f)
+                os.remove(path)
+                return result
+            await asyncio.sleep(SPOOL_POLL_SECONDS)
+        return None
+
+writer_lock = WriterLock(WRITER_LOCK_PATH)
+write_spool = WriteSpool(SPOOL_DIRECTORY)
+
+# --- Context compression ---
+COMPRESS_ENABLED = os.getenv("RAG_COMPRESS", "false").lower() == "true"
+COMPRESS_MAX_TOKENS = int(os.getenv("RAG_COMPRESS_MAX_TOKENS", "600"))
+COMPRESS_MIN_SIMILARITY = float(os.getenv("RAG_COMPRESS_MIN_SIMILARITY", "0.25"))
+SENTENCE_CACHE_SIZE = int(os.getenv("RAG_SENTENCE_CACHE_SIZE", "4096"))
+SENTENCE_VECTORS_PATH = os.path.join(PERSIST_DIRECTORY, "sentence_vectors.sqlite3")
+
+sentence_vectors = None  # SentenceVectorStore, opened at startup
+compression_stats = {"queries": 0, "tokens_in": 0, "tokens_out": 0, "chunks_from_store": 0, "chunks_embedded": 0}
+_sentence_cache = OrderedDict()  # content hash -> vectors for chunks without stored sentence vectors
+_sentence_cache_lock = threading.Lock()
+
+def chunk_sentence_vectors(docs: list, sentences: list) -> list:
+    """
+    Sentence vectors for each document, from the store written at ingest time when present.
+    Chunks stored before it existed are embedded once and kept in an LRU; the writer process
+    also saves them to the store.
+    """
+    stored = sentence_vectors.get_many({doc.id for doc in docs if doc.id}) if sentence_vectors is not None else {}
+    vectors, missing = [None] * len(docs), []
+    with _sentence_cache_lock:
+        for i, doc in enumerate(docs):
+            found = stored.get(doc.id)
+            key = content_hash(doc.page_content)
+            if found is not None and len(found) == len(sentences[i]):
+                vectors[i] = found
+                compression_stats["chunks_from_store"] += 1
+            elif key in _sentence_cache:
+                _sentence_cache.move_to_end(key)
+                vectors[i] = _sentence_cache[key]
+            else:
+                missing.append(i)
+    if not missing:
+        return vectors
+    embedded = embed_sentences(embedding_service, [docs[i].page_content for i in missing])
+    with _sentence_cache_lock:
+        compression_stats["chunks_embedded"] += len(missing)
+        for i, array in zip(missing, embedded):
+            vectors[i] = array
+            _sentence_cache[content_hash(docs[i].page_content)] = array
+        while len(_sentence_cache) > SENTENCE_CACHE_SIZE:
+            _sentence_cache.popitem(last=False)
+    if writer_lock.held and sentence_vectors is not None:
+        sentence_vectors.put_many((docs[i].id, vectors[i]) for i in missing if docs[i].id)
+    return vectors
+
+class SentenceCompressor(BaseDocumentCompressor):
+    """
+    Keeps only the sentences of the retrieved chunks that are closest to the question, best
+    first, until max_tokens of context is used, so the stuff prompt carries the relevant text
+    rather than whole chunks. Kept sentences stay in document order. The query vector comes
+    from the embedding cache, since retrieval has just embedded the same query.
+    """
+    max_tokens: int = COMPRESS_MAX_TOKENS
+    min_similarity: float = COMPRESS_MIN_SIMILARITY
+
+    def compress_documents(self, documents, query: str, callbacks=None) -> list:
+        return self._compress(list(documents), embedding_service.embed_query(query))
+
+    async def acompress_documents(self, documents, query: str, callbacks=None) -> list:
+        query_vector = await embedding_service.aembed_query(query)
+        return await asyncio.to_thread(self._compress, list(documents), query_vector)
+
+    def _compress(self, docs: list, query_vector) -> list:
+        if not docs:
+            return []
+        sentences = [split_sentences(doc.page_content) for doc in docs]
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        candidates = []
+        for i, vectors in enumerate(chunk_sentence_vectors(docs, sentences)):
+            if len(vectors):
+                similarities = vectors @ query / np.clip(np.linalg.norm(vectors, axis=1), 1e-12, None)
+                candidates.extend((float(similarity), i, j) for j, similarity in enumerate(similarities))
+        candidates.sort(key=itemgetter(0), reverse=True)
+
+        kept, used = defaultdict(list), 0
+        for similarity, i, j in candidates:
+            # The best sentence is always kept, so the model never gets an empty context
+            if used and similarity < self.min_similarity:
+                break
+            text = sentences[i][j]
+            tokens = estimate_tokens(text)
+            if used + tokens > self.max_tokens:
+                if used:
+                    continue
+                text = truncate_to_tokens(text, self.max_tokens)
+                tokens = estimate_tokens(text)
+            kept[i].append((j, text))
+            used += tokens
+
+        compressed = []
+        for i, doc in enumerate(docs):
+            if i in kept:
+                parts = [text for _, text in sorted(kept[i])]
+                compressed.append(Document(id=doc.id, page_content=" ".join(parts), metadata={
+                    **doc.metadata, "sentences_kept": len(parts), "sentences_total": len(sentences[i])
+                }))
+        with _sentence_cache_lock:
+            compression_stats["queries"] += 1
+            compression_stats["tokens_in"] += sum(estimate_tokens(doc.page_content) for doc in docs)
+            compression_stats["tokens_out"] += used
+        return compressed
+
 # Initialize global variables
 qa_chain = None
 vectordb = None
+web_vectordb = None
+retriever = None
+WARMUP_QUERY = os.getenv("RAG_WARMUP_QUERY", "What is covered in the knowledge base?")
 
-try:
+def load_embeddings_model() -> None:
+    embedding_service.model = get_embeddings(EMBEDDINGS_CACHE_DIR, EMBEDDINGS_MODEL_NAME, EMBEDDINGS_BACKEND)
+
+def open_chroma() -> None:
+    global vectordb, web_vectordb, sentence_vectors
+    # The first process to take the lock applies all writes; the others share its files read-only
+    writer_lock.acquire()
     vectordb = Chroma(
         persist_directory=PERSIST_DIRECTORY, # ChromaDB data will also persist here
-        embedding_function=embeddings_model
+        embedding_function=embedding_service
     )
     if vectordb._collection.count() == 0:
         print("ChromaDB is empty. Please run a separate script to load your documents.")
 
-    retriever = vectordb.as_retriever()
+    web_vectordb = Chroma(
+        collection_name=WEB_CACHE_COLLECTION,
+        persist_directory=PERSIST_DIRECTORY,
+        embedding_function=embedding_service
+    )
+    if COMPRESS_ENABLED:
+        sentence_vectors = SentenceVectorStore(SENTENCE_VECTORS_PATH)
+
+def build_indexes() -> None:
+    global compact_store
+    bm25_index.sync(vectordb._collection, force=True)
+    if VECTOR_STORE != "chroma":
+        hnsw_config = vectordb._collection.configuration.get("hnsw") or {}
+        compact_store = CompactVectorStore(
+            COMPACT_DIRECTORY, VECTOR_STORE, hnsw_config.get("space") or "l2", read_only=not writer_lock.held
+        )
+        compact_store.sync(vectordb._collection, force=True)
+        print(f"RAG MCP: compact {VECTOR_STORE} vectors ready: {compact_store.report()}")
+
+def build_qa_chain() -> None:
+    global retriever, qa_chain
+    retriever = HybridRetriever()
+    chain_retriever = retriever
+    if COMPRESS_ENABLED:
+        chain_retriever = ContextualCompressionRetriever(base_compressor=SentenceCompressor(), base_retriever=retriever)
 
     system_prompt = (
         "You are an assistant for question-answering tasks. "
@@ -85,11 +1106,93 @@ try:
     question_answer_chain = create_stuff_documents_chain(llm_model, prompt)
 
     # Create the retrieval chain
-    qa_chain = create_retrieval_chain(retriever, question_answer_chain)
-    print(f"RAG MCP: ChromaDB initialized successfully with {vectordb._collection.count()} documents using {EMBEDDINGS_MODEL_NAME} embeddings.")
+    qa_chain = create_retrieval_chain(chain_retriever, question_answer_chain)
+
+def warm_up() -> None:
+    """Runs one query end to end so the model weights and index pages are resident before traffic."""
+    # Straight to the model, so the warm-up query does not sit in the query cache
+    vector = embedding_service.model.embed_query(WARMUP_QUERY)
+    scored_docs = search_documents(WARMUP_QUERY, max(RETRIEVER_K, RERANK_CANDIDATES), query_vector=vector)
+    if reranker is not None and scored_docs:
+        reranker._score(WARMUP_QUERY, [doc for doc, _ in scored_docs])
+    if COMPRESS_ENABLED and scored_docs:
+        SentenceCompressor()._compress([doc for doc, _ in scored_docs[:RETRIEVER_K]], vector)
+
+class RagStartup:
+    """
+    Loads the models, opens Chroma and builds the indexes off the event loop, so the server
+    binds immediately and /ready tells Kubernetes when queries can be served. Every phase is
+    timed, and a failure is kept and reported by the tools and /ready.
+    """
+    def __init__(self):
+        self.phase = "pending"
+        self.timings = {}
+        self.error = None
+        self.ready = False
+        self.models_loaded = False
+
+    def _run_phase(self, name: str, step) -> None:
+        self.phase = name
+        start = time.perf_counter()
+        step()
+        self.timings[name] = round(time.perf_counter() - start, 3)
+        logger.info(f"RAG MCP startup: {name} took {self.timings[name]}s")
+
+    def load_models(self) -> None:
+        if self.models_loaded:
+            return
+        self._run_phase("embeddings_model", load_embeddings_model)
+        if reranker is not None:
+            self._run_phase("rerank_model", reranker.load)
+        self.models_loaded = True
+
+    def load(self) -> None:
+        """Runs every remaining phase; raises after recording the error if one fails."""
+        try:
+            self.load_models()
+            self._run_phase("chroma", open_chroma)
+            self._run_phase("indexes", build_indexes)
+            self._run_phase("qa_chain", build_qa_chain)
+            self._run_phase("warmup", warm_up)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.error(f"RAG MCP Error initializing during {self.phase}: {e}")
+            raise
+        self.phase = "ready"
+        self.ready = True
+        print(f"RAG MCP: ChromaDB initialized successfully with {vectordb._collection.count()} documents using {EMBEDDINGS_MODEL_NAME} embeddings on {EMBEDDINGS_BACKEND} ({RETRIEVER_MODE} retrieval) in {sum(self.timings.values()):.2f}s.")
+
+    async def run(self) -> None:
+        with suppress(Exception):
+            await asyncio.to_thread(self.load)
+
+    def not_ready_message(self) -> str:
+        if self.error:
+            return f"RAG system failed to initialize during {self.phase}: {self.error}"
+        return f"RAG system is still starting ({self.phase}). Try again shortly."
+
+    def report(self) -> dict:
+        status = "ready" if self.ready else "failed" if self.error else "starting"
+        return {
+            "status": status,
+            "phase": self.phase,
+            "timings": self.timings,
+            "total_seconds": round(sum(self.timings.values()), 3),
+            "error": self.error
+        }
 
-except Exception as e:
-    print(f"RAG MCP Error initializing ChromaDB or LangChain: {e}")
+startup = RagStartup()
+
+def init_worker() -> None:
+    """Called by gunicorn in each forked worker to split the cores between workers."""
+    threads = int(os.getenv("RAG_WORKER_THREADS", "0")) or max(1, (os.cpu_count() or 1) // WORKERS)
+    if EMBEDDINGS_BACKEND == "torch":
+        import torch
+        torch.set_num_threads(threads)
+
+if PRELOAD:
+    # Loaded in the gunicorn master so the forked workers share the weights
+    startup.load_models()
 
 @mcp.tool()
 async def query_docs(query: str) -> dict:
@@ -102,7 +1205,7 @@ async def query_docs(query: str) -> dict:
     """
     try:
         if qa_chain is None:
-            return {"answer": "RAG system not initialized. Check server logs for errors.", "source_documents": []}
+            return {"answer": startup.not_ready_message(), "source_documents": []}
 
         result = await qa_chain.ainvoke({"input": query})
 
@@ -119,10 +1222,542 @@ async def query_docs(query: str) -> dict:
         print(f"RAG MCP Error querying documents for '{query}': {e}")
         return {"answer": f"Error querying documents: {e}", "source_documents": []}
 
+def budget_chunks(scored_docs: list, max_tokens: int) -> tuple:
+    """Keeps (doc, score) pairs in order until max_tokens is used, trimming the last one to fit."""
+    chunks, used = [], 0
+    for doc, score in scored_docs:
+        remaining = max_tokens - used
+        if remaining < 32:
+            break
+        content = truncate_to_tokens(doc.page_content, remaining)
+        tokens = estimate_tokens(content)
+        chunks.append({
+            "page_content": content,
+            "metadata": doc.metadata,
+            "score": round(float(score), 4),
+            "tokens": tokens,
+            "truncated": len(content) < len(doc.page_content)
+        })
+        used += tokens
+    return chunks, used
+
+@mcp.tool()
+async def retrieve_docs(
+    query: str,
+    k: int = 4,
+    score_threshold: float | None = None,
+    filters: dict | None = None,
+    max_tokens: int = 1500,
+    mode: str | None = None
+) -> dict:
+    """
+    Retrieves the most relevant document chunks for a query without generating an answer.
+    Prefer this over query_docs when you will write the answer yourself, since it skips
+    the internal LLM call.
+    Args:
+        query: The natural language query to search documents for.
+        k: Maximum number of chunks to return (max 20).
+        score_threshold: Optional minimum vector relevance score, usually between 0 and 1. It filters
+            dense matches only; in hybrid mode keyword matches are kept, and bm25 ignores it.
+        filters: Exact-match metadata filters, e.g. {"source": "report.pdf"}.
+        max_tokens: Approximate token budget for all returned chunks together.
+        mode: "dense", "bm25" or "hybrid". Use bm25 or hybrid for exact tokens such as error codes.
+    Returns:
+        A dictionary containing the chunks with their metadata and scores. When the server
+        reranks (RAG_RERANK), a wider candidate set is scored and the scores are cross-encoder scores.
+    """
+    mode = mode or RETRIEVER_MODE
+    try:
+        if not startup.ready:
+            return {"chunks": [], "error": startup.not_ready_message()}
+
+        k = max(1, min(k, 20))
+        if reranker is None:
+            scored_docs = await asearch_documents(query, k, filters, score_threshold, mode)
+        else:
+            candidates = await asearch_documents(query, max(k, RERANK_CANDIDATES), filters, score_threshold, mode)
+            scored_docs = await reranker.arerank(query, candidates, k)
+        chunks, used = budget_chunks(scored_docs, max_tokens)
+        return {"query": query, "mode": mode, "chunks": chunks, "total_tokens": used}
+    except Exception as e:
+        logger.error(f"RAG MCP Error retrieving documents for '{query}': {e}")
+        return {"query": query, "chunks": [], "error": f"Error retrieving documents: {e}"}
+
+
+# --- Web result cache ---
+web_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+
+def purge_expired_web_results() -> None:
+    web_vectordb._collection.delete(where={"expires_at": {"$lt": time.time()}})
+
+def ingest_web_results(items: list, query: str = "", ttl_hours: float | None = None) -> int:
+    """
+    Chunks and embeds fetched web results into the web cache collection.
+    Each item is {"url", "title", "text", "provider", "kind"}, where kind is "page" for
+    fetched page text and "snippet" (the default) for a search result snippet. Earlier
+    chunks of the same URL and kind are replaced; a snippet is skipped while the full
+    page is cached. Returns the number of chunks written.
+    """
+    now = time.time()
+    expires_at = now + (ttl_hours or WEB_CACHE_TTL_HOURS) * 3600
+    documents, ids = [], []
+    for item in items:
+        url, text = item.get("url"), (item.get("text") or "").strip()
+        kind = "page" if item.get("kind") == "page" else "snippet"
+        if not url or not text:
+            continue
+        if kind == "snippet" and web_vectordb._collection.get(
+            where={"$and": [{"url": url}, {"kind": "page"}, {"expires_at": {"$gte": now}}]}, limit=1, include=[]
+        )["ids"]:
+            continue
+        web_vectordb._collection.delete(where={"$and": [{"url": url}, {"kind": kind}]})
+        for i, chunk in enumerate(web_splitter.split_text(text)):
+            documents.append(Document(page_content=chunk, metadata={
+                "url": url,
+                "kind": kind,
+                "title": item.get("title") or "",
+                "provider": item.get("provider") or "",
+                "query": query,
+                "fetched_at": now,
+                "expires_at": expires_at
+            }))
+            ids.append(hashlib.sha1(f"{url}\0{kind}\0{i}".encode()).hexdigest())
+    if documents:
+        web_vectordb.add_documents(documents, ids=ids)
+    purge_expired_web_results()
+    return len(documents)
+
+def search_web_results(query: str, k: int = 5, max_age_hours: float = 24, min_score: float | None = None) -> list:
+    """Returns unexpired cached web chunks fetched within max_age_hours, best first."""
+    now = time.time()
+    # Expired chunks are only purged on the next ingest, so they are filtered out here too
+    hits = web_vectordb.similarity_search_with_relevance_scores(
+        query, k=k, filter={"$and": [{"fetched_at": {"$gte": now - max_age_hours * 3600}}, {"expires_at": {"$gte": now}}]}
+    )
+    return [{
+        "page_content": doc.page_content,
+        "metadata": doc.metadata,
+        "score": round(score, 4),
+        "age_hours": round((time.time() - doc.metadata.get("fetched_at", 0)) / 3600, 2)
+    } for doc, score in hits if min_score is None or score >= min_score]
+
+@mcp.tool()
+async def search_web_cache(query: str, max_age_hours: float = 24, k: int = 5) -> dict:
+    """
+    Searches web results fetched earlier by the web tools, before paying for a new web search.
+    Args:
+        query: The natural language query.
+        max_age_hours: Ignore results fetched longer ago than this.
+        k: Maximum number of chunks to return.
+    Returns:
+        A dictionary with matching chunks, their source URLs, scores and age.
+    """
+    if web_vectordb is None:
+        return {"results": [], "error": startup.not_ready_message()}
+    result = await web_cache_lookup(query, k, max_age_hours)
+    if result["status"] != "success":
+        return {"query": query, "results": [], "error": result["message"]}
+    return {"query": query, "results": result["results"]}
+
+class WebIngestRequest(BaseModel):
+    items: list[dict]
+    query: str = ""
+    ttl_hours: float | None = None
+
+class WebSearchRequest(BaseModel):
+    query: str
+    k: int = 5
+    max_age_hours: float = 24
+    min_score: float | None = None
+
+# --- Live document writes ---
+WRITE_BATCH_CHUNKS = int(os.getenv("RAG_WRITE_BATCH_CHUNKS", "64"))
+WRITE_BATCH_WINDOW = float(os.getenv("RAG_WRITE_BATCH_WINDOW_MS", "50")) / 1000
+WRITE_QUEUE_SIZE = int(os.getenv("RAG_WRITE_QUEUE_SIZE", "1000"))
+
+# Same chunking as scripts/load_initial_rag_data.py
+document_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+
+def invalid_metadata(metadata: dict | None) -> list:
+    """Keys whose values Chroma cannot store."""
+    return [key for key, value in (metadata or {}).items() if not isinstance(value, (str, int, float, bool))]
+
+def document_chunks(doc_id: str, content: str, metadata: dict | None) -> list:
+    """Splits a document into (chunk_id, text, metadata) with ids stable for unchanged text."""
+    chunks, seen = [], Counter()
+    for text in document_splitter.split_text(content):
+        chunk_metadata = {**(metadata or {}), "doc_id": doc_id}
+        chunks.append((stable_chunk_id(doc_id, text, seen[text]), text, chunk_metadata))
+        seen[text] += 1
+    return chunks
+
+class DocumentWriter:
+    """
+    Applies add/upsert/delete requests in the background so queries never wait on ingestion.
+    Requests arriving within WRITE_BATCH_WINDOW are handled together: their new chunks are
+    embedded in one model call off the event loop, then written to Chroma and to the BM25
+    index. Chunks whose text did not change keep their ids and are not embedded again.
+    Query vectors in the embedding cache do not depend on the corpus and stay valid.
+    """
+    def __init__(self, maxsize: int = WRITE_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.queue = None  # created on the serving event loop by start()
+        self.stats = {
+            "documents_written": 0, "documents_deleted": 0, "chunks_embedded": 0,
+            "chunks_deleted": 0, "batches": 0, "errors": 0
+        }
+
+    def start(self) -> asyncio.Task:
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        return asyncio.create_task(self.run())
+
+    async def submit(self, op: dict) -> asyncio.Future:
+        """Queues an operation, waiting while the queue is full, and returns a future for its result."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((op, future))
+        return future
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + WRITE_BATCH_WINDOW
+            chunks = len(batch[0][0].get("chunks", ()))
+            while chunks < WRITE_BATCH_CHUNKS and (timeout := deadline - loop.time()) > 0:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                chunks += len(item[0].get("chunks", ()))
+            try:
+                results = await asyncio.to_thread(self._apply, [op for op, _ in batch])
+            except Exception as e:
+                logger.error(f"RAG MCP Error applying {len(batch)} document writes: {e}")
+                self.stats["errors"] += 1
+                results = [{"status": "error", "doc_id": op["doc_id"], "message": str(e)} for op, _ in batch]
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _apply(self, ops: list) -> list:
+        collection = vectordb._collection
+        # Stored chunks are reused, unless an earlier op in this batch may delete them first
+        op_counts = Counter(op["doc_id"] for op in ops)
+        volatile = {op["doc_id"] for op in ops if op["action"] == "delete" or op_counts[op["doc_id"]] > 1}
+        new_ids = [chunk_id for op in ops for chunk_id, _, _ in op.get("chunks", ())]
+        present = set(collection.get(ids=new_ids, include=[])["ids"]) if new_ids else set()
+        to_embed = {
+            chunk_id: text
+            for op in ops if op["action"] == "upsert"
+            for chunk_id, text, _ in op["chunks"]
+            if chunk_id not in present or op["doc_id"] in volatile
+        }
+        vectors = dict(zip(to_embed, embedding_service.embed_documents(list(to_embed.values())))) if to_embed else {}
+        sentence_sets = {}
+        if sentence_vectors is not None and to_embed:
+            sentence_sets = dict(zip(to_embed, embed_sentences(embedding_service, list(to_embed.values()))))
+        self.stats["chunks_embedded"] += len(vectors)
+        self.stats["batches"] += 1
+
+        results = []
+        for op in ops:
+            doc_id = op["doc_id"]
+            existing = set(collection.get(where={"doc_id": doc_id}, include=[])["ids"])
+            keep = {chunk_id for chunk_id, _, _ in op.get("chunks", ())}
+            stale = sorted(existing - keep)
+            if stale:
+                collection.delete(ids=stale)
+                bm25_index.remove(stale)
+                if compact_store is not None:
+                    compact_store.remove(stale)
+                if sentence_vectors is not None:
+                    sentence_vectors.delete(stale)
+            # A stored chunk with the same id has the same text, so only embedded chunks are written
+            written = [chunk for chunk in op.get("chunks", ()) if chunk[0] in vectors]
+            if written:
+                ids, texts, metadatas = (list(column) for column in zip(*written))
+                collection.upsert(ids=ids, embeddings=[vectors[i] for i in ids], documents=texts, metadatas=metadatas)
+                bm25_index.add(ids, texts, metadatas)
+                if compact_store is not None:
+                    compact_store.add(ids, [vectors[i] for i in ids])
+                if sentence_sets:
+                    sentence_vectors.put_many((i, sentence_sets[i]) for i in ids)
+            updated = self._update_metadata(collection, [chunk for chunk in op.get("chunks", ()) if chunk[0] not in vectors])
+            self.stats["chunks_deleted"] += len(stale)
+            self.stats["documents_deleted" if op["action"] == "delete" else "documents_written"] += 1
+            results.append({
+                "status": "success",
+                "doc_id": doc_id,
+                "chunks": len(keep),
+                "chunks_written": len(written),
+                "chunks_updated": updated,
+                "chunks_deleted": len(stale)
+            })
+        return results
+
+    def _update_metadata(self, collection, kept: list) -> int:
+        """Writes new metadata for kept chunks whose stored metadata differs; returns how many changed."""
+        if not kept:
+            return 0
+        stored = collection.get(ids=[chunk_id for chunk_id, _, _ in kept], include=["metadatas"])
+        stored_metadata = dict(zip(stored["ids"], stored["metadatas"]))
+        changed = [chunk for chunk in kept if (stored_metadata.get(chunk[0]) or {}) != chunk[2]]
+        if not changed:
+            return 0
+        ids, texts, metadatas = (list(column) for column in zip(*changed))
+        # Chroma merges metadata on update, so keys the new metadata dropped are cleared explicitly
+        collection.update(ids=ids, metadatas=[
+            {**{key: None for key in stored_metadata.get(chunk_id) or {}}, **metadata}
+            for chunk_id, metadata in zip(ids, metadatas)
+        ])
+        bm25_index.add(ids, texts, metadatas)
+        return len(changed)
+
+    def report(self) -> dict:
+        return {**self.stats, "queued": self.queue.qsize() if self.queue else 0, "capacity": self.maxsize}
+
+document_writer = DocumentWriter()
+
+async def spool_write(op: dict, wait: bool) -> dict:
+    """Hands a write to the writer process; with wait, returns its result once applied."""
+    op_id = await asyncio.to_thread(write_spool.put, {**op, "reply": wait})
+    if wait and (result := await write_spool.result(op_id, SPOOL_WAIT_SECONDS)) is not None:
+        return result
+    return {"status": "queued", "doc_id": op.get("doc_id"), "spooled": op_id}
+
+async def queue_document_write(op: dict, wait: bool) -> dict:
+    if not startup.ready:
+        return {"status": "error", "message": startup.not_ready_message()}
+    if not writer_lock.held:
+        return await spool_write(op, wait)
+    if document_writer.queue is None:
+        return {"status": "error", "message": "Document writer is not running."}
+    future = await document_writer.submit(op)
+    if wait:
+        return await future
+    return {"status": "queued", "doc_id": op["doc_id"], "queued": document_writer.queue.qsize()}
+
+async def apply_web_search(op: dict) -> dict:
+    try:
+        results = await asyncio.to_thread(search_web_results, op["query"], op["k"], op["max_age_hours"], op.get("min_score"))
+    except Exception as e:
+        logger.error(f"RAG MCP Error searching web cache for '{op['query']}': {e}")
+        return {"status": "error", "message": str(e)}
+    return {"status": "success", "results": results}
+
+async def web_cache_lookup(query: str, k: int, max_age_hours: float, min_score: float | None = None) -> dict:
+    """
+    Searches the web cache in the writer process. The cache is a Chroma collection, whose
+    in-memory index only sees the results written by its own process, so other workers
+    pass the search through the write spool and wait for the answer.
+    """
+    op = {"action": "web_search", "query": query, "k": k, "max_age_hours": max_age_hours, "min_score": min_score}
+    if writer_lock.held or WORKERS == 1:
+        return await apply_web_search(op)
+    result = await spool_write(op, wait=True)
+    if result.get("status") == "queued":
+        return {"status": "error", "message": "The writer did not answer the web cache search in time."}
+    return result
+
+async def apply_web_ingest(op: dict) -> dict:
+    try:
+        chunks = await asyncio.to_thread(ingest_web_results, op["items"], op.get("query", ""), op.get("ttl_hours"))
+    except Exception as e:
+        logger.error(f"RAG MCP Error ingesting web results: {e}")
+        return {"status": "error", "message": str(e)}
+    return {"status": "success", "chunks": chunks}
+
+async def complete_spooled_write(op_id: str, reply: bool, future: asyncio.Future) -> None:
+    result = await future
+    await asyncio.to_thread(write_spool.complete, op_id, result if reply else None)
+
+async def consume_spool() -> None:
+    """Feeds writes (and web cache searches) spooled by the other workers into this process's writers, oldest first."""
+    expired_at = 0.0
+    completions = set()
+    while True:
+        try:
+            claimed = await asyncio.to_thread(write_spool.claim)
+        except OSError as e:
+            logger.error(f"RAG MCP Error reading the write spool: {e}")
+            claimed = []
+        for op_id, op in claimed:
+            reply = op.pop("reply", False)
+            if op["action"] in ("web_ingest", "web_search"):
+                result = await (apply_web_ingest if op["action"] == "web_ingest" else apply_web_search)(op)
+                await asyncio.to_thread(write_spool.complete, op_id, result if reply else None)
+                continue
+            future = await document_writer.submit(op)
+            # Completing writes files, so it runs off the event loop once the write is applied
+            task = asyncio.create_task(complete_spooled_write(op_id, reply, future))
+            completions.add(task)
+            task.add_done_callback(completions.discard)
+        if time.monotonic() - expired_at > SPOOL_RESULT_TTL_SECONDS:
+            expired_at = time.monotonic()
+            await asyncio.to_thread(write_spool.expire_results)
+        await asyncio.sleep(SPOOL_POLL_SECONDS)
+
+async def serve_writes() -> None:
+    """
+    Runs the document writer and the spool consumer in the writer process. Other workers wait
+    here and take over when the writer exits and its lock is released.
+    """
+    while not (startup.ready and writer_lock.acquire()):
+        if startup.error:
+            return
+        await asyncio.sleep(WRITER_ELECTION_SECONDS if startup.ready else 0.1)
+    logger.info(f"RAG MCP: process {os.getpid()} is the writer.")
+    if compact_store is not None:
+        compact_store.read_only = False
+    writer_task = document_writer.start()
+    try:
+        await consume_spool()
+    finally:
+        writer_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await writer_task
+
+async def queue_upsert(doc_id: str, content: str, metadata: dict | None, wait: bool) -> dict:
+    bad_keys = invalid_metadata(metadata)
+    if bad_keys:
+        return {"status": "error", "message": f"Metadata values must be str, int, float or bool: {', '.join(bad_keys)}"}
+    if not content.strip():
+        return {"status": "error", "message": "Document content is empty"}
+    chunks = document_chunks(doc_id, content, metadata)
+    return await queue_document_write({"action": "upsert", "doc_id": doc_id, "chunks": chunks}, wait)
+
+@mcp.tool()
+async def add_document(content: str, metadata: dict | None = None, doc_id: str | None = None, wait: bool = False) -> dict:
+    """
+    Adds a document to the knowledge base. Adding the same content again is a no-op.
+    Args:
+        content: The document text. It is chunked and embedded in the background.
+        metadata: Optional flat metadata, e.g. {"source": "meeting-notes"}.
+        doc_id: Optional id for later updates or deletion; defaults to a hash of the content.
+        wait: Wait until the document is searchable instead of returning once queued.
+    Returns:
+        A dictionary with the document id and the write status.
+    """
+    return await queue_upsert(doc_id or content_hash(content)[:16], content, metadata, wait)
+
+@mcp.tool()
+async def upsert_document(doc_id: str, content: str, metadata: dict | None = None, wait: bool = False) -> dict:
+    """
+    Replaces the document with this id, or adds it if it does not exist.
+    Only chunks whose text changed are embedded again.
+    Args:
+        doc_id: The id the document was added under.
+        content: The new document text.
+        metadata: Optional flat metadata.
+        wait: Wait until the change is searchable instead of returning once queued.
+    Returns:
+        A dictionary with the document id and the write status.
+    """
+    return await queue_upsert(doc_id, content, metadata, wait)
+
+@mcp.tool()
+async def delete_document(doc_id: str, wait: bool = False) -> dict:
+    """
+    Removes a document and all of its chunks from the knowledge base.
+    Args:
+        doc_id: The id the document was added under.
+        wait: Wait until the document is gone instead of returning once queued.
+    Returns:
+        A dictionary with the document id and the write status.
+    """
+    return await queue_document_write({"action": "delete", "doc_id": doc_id}, wait)
+
+class DocumentRequest(BaseModel):
+    content: str
+    metadata: dict | None = None
+    doc_id: str | None = None
+    wait: bool = False
 
 # --- FastMCP to FastAPI Integration ---
 http_mcp = mcp.http_app(transport="streamable-http")
-app = FastAPI(lifespan=http_mcp.router.lifespan_context)
+
+@asynccontextmanager
+async def combined_lifespan(app: FastAPI):
+    # Bind first; /ready reports when the background startup has finished
+    startup_task = asyncio.create_task(startup.run())
+    writer_task = asyncio.create_task(serve_writes())
+
+    async with http_mcp.router.lifespan_context(app) as maybe_state:
+        yield maybe_state
+
+    # Finish queued writes before stopping, but do not hang shutdown on them
+    if document_writer.queue is not None:
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(document_writer.queue.join(), timeout=30)
+    for task in (writer_task, startup_task):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    logger.info("RAG MCP document writer stopped.")
+
+app = FastAPI(lifespan=combined_lifespan)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    report = startup.report()
+    return JSONResponse(report, status_code=200 if startup.ready else 503)
+
+@app.post("/documents")
+async def documents_add(request: DocumentRequest):
+    doc_id = request.doc_id or content_hash(request.content)[:16]
+    return await queue_upsert(doc_id, request.content, request.metadata, request.wait)
+
+@app.delete("/documents/{doc_id}")
+async def documents_delete(doc_id: str, wait: bool = False):
+    return await queue_document_write({"action": "delete", "doc_id": doc_id}, wait)
+
+@app.get("/documents/stats")
+async def documents_stats():
+    return {
+        **document_writer.report(),
+        "indexed_chunks": len(bm25_index.docs),
+        "pid": os.getpid(),
+        "writer": writer_lock.held
+    }
+
+@app.post("/web-cache/ingest")
+async def web_cache_ingest(request: WebIngestRequest):
+    if web_vectordb is None:
+        return {"status": "error", "message": startup.not_ready_message()}
+    op = {"action": "web_ingest", "items": request.items, "query": request.query, "ttl_hours": request.ttl_hours}
+    if not writer_lock.held:
+        return await spool_write(op, wait=True)
+    return await apply_web_ingest(op)
+
+@app.post("/web-cache/search")
+async def web_cache_search(request: WebSearchRequest):
+    if web_vectordb is None:
+        return {"status": "error", "message": startup.not_ready_message(), "results": []}
+    result = await web_cache_lookup(request.query, request.k, request.max_age_hours, request.min_score)
+    return {"results": [], **result}
+
+@app.get("/stats/embeddings")
+async def embedding_stats():
+    report = embedding_service.report()
+    if reranker is not None:
+        report["rerank"] = reranker.stats
+    if compact_store is not None:
+        report["compact_vectors"] = compact_store.report()
+    if COMPRESS_ENABLED:
+        with _sentence_cache_lock:
+            report["compression"] = {
+                **compression_stats,
+                "ratio": round(compression_stats["tokens_out"] / compression_stats["tokens_in"], 3) if compression_stats["tokens_in"] else 0.0
+            }
+    return report
+
 app.mount("/", http_mcp)
 logger.info("RAG MCP server initialized and tools registered.")
 
@@ -1,9 +1,25 @@
 import os
+import asyncio
+import codecs
+import functools
+import ipaddress
+import json
 import logging
+import socket
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timezone
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+import httpcore
 import httpx
 from fastapi import FastAPI, HTTPException
 from fastmcp import FastMCP
 from dotenv import load_dotenv
+from common.utils import estimate_tokens, truncate_to_tokens
 
 load_dotenv()
 
@@ -33,102 +49,610 @@ if not NEWSAPI_KEY:
 
 mcp = FastMCP("multi_search")
 
+# --- Response cache ---
+WEB_CACHE_MAX_ENTRIES = int(os.getenv("WEB_CACHE_MAX_ENTRIES", "2000"))
+# Cache misses fetch at least this many results so later, larger requests can still hit
+WEB_CACHE_FETCH_RESULTS = int(os.getenv("WEB_CACHE_FETCH_RESULTS", "10"))
+CACHE_TTLS = {
+    "serpapi": int(os.getenv("WEB_CACHE_TTL_SERPAPI", "3600")),
+    "google": int(os.getenv("WEB_CACHE_TTL_GOOGLE", "3600")),
+    "newsapi": int(os.getenv("WEB_CACHE_TTL_NEWSAPI", "900")),
+    "stackoverflow": int(os.getenv("WEB_CACHE_TTL_STACKOVERFLOW", "1800")),
+    "weather": int(os.getenv("WEB_CACHE_TTL_WEATHER", "600")),
+}
+# Approximate price of one upstream call in USD, used to report the spend avoided by cache hits
+PROVIDER_CALL_COST = {
+    "serpapi": float(os.getenv("WEB_COST_SERPAPI", "0.015")),
+    "google": float(os.getenv("WEB_COST_GOOGLE", "0.002")),
+    "newsapi": float(os.getenv("WEB_COST_NEWSAPI", "0.0")),
+    "stackoverflow": float(os.getenv("WEB_COST_STACKOVERFLOW", "0.0")),
+    "weather": float(os.getenv("WEB_COST_WEATHER", "0.0")),
+}
+
+def normalize_query(query: str) -> str:
+    """Case-folds and collapses whitespace so trivially different queries share an entry."""
+    return " ".join(query.casefold().split())
+
+class ResponseCache:
+    """
+    Bounded LRU cache of upstream results keyed by (provider, normalized query).
+    Each entry remembers how many results were requested upstream, so a request
+    for fewer results is served from it, as is any request when upstream
+    returned fewer results than were asked for.
+    """
+    def __init__(self, max_entries: int, ttls: dict):
+        self.max_entries = max_entries
+        self.ttls = ttls
+        self._entries = OrderedDict()
+        self.stats = {provider: {"hits": 0, "misses": 0} for provider in ttls}
+
+    def get(self, provider: str, query: str, num_results: int = 1):
+        key = (provider, normalize_query(query))
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched, expires_at = entry
+            exhausted = isinstance(value, list) and len(value) < fetched
+            if expires_at > time.time() and (num_results <= fetched or exhausted):
+                self._entries.move_to_end(key)
+                self.stats[provider]["hits"] += 1
+                return value[:num_results] if isinstance(value, list) else value
+            if expires_at <= time.time():
+                del self._entries[key]
+        self.record_miss(provider)
+        return None
+
+    def record_miss(self, provider: str):
+        """Counts a lookup that went upstream without consulting the cache."""
+        self.stats[provider]["misses"] += 1
+
+    def set(self, provider: str, query: str, value, fetched: int = 1):
+        key = (provider, normalize_query(query))
+        self._entries[key] = (value, fetched, time.time() + self.ttls[provider])
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def report(self) -> dict:
+        providers = {}
+        for provider, counts in self.stats.items():
+            lookups = counts["hits"] + counts["misses"]
+            providers[provider] = {
+                **counts,
+                "hit_rate": round(counts["hits"] / lookups, 4) if lookups else 0.0,
+                "upstream_spend_avoided_usd": round(counts["hits"] * PROVIDER_CALL_COST.get(provider, 0.0), 4)
+            }
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "upstream_spend_avoided_usd": round(sum(p["upstream_spend_avoided_usd"] for p in providers.values()), 4),
+            "providers": providers
+        }
+
+response_cache = ResponseCache(WEB_CACHE_MAX_ENTRIES, CACHE_TTLS)
+
+# --- Provider quota accounting ---
+WEB_QUOTA_STATE = os.getenv("WEB_QUOTA_STATE", "./web_state/quota.json")
+WEB_QUOTA_THROTTLE_AT = float(os.getenv("WEB_QUOTA_THROTTLE_AT", "0.8"))  # fraction used before pacing starts
+WEB_QUOTA_MAX_WAIT = float(os.getenv("WEB_QUOTA_MAX_WAIT", "5"))  # longer waits fail fast instead
+# "<calls>/<day|month>" per provider, matching the free tiers by default
+QUOTA_LIMITS = {
+    "serpapi": os.getenv("WEB_QUOTA_SERPAPI", "100/month"),
+    "google": os.getenv("WEB_QUOTA_GOOGLE", "500/month"),
+    "newsapi": os.getenv("WEB_QUOTA_NEWSAPI", "100/day"),
+    "stackoverflow": os.getenv("WEB_QUOTA_STACKOVERFLOW", "10000/day"),
+    "weather": os.getenv("WEB_QUOTA_WEATHER", "1000/day"),
+}
+
+class QuotaExceeded(RuntimeError):
+    pass
+
+def _parse_count(value) -> int | None:
+    """Reads a provider-reported call count, or None if it is missing or malformed ("1.0", "")."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+class QuotaTracker:
+    """
+    Counts upstream calls per provider and quota period (UTC day or month), persisted
+    to a JSON file. Once a provider has used WEB_QUOTA_THROTTLE_AT of its quota, calls
+    are paced so the remainder lasts until the period resets. Provider-reported
+    remaining quota and backoff requests (StackExchange, RapidAPI) override the local view.
+    """
+    def __init__(self, path: str, limits: dict):
+        self.path = path
+        self.limits = {}
+        for provider, spec in limits.items():
+            count, _, period = spec.partition("/")
+            if period not in ("day", "month"):
+                raise ValueError(f"Invalid quota '{spec}' for {provider}: use <calls>/day or <calls>/month")
+            self.limits[provider] = (int(count), period)
+        self.state = {provider: self._fresh_state(provider) for provider in self.limits}
+        self._dirty = False
+        self._lock = asyncio.Lock()
+        self._load()
+
+    def _period_bounds(self, provider: str, now: float) -> tuple:
+        current = datetime.fromtimestamp(now, timezone.utc)
+        if self.limits[provider][1] == "day":
+            start = current.replace(hour=0, minute=0, second=0, microsecond=0)
+            end = start.timestamp() + 86400
+        else:
+            start = current.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            end = (start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)).timestamp()
+        return start.timestamp(), end
+
+    def _fresh_state(self, provider: str) -> dict:
+        start, _ = self._period_bounds(provider, time.time())
+        return {"period_start": start, "used": 0, "remote_remaining": None, "backoff_until": 0.0, "last_call": 0.0}
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable quota state {self.path}: {e}")
+            return
+        for provider, state in saved.items():
+            if provider in self.state:
+                self.state[provider].update(state)
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    def _current(self, provider: str, now: float) -> dict:
+        state = self.state[provider]
+        start, _ = self._period_bounds(provider, now)
+        if state["period_start"] != start:
+            state.update({**self._fresh_state(provider), "backoff_until": state["backoff_until"]})
+            self._dirty = True
+        return state
+
+    def remaining(self, provider: str) -> int:
+        state = self._current(provider, time.time())
+        remaining = self.limits[provider][0] - state["used"]
+        if state["remote_remaining"] is not None:
+            remaining = min(remaining, state["remote_remaining"])
+        return max(0, remaining)
+
+    def _required_wait(self, provider: str, now: float) -> float:
+        state = self._current(provider, now)
+        wait = max(0.0, state["backoff_until"] - now)
+        limit = self.limits[provider][0]
+        remaining = self.remaining(provider)
+        if remaining <= 0:
+            raise QuotaExceeded(f"{provider} quota exhausted until {datetime.fromtimestamp(self._period_bounds(provider, now)[1], timezone.utc).isoformat()}")
+        if state["used"] >= limit * WEB_QUOTA_THROTTLE_AT:
+            spacing = (self._period_bounds(provider, now)[1] - now) / remaining
+            wait = max(wait, state["last_call"] + spacing - now)
+        return wait
+
+    async def acquire(self, provider: str):
+        """Waits for (or refuses) the next upstream call to `provider` and counts it."""
+        # The slot is reserved before sleeping, so concurrent callers queue behind it
+        # instead of all reading the same last_call and firing together
+        async with self._lock:
+            now = time.time()
+            wait = self._required_wait(provider, now)
+            if wait > WEB_QUOTA_MAX_WAIT:
+                raise QuotaExceeded(f"{provider} is throttled to preserve its quota; retry in {wait:.0f}s")
+            state = self._current(provider, now)
+            state["used"] += 1
+            state["last_call"] = now + wait
+            if state["remote_remaining"] is not None:
+                state["remote_remaining"] -= 1
+            self._dirty = True
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def observe(self, provider: str, remaining=None, backoff=None):
+        """Applies quota information reported by the provider."""
+        # Runs after a successful (and counted) call, so a bad header must not fail it
+        state = self._current(provider, time.time())
+        remaining = _parse_count(remaining)
+        if remaining is not None:
+            state["remote_remaining"] = remaining
+        try:
+            backoff = float(backoff or 0)
+        except (TypeError, ValueError):
+            backoff = 0
+        if backoff > 0:
+            state["backoff_until"] = max(state["backoff_until"], time.time() + backoff)
+        self._dirty = True
+
+    def report(self) -> dict:
+        now = time.time()
+        report = {}
+        for provider, (limit, period) in self.limits.items():
+            state = self._current(provider, now)
+            start, end = self._period_bounds(provider, now)
+            remaining = self.remaining(provider)
+            rate_per_hour = state["used"] / max((now - start) / 3600, 1 / 60)
+            exhaustion = now + remaining / rate_per_hour * 3600 if state["used"] else None
+            report[provider] = {
+                "limit": limit,
+                "period": period,
+                "used": state["used"],
+                "remaining": remaining,
+                "provider_reported_remaining": state["remote_remaining"],
+                "calls_per_hour": round(rate_per_hour, 2),
+                "resets_at": datetime.fromtimestamp(end, timezone.utc).isoformat(),
+                "projected_exhaustion": (
+                    datetime.fromtimestamp(exhaustion, timezone.utc).isoformat()
+                    if exhaustion is not None and exhaustion < end else None
+                ),
+                "throttled": state["used"] >= limit * WEB_QUOTA_THROTTLE_AT or state["backoff_until"] > now,
+                "backoff_until": (
+                    datetime.fromtimestamp(state["backoff_until"], timezone.utc).isoformat()
+                    if state["backoff_until"] > now else None
+                )
+            }
+        return report
+
+quota_tracker = QuotaTracker(WEB_QUOTA_STATE, QUOTA_LIMITS)
+
+def reports_quota(tool):
+    """Returns a refused or throttled upstream call as an error result instead of raising."""
+    @functools.wraps(tool)
+    async def wrapper(*args, **kwargs) -> dict:
+        try:
+            return await tool(*args, **kwargs)
+        except QuotaExceeded as e:
+            return {"status": "error", "message": str(e)}
+    return wrapper
+
+async def flush_quota_state_periodically():
+    while True:
+        await asyncio.sleep(10)
+        try:
+            await asyncio.to_thread(quota_tracker.save)
+        except Exception as e:
+            logger.warning(f"Saving quota state failed: {e}")
+
+# --- Optional reuse of web results through the rag-mcp web cache ---
+WEB_RAG_URL = os.getenv("WEB_RAG_URL", "").rstrip("/")  # e.g. http://rag-mcp-svc:9000; empty disables it
+WEB_RAG_MAX_AGE_HOURS = float(os.getenv("WEB_RAG_MAX_AGE_HOURS", "24"))
+WEB_RAG_MIN_SCORE = float(os.getenv("WEB_RAG_MIN_SCORE", "0.6"))
+WEB_RAG_MIN_HITS = int(os.getenv("WEB_RAG_MIN_HITS", "3"))
+WEB_RAG_MAX_PENDING = int(os.getenv("WEB_RAG_MAX_PENDING", "20"))
+
+_rag_ingest_tasks = set()
+
+async def _post_to_rag(items: list, query: str):
+    try:
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            r = await client.post(f"{WEB_RAG_URL}/web-cache/ingest", json={"items": items, "query": query})
+            r.raise_for_status()
+    except Exception as e:
+        logger.warning(f"Ingesting web results into RAG failed: {e}")
+
+def schedule_rag_ingest(items: list, query: str = ""):
+    """Sends results to rag-mcp in the background; dropped when too many sends are pending."""
+    if not WEB_RAG_URL or not items or len(_rag_ingest_tasks) >= WEB_RAG_MAX_PENDING:
+        return
+    task = asyncio.create_task(_post_to_rag(items, query))
+    _rag_ingest_tasks.add(task)
+    task.add_done_callback(_rag_ingest_tasks.discard)
+
+async def search_rag_cache(query: str, num_results: int, max_age_hours: float) -> list:
+    """Returns fresh cached web results from rag-mcp as search results, one per URL."""
+    try:
+        async with httpx.AsyncClient(timeout=2.0) as client:
+            r = await client.post(f"{WEB_RAG_URL}/web-cache/search", json={
+                "query": query,
+                "k": num_results * 2,
+                "max_age_hours": max_age_hours,
+                "min_score": WEB_RAG_MIN_SCORE
+            })
+            r.raise_for_status()
+            hits = r.json().get("results", [])
+    except Exception as e:
+        logger.warning(f"RAG web cache lookup failed: {e}")
+        return []
+    results, seen = [], set()
+    for hit in hits:
+        url = hit["metadata"].get("url")
+        if url in seen:
+            continue
+        seen.add(url)
+        results.append({
+            "title": hit["metadata"].get("title"),
+            "link": url,
+            "snippet": hit["page_content"],
+            "provider": "rag_cache",
+            "age_hours": hit.get("age_hours")
+        })
+    return results[:num_results]
+
+# --- Provider latency tracking for hedged search ---
+WEB_HEDGE_PERCENTILE = float(os.getenv("WEB_HEDGE_PERCENTILE", "0.9"))
+WEB_HEDGE_MIN_DELAY = float(os.getenv("WEB_HEDGE_MIN_DELAY", "0.3"))
+WEB_HEDGE_MAX_DELAY = float(os.getenv("WEB_HEDGE_MAX_DELAY", "3.0"))
+WEB_HEDGE_MERGE_WINDOW = float(os.getenv("WEB_HEDGE_MERGE_WINDOW", "0.25"))  # extra wait for the slower provider
+
+class ProviderStats:
+    """EWMA latency and error rate of one upstream provider, plus recent latencies for percentiles."""
+    def __init__(self, alpha: float = 0.2, window: int = 100):
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self._recent = deque(maxlen=window)
+
+    def record(self, latency: float, ok: bool):
+        self.calls += 1
+        self.error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.error_rate
+        if ok:
+            self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+            self._recent.append(latency)
+
+    def percentile(self, q: float) -> float | None:
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def score(self) -> float:
+        """Expected cost of trying this provider first; lower is better."""
+        latency = self.latency if self.latency is not None else 1.0
+        return latency * (1 + 4 * self.error_rate)
+
+    def report(self) -> dict:
+        return {
+            "calls": self.calls,
+            "ewma_latency_s": round(self.latency, 4) if self.latency is not None else None,
+            "p90_latency_s": round(self.percentile(0.9), 4) if self._recent else None,
+            "ewma_error_rate": round(self.error_rate, 4)
+        }
+
+provider_stats = {"serpapi": ProviderStats(), "google": ProviderStats()}
+
+@asynccontextmanager
+async def track_latency(provider: str):
+    """Records the latency and outcome of an upstream call; cancelled hedges are not counted."""
+    started = time.perf_counter()
+    try:
+        yield
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        provider_stats[provider].record(time.perf_counter() - started, ok=False)
+        raise
+    provider_stats[provider].record(time.perf_counter() - started, ok=True)
+
 @mcp.tool()
+@reports_quota
 async def serpapi_search(query: str, num_results: int = 5) -> dict:
     """
     Live web search via SerpApi.
     Returns top `num_results` organic results.
     """
+    results = response_cache.get("serpapi", query, num_results)
+    if results is not None:
+        return {"query": query, "results": results}
+
+    fetch_results = max(num_results, WEB_CACHE_FETCH_RESULTS)
     params = {
         "engine": "google",
         "q": query,
         "api_key": SERPAPI_KEY,
-        "num": num_results
+        "num": fetch_results
     }
     url = "https://serpapi.com/search.json"
-    async with httpx.AsyncClient(timeout=10) as client:
+    await quota_tracker.acquire("serpapi")
+    async with track_latency("serpapi"), httpx.AsyncClient(timeout=10) as client:
         r = await client.get(url, params=params)
         r.raise_for_status()
         data = r.json()
 
     results = []
-    for item in data.get("organic_results", [])[:num_results]:
+    for item in data.get("organic_results", [])[:fetch_results]:
         results.append({
             "title": item.get("title"),
             "link": item.get("link"),
             "snippet": item.get("snippet")
         })
-    return {"query": query, "results": results}
+    response_cache.set("serpapi", query, results, fetch_results)
+    schedule_rag_ingest([
+        {"url": r["link"], "title": r["title"], "text": r["snippet"], "provider": "serpapi"} for r in results
+    ], query)
+    return {"query": query, "results": results[:num_results]}
 
 
 
 @mcp.tool()
+@reports_quota
 async def stackoverflow_search(tag: str, num_results: int = 5) -> dict:
     """
     Search StackOverflow questions by tag.
     """
+    questions = response_cache.get("stackoverflow", tag, num_results)
+    if questions is not None:
+        return {"tag": tag, "questions": questions}
+
+    fetch_results = max(num_results, WEB_CACHE_FETCH_RESULTS)
     url = "https://api.stackexchange.com/2.3/questions"
     params = {
         "order": "desc",
         "sort": "activity",
-        "tagged": tag,
+        "tagged": normalize_query(tag),
         "site": "stackoverflow",
-        "pagesize": num_results,
-        "filter": "!nKzQUR3Egv" 
+        "pagesize": fetch_results,
+        "filter": "!nKzQUR3Egv",
+        "key": STACKEXCHANGE_KEY
     }
+    await quota_tracker.acquire("stackoverflow")
     async with httpx.AsyncClient(timeout=10) as client:
         r = await client.get(url, params=params)
         r.raise_for_status()
         data = r.json()
+    # StackExchange asks clients to honour `backoff` and reports the daily quota left
+    quota_tracker.observe("stackoverflow", remaining=data.get("quota_remaining"), backoff=data.get("backoff"))
 
     questions = [{
         "title": q.get("title"),
         "link": q.get("link")
     } for q in data.get("items", [])]
-    return {"tag": tag, "questions": questions}
+    response_cache.set("stackoverflow", tag, questions, fetch_results)
+    return {"tag": tag, "questions": questions[:num_results]}
 
 @mcp.tool()
+@reports_quota
 async def newsapi_org(topic: str, num_results: int = 5) -> dict:
     """
     Fetch top headlines on a topic via NewsAPI.org.
     """
-    params = {"q": topic, "pageSize": num_results, "apiKey": NEWSAPI_KEY}
+    headlines = response_cache.get("newsapi", topic, num_results)
+    if headlines is not None:
+        return {"topic": topic, "headlines": headlines}
+
+    fetch_results = max(num_results, WEB_CACHE_FETCH_RESULTS)
+    params = {"q": topic, "pageSize": fetch_results, "apiKey": NEWSAPI_KEY}
     url = "https://newsapi.org/v2/everything"
+    await quota_tracker.acquire("newsapi")
     async with httpx.AsyncClient(timeout=10) as client:
         r = await client.get(url, params=params)
         r.raise_for_status()
         data = r.json()
-    articles = data.get("articles", [])[:num_results]
+    articles = data.get("articles", [])[:fetch_results]
 
     headlines = [{
         "title": a.get("title"),
         "url": a.get("url"),
         "source": a.get("source", {}).get("name")
     } for a in articles]
-    return {"topic": topic, "headlines": headlines}
+    response_cache.set("newsapi", topic, headlines, fetch_results)
+    schedule_rag_ingest([{
+        "url": a.get("url"),
+        "title": a.get("title"),
+        "text": "\n".join(filter(None, [a.get("title"), a.get("description")])),
+        "provider": "newsapi"
+    } for a in articles], topic)
+    return {"topic": topic, "headlines": headlines[:num_results]}
 
 
 
-@mcp.tool()
-async def get_weather(city: str) -> dict:
-    """
-    Fetch current weather for a city via OpenWeatherMap.
-    """
+# --- Weather: canonical locations, shared client and batch lookups ---
+WEB_WEATHER_CONCURRENCY = int(os.getenv("WEB_WEATHER_CONCURRENCY", "5"))
+WEB_LOCATION_ALIASES = int(os.getenv("WEB_LOCATION_ALIASES", "5000"))
+
+# Normalized location string -> OpenWeather city id, learned from responses
+location_aliases = OrderedDict()
+_weather_client: httpx.AsyncClient | None = None
+
+def normalize_location(city: str) -> str:
+    """Canonical form of a free-form location: "Paris , FR " -> "paris,fr"."""
+    text = unicodedata.normalize("NFKC", city).casefold()
+    return ",".join(" ".join(part.split()) for part in text.split(",") if part.strip())
+
+def _remember_location(alias: str, location_id: int):
+    location_aliases[alias] = location_id
+    location_aliases.move_to_end(alias)
+    while len(location_aliases) > WEB_LOCATION_ALIASES:
+        location_aliases.popitem(last=False)
+
+def _get_weather_client() -> httpx.AsyncClient:
+    """One pooled client for all weather calls so batch lookups reuse connections."""
+    global _weather_client
+    if _weather_client is None or _weather_client.is_closed:
+        _weather_client = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=WEB_WEATHER_CONCURRENCY, max_keepalive_connections=WEB_WEATHER_CONCURRENCY)
+        )
+    return _weather_client
+
+async def _lookup_weather(city: str) -> tuple:
+    """Returns (weather, cache_hit) for a city, keyed by its canonical location id."""
+    location = normalize_location(city)
+    if not location:
+        raise ValueError("City must not be empty")
+    location_id = location_aliases.get(location)
+    if location_id is not None:
+        weather = response_cache.get("weather", f"id:{location_id}")
+        if weather is not None:
+            return weather, True
+    else:
+        # No canonical id yet, so there is no cache key to look up; still a miss
+        response_cache.record_miss("weather")
+
     url = "https://api.openweathermap.org/data/2.5/weather"
-    params = {"q": city, "appid": OPENWEATHER_API_KEY, "units": "metric"}
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        data = r.json()
+    params = {"appid": OPENWEATHER_API_KEY, "units": "metric"}
+    if location_id is not None:
+        params["id"] = location_id
+    else:
+        params["q"] = location
+    await quota_tracker.acquire("weather")
+    r = await _get_weather_client().get(url, params=params)
+    r.raise_for_status()
+    data = r.json()
 
-    return {
+    weather = {
         "city": data.get("name"),
+        "country": data.get("sys", {}).get("country"),
+        "location_id": data.get("id"),
         "description": data["weather"][0]["description"],
         "temperature_c": data["main"]["temp"],
         "humidity": data["main"]["humidity"]
     }
+    if weather["location_id"] is not None:
+        _remember_location(location, weather["location_id"])
+        if weather["city"] and weather["country"]:
+            _remember_location(normalize_location(f"{weather['city']},{weather['country']}"), weather["location_id"])
+        response_cache.set("weather", f"id:{weather['location_id']}", weather)
+    return weather, False
+
+@mcp.tool()
+@reports_quota
+async def get_weather(city: str) -> dict:
+    """
+    Fetch current weather for a city via OpenWeatherMap.
+    """
+    weather, _ = await _lookup_weather(city)
+    return weather
 
 @mcp.tool()
+async def get_weather_batch(cities: list[str]) -> dict:
+    """
+    Fetch current weather for several cities in one call, e.g. to compare them.
+    Cities may include a country code ("Paris, FR").
+    """
+    semaphore = asyncio.Semaphore(WEB_WEATHER_CONCURRENCY)
+    unique = list(dict.fromkeys(normalize_location(city) for city in cities))
+
+    async def lookup(location: str):
+        async with semaphore:
+            return await _lookup_weather(location)
+
+    outcomes = await asyncio.gather(*(lookup(location) for location in unique), return_exceptions=True)
+    by_location = dict(zip(unique, outcomes))
+
+    results, cache_hits = [], 0
+    for city in cities:
+        outcome = by_location[normalize_location(city)]
+        if isinstance(outcome, httpx.HTTPStatusError):
+            # The request URL carries the API key, so don't echo the exception text
+            results.append({"query": city, "error": f"Weather lookup failed with HTTP {outcome.response.status_code}"})
+        elif isinstance(outcome, Exception):
+            results.append({"query": city, "error": str(outcome)})
+        else:
+            weather, hit = outcome
+            cache_hits += hit
+            results.append({"query": city, **weather})
+    return {"count": len(results), "cache_hits": cache_hits, "results": results}
+
+@mcp.tool()
+@reports_quota
 async def google_search(query: str, num_results: int = 5) -> dict:
     """
     Live Google Web Search via RapidAPI.
@@ -138,26 +662,401 @@ async def google_search(query: str, num_results: int = 5) -> dict:
         "X-RapidAPI-Key": RAPIDAPI_KEY,
         "X-RapidAPI-Host": "google-search72.p.rapidapi.com"
     }
+    results = response_cache.get("google", query, num_results)
+    if results is not None:
+        return {"query": query, "results": results}
+
+    fetch_results = max(num_results, WEB_CACHE_FETCH_RESULTS)
     params = {
         "q": query,
-        "num": num_results
+        "num": fetch_results
     }
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    await quota_tracker.acquire("google")
+    async with track_latency("google"), httpx.AsyncClient(timeout=10.0) as client:
         resp = await client.get(url, headers=headers, params=params)
         resp.raise_for_status()
         data = resp.json()
+    quota_tracker.observe("google", remaining=resp.headers.get("x-ratelimit-requests-remaining"))
 
     results = []
-    for item in data.get("results", [])[:num_results]:
+    for item in data.get("results", [])[:fetch_results]:
         results.append({
             "title":       item.get("title"),
             "link":        item.get("link"),
             "description": item.get("description")
         })
+    response_cache.set("google", query, results, fetch_results)
+    schedule_rag_ingest([
+        {"url": r["link"], "title": r["title"], "text": r["description"], "provider": "google"} for r in results
+    ], query)
+
+    return {"query": query, "results": results[:num_results]}
+
+def _url_key(url: str) -> str:
+    """Normalizes a URL for de-duplication: scheme, www., fragment and trailing slash are ignored."""
+    parts = urlsplit(url or "")
+    host = parts.netloc.lower().removeprefix("www.")
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{host}{parts.path.rstrip('/')}{query}"
+
+def _describe_failure(error: BaseException) -> str:
+    """Names a provider failure without its text, which can include the request URL and its API key."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"{type(error).__name__} (HTTP {error.response.status_code})"
+    if isinstance(error, QuotaExceeded):
+        return str(error)
+    return type(error).__name__
+
+def _merge_results(result_lists: list, num_results: int) -> list:
+    """Interleaves ranked result lists, dropping URLs already seen."""
+    merged, seen = [], set()
+    for rank in range(max((len(results) for results in result_lists), default=0)):
+        for results in result_lists:
+            if rank < len(results):
+                key = _url_key(results[rank]["link"])
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(results[rank])
+    return merged[:num_results]
+
+async def _provider_results(provider: str, query: str, num_results: int) -> list:
+    """Runs one search backend and returns results as {title, link, snippet, provider}."""
+    data = await (serpapi_search if provider == "serpapi" else google_search)(query, num_results)
+    if data.get("status") == "error":
+        raise QuotaExceeded(data["message"])
+    if provider == "serpapi":
+        return [{**item, "provider": "serpapi"} for item in data["results"]]
+    return [{
+        "title": item.get("title"),
+        "link": item.get("link"),
+        "snippet": item.get("description"),
+        "provider": "google"
+    } for item in data["results"]]
+
+@mcp.tool()
+async def web_search(query: str, num_results: int = 5, max_age_hours: float = WEB_RAG_MAX_AGE_HOURS) -> dict:
+    """
+    Live web search across SerpApi and Google (RapidAPI). Queries the provider that is
+    currently fastest and more reliable, hedges to the other one if it is slow, and
+    merges both result lists (deduplicated by URL) when both answer in time.
+    When the RAG web cache is enabled, results fetched within `max_age_hours` are
+    reused instead; pass 0 to always search the live web.
+    """
+    if WEB_RAG_URL and max_age_hours > 0:
+        local_results = await search_rag_cache(query, num_results, max_age_hours)
+        if len(local_results) >= min(num_results, WEB_RAG_MIN_HITS):
+            return {"query": query, "providers": ["rag_cache"], "hedged": False, "results": local_results}
+
+    order = sorted(provider_stats, key=lambda p: provider_stats[p].score())
+    tasks = {asyncio.create_task(_provider_results(order[0], query, num_results)): order[0]}
+    hedge_delay = provider_stats[order[0]].percentile(WEB_HEDGE_PERCENTILE) or WEB_HEDGE_MAX_DELAY
+    hedge_delay = min(max(hedge_delay, WEB_HEDGE_MIN_DELAY), WEB_HEDGE_MAX_DELAY)
+
+    answered, errors = {}, {}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+        primary_ok = any(not task.exception() for task in done)
+        if not primary_ok:
+            tasks[asyncio.create_task(_provider_results(order[1], query, num_results))] = order[1]
+
+        pending = set(tasks)
+        merge_deadline = None
+        while pending:
+            timeout = None if merge_deadline is None else max(0.0, merge_deadline - time.perf_counter())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                if task.exception():
+                    errors[tasks[task]] = _describe_failure(task.exception())
+                else:
+                    answered[tasks[task]] = task.result()
+            if answered and merge_deadline is None:
+                merge_deadline = time.perf_counter() + WEB_HEDGE_MERGE_WINDOW
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if not answered:
+        raise RuntimeError(f"All search providers failed: {errors}")
+    providers = [p for p in order if p in answered]
+    return {
+        "query": query,
+        "providers": providers,
+        "hedged": len(tasks) > 1,
+        "results": _merge_results([answered[p] for p in providers], num_results)
+    }
+
+# --- Page fetching and text extraction ---
+WEB_FETCH_MAX_BYTES = int(os.getenv("WEB_FETCH_MAX_BYTES", str(2 * 1024 * 1024)))
+WEB_FETCH_TIMEOUT = float(os.getenv("WEB_FETCH_TIMEOUT", "10"))
+WEB_FETCH_CONCURRENCY = int(os.getenv("WEB_FETCH_CONCURRENCY", "4"))
+WEB_FETCH_MAX_TOKENS = int(os.getenv("WEB_FETCH_MAX_TOKENS", "4000"))
+WEB_PAGE_CACHE_ENTRIES = int(os.getenv("WEB_PAGE_CACHE_ENTRIES", "256"))
+WEB_PAGE_CACHE_TTL = int(os.getenv("WEB_PAGE_CACHE_TTL", "600"))  # revalidated with the ETag after this
+WEB_FETCH_MAX_REDIRECTS = int(os.getenv("WEB_FETCH_MAX_REDIRECTS", "5"))
+# fetch_page is LLM-callable, so cluster services, localhost and cloud metadata are off limits
+WEB_FETCH_ALLOW_PRIVATE = os.getenv("WEB_FETCH_ALLOW_PRIVATE", "false").lower() == "true"
+
+# HTML parsing is CPU-bound, so it runs on a small dedicated pool instead of the event loop
+extract_pool = ThreadPoolExecutor(max_workers=int(os.getenv("WEB_EXTRACT_WORKERS", "2")), thread_name_prefix="extract")
+fetch_semaphore = asyncio.Semaphore(WEB_FETCH_CONCURRENCY)
+
+class TextExtractor(HTMLParser):
+    """Incremental HTML-to-text converter that skips scripts, styles and page chrome."""
+    SKIP_TAGS = {"script", "style", "noscript", "svg", "nav", "footer", "header", "aside", "form", "iframe", "template"}
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "pre", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self._in_title = False
+        self._skip_depth = 0
+        self._parts = []
+        self.length = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == "title":
+            self._in_title = True
+        elif tag in self.BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == "title":
+            self._in_title = False
+        elif tag in self.BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data.strip()
+        elif not self._skip_depth:
+            text = " ".join(data.split())
+            if text:
+                self._parts.append(text + " ")
+                self.length += len(text) + 1
+
+    def text(self) -> str:
+        lines = (" ".join(line.split()) for line in "".join(self._parts).split("\n"))
+        return "\n".join(line for line in lines if line)
 
-    return {"query": query, "results": results}
+class PlainTextExtractor:
+    """Same interface as TextExtractor for text/plain responses."""
+    def __init__(self):
+        self.title = ""
+        self._parts = []
+        self.length = 0
+
+    def feed(self, data: str):
+        self._parts.append(data)
+        self.length += len(data)
+
+    def close(self):
+        pass
+
+    def text(self) -> str:
+        return "".join(self._parts).strip()
+
+# URL -> {"etag", "last_modified", "title", "text", "complete", "final_url", "fetched_at"}
+page_cache = OrderedDict()
+
+def _cache_page(url: str, entry: dict):
+    page_cache[url] = entry
+    page_cache.move_to_end(url)
+    while len(page_cache) > WEB_PAGE_CACHE_ENTRIES:
+        page_cache.popitem(last=False)
+
+async def _resolve_public(host: str, port: int) -> list:
+    """Resolves host, raising ValueError unless every address is public or WEB_FETCH_ALLOW_PRIVATE is set."""
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ValueError(f"Cannot resolve {host}: {e}")
+    addresses = []
+    for *_, sockaddr in infos:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        # is_global excludes loopback, private, link-local, shared and reserved ranges
+        if not WEB_FETCH_ALLOW_PRIVATE and (not address.is_global or address.is_multicast):
+            raise ValueError(f"Refusing to fetch {host}: it resolves to non-public address {address}")
+        addresses.append(sockaddr[0])
+    return list(dict.fromkeys(addresses))
+
+class PublicAddressBackend(httpcore.AnyIOBackend):
+    """
+    Network backend for fetch_page that resolves each host itself and connects to
+    the address it vetted, so a DNS answer cannot change between the check and the
+    connection (DNS rebinding). TLS still uses the URL's host name for SNI and the
+    certificate check, and httpx sets the Host header from the URL as usual.
+    """
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        error = None
+        for address in await _resolve_public(host, port):
+            try:
+                return await super().connect_tcp(address, port, timeout=timeout, local_address=local_address, socket_options=socket_options)
+            except httpcore.ConnectError as e:
+                error = e
+        raise error
+
+def _fetch_transport() -> httpx.AsyncHTTPTransport:
+    transport = httpx.AsyncHTTPTransport()
+    # httpx has no public option for the network backend of its connection pool
+    transport._pool._network_backend = PublicAddressBackend()
+    return transport
+
+async def _send_checked(client: httpx.AsyncClient, url: str, headers: dict) -> httpx.Response:
+    """Sends a streaming GET, following redirects by hand so every hop's scheme is checked."""
+    for _ in range(WEB_FETCH_MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("Only http and https URLs are supported.")
+        response = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+        # is_redirect covers every 3xx; a 304 has no Location and goes back to the caller
+        if not response.is_redirect or "location" not in response.headers:
+            return response
+        await response.aclose()
+        url = str(response.url.join(response.headers["location"]))
+    raise ValueError(f"More than {WEB_FETCH_MAX_REDIRECTS} redirects")
+
+async def _stream_page(url: str, target_chars: int, cached: dict | None) -> dict:
+    """
+    Streams a page and feeds it to the extractor chunk by chunk, stopping at the
+    byte cap, the time cap, or as soon as `target_chars` of text are extracted.
+    Returns the cached entry unchanged when the server answers 304.
+    """
+    headers = {"User-Agent": "Mozilla/5.0 (compatible; multi-agent-bot/1.0)"}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    loop = asyncio.get_running_loop()
+    bytes_read, stop_reason = 0, None
+    async with httpx.AsyncClient(timeout=WEB_FETCH_TIMEOUT, transport=_fetch_transport()) as client:
+        response = await _send_checked(client, url, headers)
+        try:
+            if response.status_code == 304 and cached:
+                return {**cached, "fetched_at": time.time(), "revalidated": True}
+            response.raise_for_status()
+
+            content_type = response.headers.get("content-type", "").lower()
+            if "html" in content_type or not content_type:
+                extractor = TextExtractor()
+            elif content_type.startswith("text/"):
+                extractor = PlainTextExtractor()
+            else:
+                raise ValueError(f"Unsupported content type '{content_type}'")
+            decoder = codecs.getincrementaldecoder(response.charset_encoding or "utf-8")(errors="replace")
+
+            try:
+                async with asyncio.timeout(WEB_FETCH_TIMEOUT):
+                    async for chunk in response.aiter_bytes():
+                        bytes_read += len(chunk)
+                        await loop.run_in_executor(extract_pool, extractor.feed, decoder.decode(chunk))
+                        if extractor.length >= target_chars:
+                            stop_reason = "enough_text"
+                            break
+                        if bytes_read >= WEB_FETCH_MAX_BYTES:
+                            stop_reason = "byte_cap"
+                            break
+            except TimeoutError:
+                stop_reason = "time_cap"
+            if stop_reason is None:
+                await loop.run_in_executor(extract_pool, extractor.feed, decoder.decode(b"", final=True))
+                await loop.run_in_executor(extract_pool, extractor.close)
+            text = await loop.run_in_executor(extract_pool, extractor.text)
+
+            return {
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified"),
+                "title": extractor.title,
+                "text": text,
+                "complete": stop_reason is None,
+                "stop_reason": stop_reason,
+                "bytes_read": bytes_read,
+                "final_url": str(response.url),
+                "fetched_at": time.time()
+            }
+        finally:
+            await response.aclose()
+
+@mcp.tool()
+async def fetch_page(url: str, max_tokens: int = 1000) -> dict:
+    """
+    Fetches a web page and returns its readable text as a compact excerpt.
+    Use it to read a result from a search tool.
+    Args:
+        url: The http(s) URL to fetch.
+        max_tokens: Approximate token budget for the returned content.
+    """
+    if urlsplit(url).scheme not in ("http", "https"):
+        return {"url": url, "error": "Only http and https URLs are supported."}
+    max_tokens = max(50, min(max_tokens, WEB_FETCH_MAX_TOKENS))
+    # Extract a bit more than the budget so the excerpt can end on a sentence boundary
+    target_chars = int(max_tokens * 4 * 1.2)
+
+    cached = page_cache.get(url)
+    usable = cached is not None and (cached["complete"] or len(cached["text"]) >= target_chars)
+    from_cache = usable and time.time() - cached["fetched_at"] < WEB_PAGE_CACHE_TTL
+    if not from_cache:
+        try:
+            async with fetch_semaphore:
+                entry = await _stream_page(url, target_chars, cached if usable else None)
+        except Exception as e:
+            logger.warning(f"fetch_page failed for {url}: {e}")
+            return {"url": url, "error": str(e)}
+        from_cache = entry.pop("revalidated", False)
+        _cache_page(url, entry)
+        if not from_cache:
+            schedule_rag_ingest([{"url": url, "title": entry["title"], "text": entry["text"], "provider": "fetch_page", "kind": "page"}])
+        cached = entry
+
+    content = truncate_to_tokens(cached["text"], max_tokens)
+    return {
+        "url": url,
+        "final_url": cached["final_url"],
+        "title": cached["title"],
+        "content": content,
+        "tokens": estimate_tokens(content),
+        "truncated": len(content) < len(cached["text"]) or not cached["complete"],
+        "cached": from_cache
+    }
 
 # Mount the MCP server
 http_mcp = mcp.http_app(transport="streamable-http")
-app = FastAPI(lifespan=http_mcp.router.lifespan_context)
+
+@asynccontextmanager
+async def combined_lifespan(app: FastAPI):
+    flush_task = asyncio.create_task(flush_quota_state_periodically())
+
+    async with http_mcp.router.lifespan_context(app) as maybe_state:
+        yield maybe_state
+
+    flush_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await flush_task
+    quota_tracker.save()
+    logger.info("Quota state saved.")
+    if _weather_client is not None:
+        await _weather_client.aclose()
+
+app = FastAPI(lifespan=combined_lifespan)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return response_cache.report()
+
+@app.get("/search/stats")
+async def search_stats():
+    return {provider: stats.report() for provider, stats in provider_stats.items()}
+
+@app.get("/quota")
+async def quota_usage():
+    return quota_tracker.report()
+
 app.mount("/", http_mcp)
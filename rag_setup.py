@@ -1,16 +1,12 @@
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from common.embeddings import get_embeddings
 from langchain.docstore.document import Document
 import os
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # Initialize embeddings
 
-embed = HuggingFaceEmbeddings(
-    model_name="all-MiniLM-L6-v2",
-    cache_folder="./sentence_transformers_cache",
-    model_kwargs={"device": "cpu"}
-)
+embed = get_embeddings("./sentence_transformers_cache")
 
 
 # Load your .txt files
@@ -1,11 +1,7 @@
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from common.embeddings import get_embeddings
 
-embed = HuggingFaceEmbeddings(
-    model_name="all-MiniLM-L6-v2",
-    cache_folder="./sentence_transformers_cache",
-    model_kwargs={"device": "cpu"}
-)
+embed = get_embeddings("./sentence_transformers_cache")
 
 vectordb = Chroma(
     persist_directory="./chroma",
@@ -0,0 +1,143 @@
+# scripts/benchmark_embeddings.py
+# Checks that the ONNX embedding backends match the PyTorch vectors and compares their
+# throughput, query latency and memory.
+#
+# Usage:
+#   python scripts/benchmark_embeddings.py [--backends torch onnx onnx-int8] [--docs ./docs] [--texts 512]
+#
+# Each backend runs in its own subprocess so its RSS is measured in isolation. Parity is the
+# cosine similarity between each backend's vectors and the torch vectors for the same texts,
+# plus the overlap of their top-5 neighbours for a set of held-out queries.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.embeddings import EMBEDDINGS_BACKENDS, get_embeddings
+
+EMBEDDINGS_CACHE_DIR = os.path.join("./chroma", "sentence_transformers_cache")
+PARITY_THRESHOLDS = {"onnx": 0.999, "onnx-int8": 0.98}
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_texts(docs_dir: str, limit: int) -> list:
+    """Paragraph-sized texts from the .txt files in docs_dir, or synthetic ones if there are none."""
+    texts = []
+    if os.path.isdir(docs_dir):
+        for root, _, files in os.walk(docs_dir):
+            for name in sorted(files):
+                if name.endswith(".txt"):
+                    with open(os.path.join(root, name), encoding="utf-8", errors="ignore") as f:
+                        texts.extend(p.strip() for p in f.read().split("\n\n") if len(p.split()) >= 5)
+    if not texts:
+        texts = [f"Sample sentence number {i} about topic {i % 17} for embedding benchmarks." for i in range(limit)]
+    return texts[:limit]
+
+
+def run_backend(backend: str, texts_file: str, out_file: str) -> dict:
+    """Runs inside the subprocess: embeds the texts and writes vectors to out_file."""
+    with open(texts_file) as f:
+        texts = json.load(f)
+    baseline = rss_mb()
+
+    start = time.perf_counter()
+    model = get_embeddings(EMBEDDINGS_CACHE_DIR, backend=backend)
+    load_seconds = time.perf_counter() - start
+
+    model.embed_documents(texts[:8])  # warm-up
+    start = time.perf_counter()
+    vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+    batch_seconds = time.perf_counter() - start
+
+    latencies = []
+    for text in texts[:100]:
+        start = time.perf_counter()
+        model.embed_query(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    np.save(out_file, vectors)
+    return {
+        "backend": backend,
+        "load_s": round(load_seconds, 2),
+        "docs_per_s": round(len(texts) / batch_seconds, 1),
+        "query_p50_ms": round(latencies[len(latencies) // 2], 2),
+        "query_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        "rss_mb": round(rss_mb(), 1),
+        "model_rss_mb": round(rss_mb() - baseline, 1),
+    }
+
+
+def neighbour_overlap(reference: np.ndarray, candidate: np.ndarray, queries: int = 50, k: int = 5) -> float:
+    """Average share of the top-k neighbours that agree, using the first texts as queries."""
+    overlaps = []
+    for i in range(min(queries, len(reference))):
+        ref_top = set(np.argsort(-(reference @ reference[i]))[1:k + 1])
+        cand_top = set(np.argsort(-(candidate @ candidate[i]))[1:k + 1])
+        overlaps.append(len(ref_top & cand_top) / k)
+    return round(float(np.mean(overlaps)), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding backends")
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDINGS_BACKENDS), choices=EMBEDDINGS_BACKENDS)
+    parser.add_argument("--docs", default="./docs", help="directory of .txt files to embed")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--worker", nargs=3, metavar=("BACKEND", "TEXTS", "OUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_backend(*args.worker)))
+        return
+
+    texts = load_texts(args.docs, args.texts)
+    print(f"Embedding {len(texts)} texts")
+    with tempfile.TemporaryDirectory() as tmp:
+        texts_file = os.path.join(tmp, "texts.json")
+        with open(texts_file, "w") as f:
+            json.dump(texts, f)
+
+        results, vectors = [], {}
+        for backend in args.backends:
+            out_file = os.path.join(tmp, f"{backend}.npy")
+            proc = subprocess.run(
+                [sys.executable, __file__, "--worker", backend, texts_file, out_file],
+                capture_output=True, text=True
+            )
+            if proc.returncode != 0:
+                print(f"{backend}: failed\n{proc.stderr.strip()[-2000:]}")
+                continue
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            vectors[backend] = np.load(out_file)
+
+    failed = False
+    for result in results:
+        backend = result["backend"]
+        if backend != "torch" and "torch" in vectors:
+            cosine = np.sum(vectors["torch"] * vectors[backend], axis=1)
+            result["cosine_min"] = round(float(cosine.min()), 4)
+            result["cosine_mean"] = round(float(cosine.mean()), 4)
+            result["top5_overlap"] = neighbour_overlap(vectors["torch"], vectors[backend])
+            result["parity"] = "ok" if result["cosine_min"] >= PARITY_THRESHOLDS[backend] else "FAIL"
+            failed |= result["parity"] == "FAIL"
+        print(json.dumps(result))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
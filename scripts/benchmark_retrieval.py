@@ -0,0 +1,105 @@
+# scripts/benchmark_retrieval.py
+# Compares latency and recall of the dense, bm25 and hybrid retriever modes of rag-mcp
+# against the Chroma collection in ./chroma.
+#
+# Usage:
+#   python scripts/benchmark_retrieval.py [--queries queries.jsonl] [--samples 200] [--k 4]
+#
+# queries.jsonl holds one {"query": ..., "relevant": [chunk ids or source paths]} per line.
+# Without it, queries are generated from sampled chunks: a "keyword" query built from the
+# chunk's rarest terms and a "passage" query taken from one of its sentences. The chunk
+# itself is the relevant result.
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GROQ_API_KEY", "unused-by-benchmark")  # the LLM is never called
+rag = importlib.import_module("mcp-servers.rag-mcp.server")
+
+
+def load_queries(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def generate_queries(samples: int, seed: int) -> list:
+    """Builds keyword and passage queries from random chunks of the collection."""
+    index = rag.bm25_index
+    doc_ids = sorted(index.docs)
+    rng = random.Random(seed)
+    queries = []
+    for doc_id in rng.sample(doc_ids, min(samples, len(doc_ids))):
+        text, _, _, terms = index.docs[doc_id]
+        rare = sorted(terms, key=lambda term: (len(index.postings[term]), term))[:3]
+        if rare:
+            queries.append({"query": " ".join(rare), "relevant": [doc_id], "kind": "keyword"})
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if len(s.split()) >= 6]
+        if sentences:
+            queries.append({"query": rng.choice(sentences), "relevant": [doc_id], "kind": "passage"})
+    return queries
+
+
+def is_relevant(doc, relevant: set) -> bool:
+    return doc.id in relevant or doc.metadata.get("source") in relevant
+
+
+async def run_mode(mode: str, queries: list, k: int) -> dict:
+    latencies, hits, reciprocal_ranks = [], 0, []
+    for item in queries:
+        relevant = set(item["relevant"])
+        start = time.perf_counter()
+        results = await rag.asearch_documents(item["query"], k, mode=mode)
+        latencies.append((time.perf_counter() - start) * 1000)
+        rank = next((i for i, (doc, _) in enumerate(results, start=1) if is_relevant(doc, relevant)), None)
+        hits += rank is not None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    latencies.sort()
+    return {
+        "mode": mode,
+        f"recall@{k}": round(hits / len(queries), 3),
+        "mrr": round(statistics.mean(reciprocal_ranks), 3),
+        "p50_ms": round(latencies[len(latencies) // 2], 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark rag-mcp retriever modes")
+    parser.add_argument("--queries", help="JSONL file of labelled queries")
+    parser.add_argument("--samples", type=int, default=200, help="chunks to sample when generating queries")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    try:
+        rag.startup.load()
+    except Exception:
+        sys.exit("RAG system failed to initialize; see the log above.")
+    rag.bm25_index.sync(rag.vectordb._collection, force=True)
+    if not rag.bm25_index.docs:
+        sys.exit("The collection is empty. Run scripts/load_initial_rag_data.py first.")
+
+    queries = load_queries(args.queries) if args.queries else generate_queries(args.samples, args.seed)
+    # Embed every query from scratch so dense and hybrid latencies include the model call
+    rag.embedding_service.cache_size = 0
+    print(f"{len(queries)} queries over {len(rag.bm25_index.docs)} chunks, k={args.k}")
+
+    kinds = sorted({item.get("kind", "labelled") for item in queries})
+    for kind in kinds:
+        subset = [item for item in queries if item.get("kind", "labelled") == kind]
+        print(f"\n{kind} ({len(subset)} queries)")
+        for mode in rag.RETRIEVER_MODES:
+            print(json.dumps(await run_mode(mode, subset, args.k)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+# scripts/benchmark_vector_storage.py
+# Reports memory and recall@k of the compact float16 / int8 vector storage of rag-mcp against
+# exact float32 search, and against Chroma's HNSW index when run on the real collection.
+#
+# Usage:
+#   python scripts/benchmark_vector_storage.py [--queries 200] [--k 4] [--shortlist 64]
+#   python scripts/benchmark_vector_storage.py --synthetic 200000 --dim 384
+#
+# Queries are stored vectors with a little noise added, so every query has true neighbours.
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GROQ_API_KEY", "unused-by-benchmark")  # the LLM is never called
+rag = importlib.import_module("mcp-servers.rag-mcp.server")
+
+
+def rss_mb() -> dict:
+    """Private (anonymous) and file-backed resident memory; mapped vector pages count as file-backed."""
+    usage = {"anon": 0.0, "file": 0.0}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                usage["anon"] = int(line.split()[1]) / 1024
+            elif line.startswith("RssFile:"):
+                usage["file"] = int(line.split()[1]) / 1024
+    return usage
+
+
+def load_vectors(args) -> tuple:
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        centers = rng.normal(size=(256, args.dim))
+        vectors = centers[rng.integers(0, 256, args.synthetic)] + 0.5 * rng.normal(size=(args.synthetic, args.dim))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return [f"synthetic-{i}" for i in range(args.synthetic)], vectors.astype(np.float32)
+    try:
+        rag.startup.load()
+    except Exception:
+        sys.exit("RAG system failed to initialize; see the log above.")
+    ids, vectors, offset = [], [], 0
+    while True:
+        batch = rag.vectordb._collection.get(include=["embeddings"], limit=5000, offset=offset)
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        vectors.extend(batch["embeddings"])
+        offset += len(batch["ids"])
+    if not ids:
+        sys.exit("The collection is empty. Run scripts/load_initial_rag_data.py first.")
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def recall(found: list, truth: list) -> float:
+    return len(set(found) & set(truth)) / len(truth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compact vector storage")
+    parser.add_argument("--synthetic", type=int, help="use N random clustered vectors instead of the collection")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--shortlist", type=int, default=rag.COMPACT_SHORTLIST)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    ids, vectors = load_vectors(args)
+    rng = np.random.default_rng(args.seed)
+    picks = rng.choice(len(ids), size=min(args.queries, len(ids)), replace=False)
+    queries = vectors[picks] + 0.05 * rng.normal(size=(len(picks), vectors.shape[1])).astype(np.float32)
+    truth = [
+        [ids[row] for row in np.argsort(((vectors - query) ** 2).sum(axis=1))[:args.k]]
+        for query in queries
+    ]
+    print(f"{len(ids)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+    print(json.dumps({"store": "float32 (in memory)", "vectors_mb": round(vectors.nbytes / 2**20, 2)}))
+
+    if not args.synthetic:
+        found, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            hits = rag.vectordb.similarity_search_by_vector_with_relevance_scores(query.tolist(), k=args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append([doc.id for doc, _ in hits])
+        print(json.dumps({
+            "store": "chroma hnsw",
+            f"recall@{args.k}": round(float(np.mean([recall(f, t) for f, t in zip(found, truth)])), 4),
+            "p50_ms": round(float(np.median(latencies)), 2)
+        }))
+
+    for dtype in ("float16", "int8"):
+        with tempfile.TemporaryDirectory() as directory:
+            store = rag.CompactVectorStore(directory, dtype, "l2")
+            for start in range(0, len(ids), 10000):
+                store.add(ids[start:start + 10000], vectors[start:start + 10000])
+            del store
+            # Reopen so only the pages searches touch count towards RSS
+            store = rag.CompactVectorStore(directory, dtype, "l2")
+            store._open()
+            before = rss_mb()
+            results = {"rescored": [], "approximate": []}
+            latencies = []
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                hits = store.search(query, args.k, shortlist=args.shortlist)
+                latencies.append((time.perf_counter() - start) * 1000)
+                results["rescored"].append(recall([chunk_id for chunk_id, _ in hits], expected))
+                # A shortlist of k is the compact ranking alone, without the exact second pass
+                hits = store.search(query, args.k, shortlist=args.k)
+                results["approximate"].append(recall([chunk_id for chunk_id, _ in hits], expected))
+            report = store.report()
+            print(json.dumps({
+                "store": dtype,
+                "compact_mb": report["compact_mb"],
+                "exact_mb_on_disk": report["exact_mb"],
+                "reduction": round(vectors.nbytes / 2**20 / max(report["compact_mb"], 1e-6), 2),
+                f"recall@{args.k}": round(float(np.mean(results["rescored"])), 4),
+                f"recall@{args.k}_without_rescore": round(float(np.mean(results["approximate"])), 4),
+                "p50_ms": round(float(np.median(latencies)), 2),
+                "anon_rss_growth_mb": round(rss_mb()["anon"] - before["anon"], 1),
+                "mapped_rss_growth_mb": round(rss_mb()["file"] - before["file"], 1)
+            }))
+
+
+if __name__ == "__main__":
+    main()
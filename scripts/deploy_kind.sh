@@ -38,6 +38,8 @@ kubectl apply -f ${K8S_DIR}/configmaps.yaml
 # Apply PersistentVolumeClaims before Deployments that use them
 mkdir -p ${K8S_DIR}/persistentvolumeclaims # Ensure directory exists for apply
 kubectl apply -f ${K8S_DIR}/persistentvolumeclaims/rag-pvc.yaml
+kubectl apply -f ${K8S_DIR}/persistentvolumeclaims/finance-cache-pvc.yaml
+kubectl apply -f ${K8S_DIR}/persistentvolumeclaims/web-state-pvc.yaml
 
 # Apply deployments
 kubectl apply -f ${K8S_DIR}/deployments/bot-deploy.yaml
@@ -1,12 +1,28 @@
 # scripts/load_initial_rag_data.py
 
+import hashlib
+import json
 import os
+import sys
 import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.document_loaders import TextLoader, PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+# This file lives in scripts/; put the repo root on the path so common/ is importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.embeddings import get_embeddings
+from common.sentence_vectors import SentenceVectorStore, embed_sentences
+from common.utils import stable_chunk_id
 
 # --------- Logging Setup ---------
 logger = logging.getLogger(__name__)
@@ -25,29 +41,297 @@ load_dotenv()
 PERSIST_DIRECTORY = "./chroma" # This must match the mountPath in the K8s Job and RAG Deployment
 EMBEDDINGS_MODEL_NAME = "all-MiniLM-L6-v2"
 EMBEDDINGS_CACHE_DIR = os.path.join(PERSIST_DIRECTORY, "sentence_transformers_cache")
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "torch")
 
 # Directory where your source documents are located within the Docker image
 # We'll copy a 'data' folder into the image that contains your docs.
 DOCUMENTS_DIR = "./data"
 
-def load_documents(doc_dir: str):
-    """Loads documents from a directory, handling different file types."""
-    documents = []
+# Records the content hash and chunk ids of every ingested file, so re-runs only touch what changed
+MANIFEST_PATH = os.path.join(PERSIST_DIRECTORY, "ingest_manifest.json")
+
+# Sentence vectors of every chunk, read by rag-mcp's context compression (RAG_COMPRESS)
+SENTENCE_VECTORS_PATH = os.path.join(PERSIST_DIRECTORY, "sentence_vectors.sqlite3")
+SENTENCE_VECTORS = os.getenv("RAG_COMPRESS", "false").lower() == "true"
+
+# Pipeline sizing: parser processes, files parsed ahead of the chunker, chunks per embedding
+# call, and embedded batches allowed to wait for the writer before the embedder blocks
+PARSE_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", str(os.cpu_count() or 2)))
+PARSE_AHEAD = int(os.getenv("RAG_INGEST_PARSE_AHEAD", str(PARSE_WORKERS * 2)))
+EMBED_BATCH_SIZE = int(os.getenv("RAG_INGEST_EMBED_BATCH", "64"))
+WRITE_QUEUE_BATCHES = int(os.getenv("RAG_INGEST_WRITE_QUEUE", "4"))
+
+LOADERS = {".txt": TextLoader, ".pdf": PyPDFLoader}
+# Add more loaders for other file types as needed (e.g., CSVLoader, JSONLoader)
+
+def iter_source_files(doc_dir: str):
+    """Yields (relative path, full path) for every supported file under doc_dir."""
     for root, _, files in os.walk(doc_dir):
-        for file in files:
+        for file in sorted(files):
             file_path = os.path.join(root, file)
-            if file.endswith(".txt"):
-                logger.info(f"Loading text file: {file_path}")
-                loader = TextLoader(file_path)
-                documents.extend(loader.load())
-            elif file.endswith(".pdf"):
-                logger.info(f"Loading PDF file: {file_path}")
-                loader = PyPDFLoader(file_path)
-                documents.extend(loader.load())
-            # Add more loaders for other file types as needed (e.g., CSVLoader, JSONLoader)
+            if os.path.splitext(file)[1].lower() in LOADERS:
+                yield os.path.relpath(file_path, doc_dir), file_path
             else:
                 logger.warning(f"Skipping unsupported file type: {file_path}")
-    return documents
+
+def load_file(file_path: str):
+    """Loads one file with the loader for its type."""
+    logger.info(f"Loading file: {file_path}")
+    return LOADERS[os.path.splitext(file_path)[1].lower()](file_path).load()
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_ids(source: str, chunks) -> list:
+    """Stable ids for a file's chunks; repeated identical chunks get increasing occurrence numbers."""
+    seen = Counter()
+    ids = []
+    for chunk in chunks:
+        ids.append(stable_chunk_id(source, chunk.page_content, seen[chunk.page_content]))
+        seen[chunk.page_content] += 1
+    return ids
+
+def load_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"version": 1, "files": {}}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(path: str, manifest: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def delete_chunks(vectordb, sentence_store, ids: list) -> None:
+    for start in range(0, len(ids), 500):
+        vectordb.delete(ids=ids[start:start + 500])
+    if sentence_store is not None:
+        sentence_store.delete(ids)
+
+def prune_unmanaged_chunks(vectordb, sentence_store, manifest: dict) -> int:
+    """
+    Deletes chunks that no manifest entry owns, e.g. duplicates left by runs before the manifest
+    existed. Documents added through the rag-mcp API carry a doc_id and are left alone.
+    """
+    managed = {chunk_id for entry in manifest["files"].values() for chunk_id in entry["chunk_ids"]}
+    stored = vectordb._collection.get(include=["metadatas"])
+    unmanaged = [
+        chunk_id for chunk_id, metadata in zip(stored["ids"], stored["metadatas"])
+        if chunk_id not in managed and "doc_id" not in (metadata or {})
+    ]
+    delete_chunks(vectordb, sentence_store, unmanaged)
+    return len(unmanaged)
+
+class StageStats:
+    """Items processed and busy time for one pipeline stage (summed over workers for parsing)."""
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.seconds = 0.0
+
+    @contextmanager
+    def timed(self, items: int = 1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.items += items
+
+    def __str__(self):
+        rate = self.items / self.seconds if self.seconds else 0.0
+        return f"{self.name}: {self.items} {self.unit} in {self.seconds:.1f}s ({rate:.1f} {self.unit}/s)"
+
+class FileTracker:
+    """
+    Records a file in the manifest only once every one of its chunks is in Chroma, so a
+    crashed run re-processes exactly the files it had not finished.
+    """
+    def __init__(self, manifest: dict, manifest_path: str):
+        self.manifest = manifest
+        self.manifest_path = manifest_path
+        self.files = {}  # source -> {"sha256", "chunk_ids", "remaining", "chunked"}
+        self._lock = threading.Lock()
+
+    def start(self, source: str, file_hash: str, ids: list) -> None:
+        with self._lock:
+            self.files[source] = {"sha256": file_hash, "chunk_ids": ids, "remaining": len(ids), "chunked": False}
+
+    def chunked(self, source: str) -> None:
+        with self._lock:
+            self.files[source]["chunked"] = True
+            self._maybe_finish(source)
+
+    def written(self, sources: list) -> None:
+        with self._lock:
+            for source in sources:
+                self.files[source]["remaining"] -= 1
+            for source in set(sources):
+                self._maybe_finish(source)
+
+    def _maybe_finish(self, source: str) -> None:
+        entry = self.files[source]
+        if entry["chunked"] and entry["remaining"] == 0:
+            del self.files[source]
+            self.manifest["files"][source] = {
+                "sha256": entry["sha256"], "chunk_ids": entry["chunk_ids"], "ingested_at": time.time()
+            }
+            save_manifest(self.manifest_path, self.manifest)
+
+def parse_file(file_path: str) -> tuple:
+    """Runs in a worker process: loads a file into (page_content, metadata) pairs and times it."""
+    start = time.perf_counter()
+    pages = [(doc.page_content, doc.metadata) for doc in load_file(file_path)]
+    return pages, time.perf_counter() - start
+
+def parsed_files(pool, jobs, stats: StageStats):
+    """
+    Yields (source, file_hash, documents) as files finish parsing in the process pool,
+    keeping at most PARSE_AHEAD files in flight so parsed text cannot pile up.
+    """
+    jobs = iter(jobs)
+    pending = {}
+
+    def submit_next() -> bool:
+        job = next(jobs, None)
+        if job is None:
+            return False
+        source, file_path, file_hash = job
+        pending[pool.submit(parse_file, file_path)] = (source, file_hash)
+        return True
+
+    while len(pending) < PARSE_AHEAD and submit_next():
+        pass
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            source, file_hash = pending.pop(future)
+            submit_next()
+            try:
+                pages, seconds = future.result()
+            except Exception as e:
+                # Left out of the manifest, so the next run tries again
+                logger.error(f"Failed to parse {source}: {e}")
+                continue
+            stats.items += 1
+            stats.seconds += seconds
+            yield source, file_hash, [Document(page_content=text, metadata=metadata) for text, metadata in pages]
+
+def chunk_stream(parsed, text_splitter, vectordb, sentence_store, manifest: dict, tracker: FileTracker,
+                 stats: StageStats, counts: Counter):
+    """Yields (source, chunk_id, chunk) for every chunk, one file at a time."""
+    for source, file_hash, documents in parsed:
+        with stats.timed(0):
+            chunks = text_splitter.split_documents(documents)
+            ids = chunk_ids(source, chunks)
+        stats.items += len(chunks)
+
+        stale = sorted(set(manifest["files"].get(source, {}).get("chunk_ids", [])) - set(ids))
+        if stale:
+            delete_chunks(vectordb, sentence_store, stale)
+            counts["chunks_deleted"] += len(stale)
+
+        tracker.start(source, file_hash, ids)
+        for chunk_id, chunk in zip(ids, chunks):
+            yield source, chunk_id, chunk
+        tracker.chunked(source)
+
+def batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def write_batches(vectordb, sentence_store, write_queue: queue.Queue, tracker: FileTracker, stats: StageStats,
+                  errors: list) -> None:
+    """Writer thread: upserts embedded batches into Chroma and the sentence store and marks their chunks written."""
+    while True:
+        item = write_queue.get()
+        if item is None:
+            return
+        sources, ids, texts, metadatas, vectors, sentence_sets, skipped_sources = item
+        try:
+            if ids:
+                with stats.timed(len(ids)):
+                    vectordb._collection.upsert(ids=ids, embeddings=vectors, documents=texts, metadatas=metadatas)
+                    if sentence_store is not None:
+                        sentence_store.put_many(zip(ids, sentence_sets))
+            tracker.written(sources + skipped_sources)
+        except Exception as e:
+            errors.append(e)
+            return
+
+def run_pipeline(vectordb, sentence_store, embeddings_model, text_splitter, manifest: dict, jobs: list,
+                 counts: Counter) -> list:
+    """
+    Streams jobs through parse (process pool) -> chunk (generator) -> embed (fixed-size
+    batches) -> write (bounded queue and writer thread). Chunks already in the collection,
+    e.g. from an interrupted run, are not embedded again. With a sentence store, the embed
+    stage also embeds each new chunk's sentences. Returns the stage statistics.
+    """
+    parse_stats = StageStats("parse", "files")
+    chunk_stats = StageStats("chunk", "chunks")
+    embed_stats = StageStats("embed", "chunks")
+    write_stats = StageStats("write", "chunks")
+    tracker = FileTracker(manifest, MANIFEST_PATH)
+    write_queue = queue.Queue(maxsize=WRITE_QUEUE_BATCHES)
+    errors = []
+    writer = threading.Thread(
+        target=write_batches, args=(vectordb, sentence_store, write_queue, tracker, write_stats, errors), daemon=True
+    )
+    writer.start()
+
+    try:
+        # By now the embedding model, Chroma and the writer thread are up; forking would copy
+        # their locks and thread state into the parsers, so the parsers are spawned fresh
+        with ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")) as pool:
+            chunks = chunk_stream(
+                parsed_files(pool, jobs, parse_stats), text_splitter, vectordb, sentence_store, manifest, tracker,
+                chunk_stats, counts
+            )
+            for batch_number, batch in enumerate(batched(chunks, EMBED_BATCH_SIZE), start=1):
+                existing = set(vectordb._collection.get(ids=[chunk_id for _, chunk_id, _ in batch], include=[])["ids"])
+                todo = [item for item in batch if item[1] not in existing]
+                skipped_sources = [source for source, chunk_id, _ in batch if chunk_id in existing]
+                vectors, sentence_sets = [], []
+                if todo:
+                    with embed_stats.timed(len(todo)):
+                        texts = [chunk.page_content for _, _, chunk in todo]
+                        vectors = embeddings_model.embed_documents(texts)
+                        if sentence_store is not None:
+                            sentence_sets = embed_sentences(embeddings_model, texts)
+                counts["chunks_added"] += len(todo)
+                counts["chunks_kept"] += len(skipped_sources)
+                # Blocks while WRITE_QUEUE_BATCHES batches wait for Chroma, holding back the embedder
+                write_queue.put((
+                    [source for source, _, _ in todo],
+                    [chunk_id for _, chunk_id, _ in todo],
+                    [chunk.page_content for _, _, chunk in todo],
+                    [chunk.metadata or None for _, _, chunk in todo],
+                    vectors,
+                    sentence_sets,
+                    skipped_sources
+                ))
+                if errors:
+                    raise errors[0]
+                if batch_number % 20 == 0:
+                    logger.info(f"Progress: {parse_stats} | {embed_stats} | {write_stats}")
+    finally:
+        write_queue.put(None)
+        writer.join()
+    if errors:
+        raise errors[0]
+    return [parse_stats, chunk_stats, embed_stats, write_stats]
 
 async def main():
     logger.info("Starting RAG data loading process...")
@@ -56,14 +340,10 @@ async def main():
     os.makedirs(PERSIST_DIRECTORY, exist_ok=True)
     os.makedirs(EMBEDDINGS_CACHE_DIR, exist_ok=True)
 
-    # Initialize HuggingFace Embeddings
-    # Model will be downloaded to EMBEDDINGS_CACHE_DIR if not present
-    logger.info(f"Initializing embeddings model '{EMBEDDINGS_MODEL_NAME}' (downloading if not cached)...")
-    embeddings_model = HuggingFaceEmbeddings(
-        model_name=EMBEDDINGS_MODEL_NAME,
-        cache_folder=EMBEDDINGS_CACHE_DIR,
-        model_kwargs={'device': 'cpu'}
-    )
+    # Initialize the embedding model on the configured backend
+    # Model will be downloaded (and exported for ONNX backends) to EMBEDDINGS_CACHE_DIR if not present
+    logger.info(f"Initializing embeddings model '{EMBEDDINGS_MODEL_NAME}' on {EMBEDDINGS_BACKEND} (downloading if not cached)...")
+    embeddings_model = get_embeddings(EMBEDDINGS_CACHE_DIR, EMBEDDINGS_MODEL_NAME, EMBEDDINGS_BACKEND)
     logger.info("Embeddings model initialized.")
 
     # Initialize ChromaDB
@@ -73,31 +353,54 @@ async def main():
         embedding_function=embeddings_model
     )
     logger.info(f"ChromaDB current document count: {vectordb._collection.count()}")
+    sentence_store = SentenceVectorStore(SENTENCE_VECTORS_PATH) if SENTENCE_VECTORS else None
+
+    first_run = not os.path.exists(MANIFEST_PATH)
+    manifest = load_manifest(MANIFEST_PATH)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    stats = Counter()
 
-    # Load documents from the 'data' directory
-    logger.info(f"Loading documents from: {DOCUMENTS_DIR}")
-    documents = load_documents(DOCUMENTS_DIR)
-    if not documents:
+    # Compare the 'data' directory against the manifest
+    logger.info(f"Scanning documents in: {DOCUMENTS_DIR}")
+    sources = dict(iter_source_files(DOCUMENTS_DIR))
+    if not sources:
         logger.warning("No documents found to load. Ensure 'data/' directory contains documents.")
-        return
 
-    logger.info(f"Loaded {len(documents)} raw documents.")
+    for source in sorted(set(manifest["files"]) - set(sources)):
+        removed = manifest["files"].pop(source)["chunk_ids"]
+        if removed:
+            delete_chunks(vectordb, sentence_store, removed)
+        logger.info(f"Removed {len(removed)} chunks of deleted file: {source}")
+        stats["files_deleted"] += 1
+        stats["chunks_deleted"] += len(removed)
+        save_manifest(MANIFEST_PATH, manifest)
 
-    # Split documents into chunks
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunked_documents = text_splitter.split_documents(documents)
-    logger.info(f"Split documents into {len(chunked_documents)} chunks.")
-
-    # Add chunks to ChromaDB
-    logger.info("Adding document chunks to ChromaDB...")
-    # Add documents to the collection. Chroma will handle embedding them.
-    vectordb.add_documents(chunked_documents)
-    logger.info(f"Successfully added {len(chunked_documents)} chunks to ChromaDB.")
-    logger.info(f"ChromaDB total document count after loading: {vectordb._collection.count()}")
+    jobs = []
+    for source, file_path in sorted(sources.items()):
+        file_hash = file_sha256(file_path)
+        if manifest["files"].get(source, {}).get("sha256") == file_hash:
+            stats["files_unchanged"] += 1
+            continue
+        stats["files_changed" if source in manifest["files"] else "files_new"] += 1
+        jobs.append((source, file_path, file_hash))
 
-    # Important: Persist the changes if ChromaDB is set to persist
-    # vectordb.persist() # ChromaDB's add_documents usually handles persistence if configured
+    if jobs:
+        logger.info(f"Ingesting {len(jobs)} new or changed files with {PARSE_WORKERS} parser processes...")
+        started = time.perf_counter()
+        for stage in run_pipeline(vectordb, sentence_store, embeddings_model, text_splitter, manifest, jobs, stats):
+            logger.info(f"Stage {stage}")
+        elapsed = time.perf_counter() - started
+        logger.info(f"Pipeline: {stats['chunks_added']} chunks embedded in {elapsed:.1f}s wall ({stats['chunks_added'] / elapsed:.1f} chunks/s)")
 
+    if first_run:
+        pruned = prune_unmanaged_chunks(vectordb, sentence_store, manifest)
+        if pruned:
+            logger.info(f"Removed {pruned} chunks loaded before the ingest manifest existed.")
+        stats["chunks_deleted"] += pruned
+        save_manifest(MANIFEST_PATH, manifest)
+
+    logger.info(f"Ingestion summary: {dict(stats)}")
+    logger.info(f"ChromaDB total document count after loading: {vectordb._collection.count()}")
     logger.info("RAG data loading process completed.")
 
 if __name__ == "__main__":
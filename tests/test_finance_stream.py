@@ -0,0 +1,105 @@
+# tests/test_finance_stream.py
+# Exercises the finance-mcp quote stream against a local stand-in for the Finnhub trade WebSocket.
+
+import asyncio
+import importlib
+import json
+import os
+import sys
+
+import websockets
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+finance = importlib.import_module("mcp-servers.finance-mcp.server")
+
+
+async def _fake_finnhub(subscriptions: list):
+    """Starts a WebSocket server that answers every subscribe with one trade."""
+    async def handler(ws):
+        async for message in ws:
+            request = json.loads(message)
+            subscriptions.append(request["symbol"])
+            await ws.send(json.dumps({
+                "type": "trade",
+                "data": [{"s": request["symbol"], "p": 101.5, "t": 1700000000000, "v": 10}]
+            }))
+
+    return await websockets.serve(handler, "127.0.0.1", 0)
+
+
+async def _wait_for(predicate, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise TimeoutError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+async def _run_stream_scenario():
+    subscriptions = []
+    server = await _fake_finnhub(subscriptions)
+    port = server.sockets[0].getsockname()[1]
+    stream = finance.QuoteStream(f"ws://127.0.0.1:{port}", "test-token", ["AAPL"], max_symbols=2)
+    task = asyncio.create_task(stream.run())
+    try:
+        await _wait_for(lambda: stream.get("AAPL", 10) is not None)
+        assert stream.get("AAPL", 10) == (101.5, 10.0, 1700000000000)
+
+        # Symbols added while connected are subscribed on the live socket
+        assert stream.subscribe("MSFT")
+        await _wait_for(lambda: stream.get("MSFT", 10) is not None)
+        assert subscriptions == ["AAPL", "MSFT"]
+
+        # The watchlist is capped
+        assert not stream.subscribe("TSLA")
+        assert stream.get("TSLA", 10) is None
+
+        # get_stock_quote serves fresh symbols from the table without REST calls
+        finance.quote_stream = stream
+        finance.cache_data("quote_AAPL", {"source": "Finnhub", "previous_close": 100.0, "high": 101.0, "low": 99.0, "open": 100.0})
+        quote = await finance.get_stock_quote("aapl")
+        assert quote["source"] == "Finnhub WebSocket"
+        assert quote["current_price"] == 101.5
+        assert quote["change_percent"] == 1.5
+        assert quote["high"] == 101.5
+    finally:
+        finance.quote_stream = None
+        task.cancel()
+        server.close()
+        await server.wait_closed()
+
+
+def test_quote_stream_against_local_server():
+    asyncio.run(_run_stream_scenario())
+
+
+def test_quote_stream_reuses_idle_slots():
+    stream = finance.QuoteStream("ws://unused", "test-token", ["AAPL"], max_symbols=2, idle_evict=60)
+    assert stream.subscribe("TYPO")
+    # A full table only gives up slots that have been idle long enough
+    assert not stream.subscribe("MSFT")
+    stream._used[stream._slots["TYPO"]] -= 120
+    assert stream.subscribe("MSFT")
+    assert not stream.is_subscribed("TYPO") and stream.symbols == ["AAPL", "MSFT"]
+
+    # Configured symbols are never evicted
+    stream._used[stream._slots["AAPL"]] -= 1000
+    assert not stream.subscribe("NVDA")
+
+
+def test_quote_stream_skips_malformed_messages():
+    stream = finance.QuoteStream("ws://unused", "test-token", ["AAPL"])
+    for message in ("[1, 2]", '"trade"', '{"type": "trade", "data": "AAPL"}', '{"type": "trade", "data": [1, null]}'):
+        stream.handle_message(message)
+    stream.handle_message(json.dumps({"type": "trade", "data": [
+        {"s": "AAPL", "p": "n/a", "v": 1, "t": 1},
+        {"s": "AAPL", "p": 101.5, "v": 2, "t": 1700000000000}
+    ]}))
+    assert stream.get("AAPL", 10) == (101.5, 2.0, 1700000000000)
+
+
+if __name__ == "__main__":
+    asyncio.run(_run_stream_scenario())
+    test_quote_stream_reuses_idle_slots()
+    test_quote_stream_skips_malformed_messages()
+    print("✅ Quote stream test passed")
@@ -0,0 +1,232 @@
+# tests/test_finance_tools.py
+# Exercises finance-mcp helpers that need no upstream API: symbol search, screening, candles and pagination.
+
+import asyncio
+import importlib
+import os
+import sys
+import time
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+finance = importlib.import_module("mcp-servers.finance-mcp.server")
+
+SYMBOLS = [
+    {"symbol": "AAPL", "description": "APPLE INC", "displaySymbol": "AAPL", "type": "Common Stock"},
+    {"symbol": "AAPL.MX", "description": "APPLE INC", "displaySymbol": "AAPL.MX", "type": "Common Stock"},
+    {"symbol": "MSFT", "description": "MICROSOFT CORP", "displaySymbol": "MSFT", "type": "Common Stock"},
+    {"symbol": "NVDA", "description": "NVIDIA CORP", "displaySymbol": "NVDA", "type": "Common Stock"},
+]
+
+
+def _mock_finnhub(handler):
+    """Routes the module's httpx clients to `handler` until the returned restore function is called."""
+    real_client = httpx.AsyncClient
+    finance.httpx.AsyncClient = lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+    def restore():
+        finance.httpx.AsyncClient = real_client
+    return restore
+
+
+def test_symbol_index_matches():
+    index = finance.SymbolIndex(SYMBOLS)
+    exact = index.search("aapl")
+    assert exact[0]["symbol"] == "AAPL" and exact[0]["score"] == 100.0
+    assert [r["symbol"] for r in exact] == ["AAPL", "AAPL.MX"]
+
+    assert index.search("NV")[0]["symbol"] == "NVDA"
+    assert index.search("micro")[0]["symbol"] == "MSFT"
+    assert 60.0 <= index.search("micro")[0]["score"] < 80.0
+
+    fuzzy = index.search("microsfot")
+    assert fuzzy[0]["symbol"] == "MSFT" and fuzzy[0]["score"] < finance.FINANCE_SYMBOL_INDEX_MIN_SCORE
+    assert index.search("zzzz") == []
+
+
+def test_search_stocks_defers_weak_local_matches():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.params["q"])
+        return httpx.Response(200, json={"result": [
+            {"symbol": "MSFT", "description": "MICROSOFT CORP", "displaySymbol": "MSFT", "type": "Common Stock"}
+        ]})
+
+    finance.symbol_index = finance.SymbolIndex(SYMBOLS)
+    previous_key = os.environ.get("FINNHUB_API_KEY")
+    os.environ["FINNHUB_API_KEY"] = "test"
+    restore = _mock_finnhub(handler)
+    try:
+        confident = asyncio.run(finance.search_stocks("aapl"))
+        assert confident["source"] == "local_index" and not calls
+
+        fuzzy = asyncio.run(finance.search_stocks("microsfot"))
+        assert calls == ["microsfot"] and "source" not in fuzzy
+        assert fuzzy["results"][0]["symbol"] == "MSFT"
+    finally:
+        restore()
+        finance.symbol_index = None
+        if previous_key is None:
+            del os.environ["FINNHUB_API_KEY"]
+        else:
+            os.environ["FINNHUB_API_KEY"] = previous_key
+
+
+def test_indicators_match_known_values():
+    # Seeded EMA: 1, 0.5 * 2 + 0.5 * 1 = 1.5, 0.5 * 3 + 0.5 * 1.5 = 2.25
+    assert finance._ema_last(np.array([1.0, 2.0, 3.0]), 0.5) == 2.25
+    # Gains 1, 1, 0, 2 and losses 0, 0, 1, 0 smoothed with alpha 1/2: 1.25 / 0.25, so RSI = 100 - 100 / 6
+    assert round(finance._rsi(np.array([10.0, 11.0, 12.0, 11.0, 13.0]), period=2), 4) == 83.3333
+    assert finance._rsi(np.array([1.0, 2.0, 3.0]), period=2) == 100.0
+    assert finance._rsi(np.array([1.0, 2.0]), period=2) is None
+
+
+def test_summarize_candles_in_utc():
+    previous_tz = os.environ.get("TZ")
+    os.environ["TZ"] = "America/Los_Angeles"
+    time.tzset()
+    try:
+        t = np.array([19000 * 86400 + day * 86400 for day in range(4)])  # 2022-01-08 00:00 UTC onwards
+        c = np.array([100.0, 110.0, 88.0, 99.0])
+        summary = finance.summarize_candles(t, c, c + 1, c - 1, c, np.full(4, 1000.0), "D")
+        assert summary["from"] == "2022-01-08" and summary["to"] == "2022-01-11"
+        assert summary["high"] == 111.0 and summary["low"] == 87.0
+        assert summary["returns"]["total_return"] == -0.01
+        assert summary["returns"]["best_period_return"] == 0.125 and summary["returns"]["worst_period_return"] == -0.2
+        assert summary["risk"]["max_drawdown"] == -0.2
+        assert summary["risk"]["max_drawdown_peak"] == "2022-01-09"
+        assert summary["risk"]["max_drawdown_trough"] == "2022-01-10"
+        assert finance.summarize_candles(t[:2], c[:2], c[:2], c[:2], c[:2], c[:2], "60")["from"] == "2022-01-08 00:00"
+    finally:
+        if previous_tz is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = previous_tz
+        time.tzset()
+
+
+def test_candle_series_refreshes_forming_candle():
+    series = finance.CandleSeries()
+    series.merge({"s": "ok", "t": [0, 60], "o": [1, 2], "h": [1, 2], "l": [1, 2], "c": [1, 2], "v": [1, 1]}, 0, 90)
+    # Inside min_gap and the refresh interval: nothing to fetch
+    assert series.missing_ranges(0, 100, min_gap=60, refresh=30) == []
+    # Past the refresh interval the tail is fetched again from the last, still forming candle
+    assert series.missing_ranges(0, 130, min_gap=60, refresh=30) == [(60, 130)]
+    series.merge({"s": "ok", "t": [60], "o": [2], "h": [5], "l": [2], "c": [4], "v": [3]}, 60, 130)
+    assert list(series.c) == [1.0, 4.0] and series.end == 130
+
+
+def _screen(**kwargs) -> dict:
+    table = finance.MetricsTable()
+    for symbol, pe, roe in (("AAA", 10.0, 30.0), ("BBB", 20.0, None), ("CCC", 20.0, 10.0), ("DDD", 40.0, 20.0)):
+        table.upsert(symbol, {"valuation_metrics": {"pe_ratio": pe}, "profitability_metrics": {"return_on_equity": roe}})
+    previous, finance.metrics_table = finance.metrics_table, table
+    try:
+        return asyncio.run(finance.screen_stocks(symbols=["AAA", "BBB", "CCC", "DDD"], **kwargs))
+    finally:
+        finance.metrics_table = previous
+
+
+def test_screen_stocks_rejects_malformed_numbers():
+    for expression in ("pe_ratio < 1.2.3", "pe_ratio < .5", "pe_ratio < 1e", "pe_ratio < 1,5", "pe_ratio <"):
+        result = _screen(filters=[expression])
+        assert result["status"] == "error" and "Invalid filter" in result["message"], expression
+    assert _screen(filters=["pe_ratio < 2.5e1"])["matched"] == 3
+    assert _screen(filters=["pe_ratio >= -1"])["matched"] == 4
+
+
+def test_percentiles():
+    column = np.array([10.0, 20.0, 20.0, np.nan, 40.0])
+    assert finance._percentiles(column)[[0, 1, 2, 4]].tolist() == [0.0, 50.0, 50.0, 100.0]
+    assert np.isnan(finance._percentiles(column)[3])
+    assert finance._percentiles(np.array([np.nan, 7.0]))[1] == 50.0
+
+    ranked = _screen(rank_by=["pe_ratio:asc", "return_on_equity:desc"], top_n=4)
+    assert [(row["symbol"], row["score"]) for row in ranked["rows"]] == [("AAA", 100.0), ("BBB", 50.0), ("CCC", 25.0), ("DDD", 25.0)]
+    assert ranked["rows"][0]["percentiles"] == {"pe_ratio": 0.0, "return_on_equity": 100.0}
+    # BBB has no return_on_equity, so its score is its tied pe_ratio percentile alone
+    assert ranked["rows"][1]["percentiles"] == {"pe_ratio": 50.0, "return_on_equity": None}
+
+
+def test_prefetcher_learns_only_successful_symbols():
+    finance.prefetcher._counts.clear()
+    finance.cache_data("quote_AAPL", {"status": "success", "symbol": "AAPL", "current_price": 101.5})
+    previous_keys = {name: os.environ.pop(name, None) for name in ("FINNHUB_API_KEY", "QUANDL_API_KEY")}
+    try:
+        assert asyncio.run(finance.get_stock_quote("aapl"))["status"] == "success"
+        assert asyncio.run(finance.get_company_profile("TYPO"))["status"] == "error"
+    finally:
+        os.environ.update({name: value for name, value in previous_keys.items() if value is not None})
+    assert finance.prefetcher._counts == {"AAPL": 1.0}
+
+
+ARTICLES = [{"id": 10 - i, "datetime": 1700000000 - 60 * (i // 2), "headline": f"Story {i}"} for i in range(7)]
+
+
+def test_cursor_pagination():
+    pages, cursor = [], None
+    while True:
+        page, cursor = finance.paginate(ARTICLES, finance._article_key, 3, cursor, ["id"])
+        pages.append([article["id"] for article in page])
+        if cursor is None:
+            break
+    # Articles sharing a timestamp are split across pages without repeats or gaps
+    assert pages == [[10, 9, 8], [7, 6, 5], [4]]
+
+    # A cursor past the last item gives an empty, exhausted page
+    last = finance._encode_cursor(finance._article_key(ARTICLES[-1]))
+    assert finance.paginate(ARTICLES, finance._article_key, 3, last) == ([], None)
+    assert finance.paginate([], finance._article_key, 3, last) == ([], None)
+    assert len(finance.paginate(ARTICLES, finance._article_key, 0)[0]) == 1
+
+    for tampered in ("not base64!", "e30=", finance._encode_cursor(["1700000000", 4]),
+                     finance._encode_cursor([1700000000]), finance._encode_cursor([True, 4])):
+        try:
+            finance.paginate(ARTICLES, finance._article_key, 3, tampered)
+        except ValueError as e:
+            assert "Invalid cursor" in str(e)
+        else:
+            raise AssertionError(f"cursor {tampered!r} was accepted")
+
+
+def test_tools_report_invalid_cursors():
+    finance.cache_data("news_CUR", {"articles": ARTICLES})
+    finance.cache_data("market_news_general", {"articles": ARTICLES})
+    periods = [{"period": f"2024-{month:02d}-01", "buy": 1} for month in range(12, 0, -1)]
+    asyncio.run(finance.cache_tiered_data("recommendations_CUR", {"periods": periods}))
+    previous_key = os.environ.get("FINNHUB_API_KEY")
+    os.environ["FINNHUB_API_KEY"] = "test"
+    try:
+        results = [
+            asyncio.run(finance.get_stock_news("CUR", cursor="e30=")),
+            asyncio.run(finance.get_market_news(cursor="e30=")),
+            asyncio.run(finance.get_stock_recommendations("CUR", cursor="e30=")),
+        ]
+        assert all(result == {"status": "error", "message": "Invalid cursor 'e30='"} for result in results), results
+
+        # Every paginated tool caps a page at PAGE_LIMIT_MAX
+        many = [{"period": f"{year}-01-01"} for year in range(2100, 2000, -1)]
+        asyncio.run(finance.cache_tiered_data("recommendations_MANY", {"periods": many}))
+        assert len(asyncio.run(finance.get_stock_recommendations("MANY", limit=500))["historical_data"]) == finance.PAGE_LIMIT_MAX
+    finally:
+        if previous_key is None:
+            del os.environ["FINNHUB_API_KEY"]
+        else:
+            os.environ["FINNHUB_API_KEY"] = previous_key
+
+
+if __name__ == "__main__":
+    test_symbol_index_matches()
+    test_search_stocks_defers_weak_local_matches()
+    test_indicators_match_known_values()
+    test_summarize_candles_in_utc()
+    test_candle_series_refreshes_forming_candle()
+    test_screen_stocks_rejects_malformed_numbers()
+    test_percentiles()
+    test_prefetcher_learns_only_successful_symbols()
+    test_cursor_pagination()
+    test_tools_report_invalid_cursors()
+    print("✅ finance tool tests passed")
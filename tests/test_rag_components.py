@@ -0,0 +1,306 @@
+# tests/test_rag_components.py
+# Exercises rag-mcp's embedding service, reranker, compact vector store and context compression with stub models, without Chroma.
+
+import asyncio
+import hashlib
+import importlib
+import os
+import sys
+import tempfile
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GROQ_API_KEY", "test")
+rag = importlib.import_module("mcp-servers.rag-mcp.server")
+
+
+class CountingEmbeddings(Embeddings):
+    """Deterministic bag-of-words vectors that record every model call."""
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _embed(self, text: str) -> list:
+        vector = [0.0] * 16
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 16] += 1.0
+        return vector
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls.append(list(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_concurrent_queries_share_one_model_call():
+    model = CountingEmbeddings()
+    service = rag.EmbeddingService(model, batch_window=0.05)
+
+    async def burst():
+        return await asyncio.gather(*(service.aembed_query(text) for text in
+                                      ("disk quota", "network plan", "Disk   QUOTA", "hiring")))
+    vectors = asyncio.run(burst())
+    # Queries that normalize alike are embedded once, and all misses go in one batch
+    assert model.calls == [["disk quota", "network plan", "hiring"]]
+    assert vectors[0] == vectors[2] == model._embed("disk quota")
+    assert service.stats["batches"] == 1 and service.stats["max_batch"] == 3
+
+
+def test_cached_queries_skip_the_model():
+    model = CountingEmbeddings()
+    service = rag.EmbeddingService(model, cache_size=2, batch_window=0.0)
+    first = asyncio.run(service.aembed_query("storage team"))
+    assert asyncio.run(service.aembed_query(" Storage team ")) == first
+    assert service.embed_query("STORAGE TEAM") == first
+    assert len(model.calls) == 1
+    assert service.report()["hits"] == 2 and service.report()["misses"] == 1
+
+    # The LRU keeps only cache_size query vectors
+    service.embed_query("second query")
+    service.embed_query("third query")
+    service.embed_query("storage team")
+    assert len(model.calls) == 4 and service.report()["cached"] == 2
+
+    # Documents always go to the model
+    service.embed_documents(["storage team"])
+    assert model.calls[-1] == ["storage team"]
+
+
+class SlowCrossEncoder:
+    """Scores by text length once `release` is set, like a cross-encoder stuck on a slow CPU."""
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=False):
+        self.calls += 1
+        self.release.wait()
+        return np.array([float(len(text)) for _, text in pairs])
+
+
+def test_reranker_skips_while_timed_out_job_runs():
+    model = SlowCrossEncoder()
+    reranker = rag.Reranker(budget=0.05)
+    reranker._model = model
+    candidates = [(Document(page_content=text), 0.5) for text in ("short", "a much longer chunk", "medium text")]
+    try:
+        # Over budget: retrieval order is kept and the running job is remembered
+        assert reranker.rerank("q", candidates, 2) == candidates[:2]
+        assert reranker._abandoned is not None and model.calls == 1
+
+        # While it still runs, later queries skip reranking instead of queueing behind it
+        assert reranker.rerank("q", candidates, 2) == candidates[:2]
+        assert asyncio.run(reranker.arerank("q", candidates, 2)) == candidates[:2]
+        assert reranker.stats == {"reranked": 0, "fallbacks": 3, "errors": 0, "skipped": 2}
+        assert model.calls == 1
+    finally:
+        model.release.set()
+    reranker._abandoned.result(timeout=5)
+
+    ranked = asyncio.run(reranker.arerank("q", candidates, 2))
+    assert [doc.page_content for doc, _ in ranked] == ["a much longer chunk", "medium text"]
+    assert model.calls == 2 and reranker.stats["reranked"] == 1
+
+
+class VectorCollection:
+    """The slice of the Chroma collection API that CompactVectorStore uses."""
+    def __init__(self, vectors: dict):
+        self.vectors = dict(vectors)
+
+    def get(self, ids=None, include=(), limit=None, offset=0):
+        chosen = list(self.vectors) if ids is None else [chunk_id for chunk_id in ids if chunk_id in self.vectors]
+        chosen = chosen[offset:None if limit is None else offset + limit]
+        result = {"ids": chosen}
+        if "embeddings" in include:
+            result["embeddings"] = [self.vectors[chunk_id] for chunk_id in chosen]
+        return result
+
+
+def _exact_top(vectors: np.ndarray, query: np.ndarray, k: int) -> list:
+    return np.argsort(((vectors - query) ** 2).sum(axis=1))[:k].tolist()
+
+
+def test_compact_store_recall_matches_exact_search():
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(3000, 32)).astype(np.float32)
+    queries = rng.normal(size=(25, 32)).astype(np.float32)
+    ids = [f"c{row}" for row in range(len(vectors))]
+    for dtype in ("int8", "float16"):
+        store = rag.CompactVectorStore(tempfile.mkdtemp(), dtype)
+        for start in range(0, len(vectors), 500):
+            store.add(ids[start:start + 500], vectors[start:start + 500])
+        found = 0
+        for query in queries:
+            hits = store.search(query, 10)
+            expected = {ids[row] for row in _exact_top(vectors, query, 10)}
+            found += len(expected & {chunk_id for chunk_id, _ in hits})
+            # The shortlist is re-scored from float32, so distances are exact
+            row = int(hits[0][0][1:])
+            assert abs(hits[0][1] - float(((vectors[row] - query) ** 2).sum())) < 1e-3
+        assert found / (10 * len(queries)) >= 0.95, (dtype, found)
+
+
+def test_compact_store_remove_then_rebuild():
+    rng = np.random.default_rng(11)
+    vectors = {f"c{row}": rng.normal(size=16).astype(np.float32) for row in range(400)}
+    directory = tempfile.mkdtemp()
+    store = rag.CompactVectorStore(directory, "int8")
+    store.add(list(vectors), list(vectors.values()))
+    removed = [f"c{row}" for row in range(0, 300, 2)]
+    store.remove(removed)
+    for chunk_id in removed:
+        del vectors[chunk_id]
+
+    reader = rag.CompactVectorStore(directory, "int8", read_only=True)
+    reader.sync(None, force=True)
+    query = vectors["c1"]
+    before = store.search(query, 5)
+    assert before[0][0] == "c1" and reader.search(query, 5) == before
+    assert not {chunk_id for chunk_id, _ in store.search(query, 400)} & set(removed)
+
+    # A quarter of the rows are dead, so the next sync writes a new generation without them
+    store.sync(VectorCollection(vectors), force=True)
+    assert len(store.ids) == len(store.row_of) == 250
+    assert [name for name in os.listdir(directory) if name.startswith("gen-")] == [store.generation]
+    assert store.search(query, 5) == before
+    reader.sync(None, force=True)
+    assert reader.generation == store.generation and reader.search(query, 5) == before
+
+
+def test_compact_store_cuts_uncommitted_rows():
+    rng = np.random.default_rng(3)
+    directory = tempfile.mkdtemp()
+    store = rag.CompactVectorStore(directory, "float16")
+    store.add([f"c{row}" for row in range(50)], rng.normal(size=(50, 8)))
+    reader = rag.CompactVectorStore(directory, "float16", read_only=True)
+    reader.sync(None, force=True)
+
+    # A writer that dies after appending rows but before committing meta.json leaves orphans behind
+    store._append(store.generation, rng.normal(size=(7, 8)).astype(np.float32))
+    with open(store._path("ids.jsonl"), "ab") as f:
+        f.write(b'{"add": ["orph')
+
+    successor = rag.CompactVectorStore(directory, "float16")
+    fresh = rng.normal(size=(3, 8)).astype(np.float32)
+    successor.add(["n0", "n1", "n2"], fresh)
+    assert len(successor.ids) == 53
+    assert os.path.getsize(successor._path("norms.f32")) == 53 * 4
+    for i, vector in enumerate(fresh):
+        assert successor.search(vector, 1)[0][0] == f"n{i}"
+
+    # Readers replay only the new log entry
+    reader.sync(None, force=True)
+    assert reader.search(fresh[2], 1)[0][0] == "n2" and len(reader.ids) == 53
+
+
+class TopicEmbeddings(Embeddings):
+    """One dimension per topic word plus a small constant, so sentences about a topic match it."""
+    TOPICS = ("storage", "network", "budget", "cafeteria")
+
+    def __init__(self):
+        self.calls = []
+
+    def _embed(self, text: str) -> list:
+        words = [word.strip(".,").lower() for word in text.split()]
+        return [0.1] + [float(words.count(topic)) for topic in self.TOPICS]
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+PLANNING = Document(id="planning", page_content=(
+    "Storage quotas are reviewed every quarter by the team. "
+    "The cafeteria menu changes on Mondays for everyone. "
+    "Storage growth drives most of the hardware budget."
+))
+NETWORK = Document(id="network", page_content=(
+    "Network upgrades happen at night to avoid outages. "
+    "Old storage arrays are retired after five years of service."
+))
+
+
+def _with_compression(test):
+    def run():
+        previous = rag.embedding_service, rag.sentence_vectors
+        model = TopicEmbeddings()
+        rag.embedding_service = rag.EmbeddingService(model, batch_window=0.0)
+        rag.sentence_vectors = rag.SentenceVectorStore(os.path.join(tempfile.mkdtemp(), "sentences.sqlite3"))
+        rag._sentence_cache.clear()
+        try:
+            test(model)
+        finally:
+            rag.embedding_service, rag.sentence_vectors = previous
+            rag._sentence_cache.clear()
+    run.__name__ = test.__name__
+    return run
+
+
+@_with_compression
+def test_compressor_keeps_relevant_sentences_in_order(model):
+    compressed = rag.SentenceCompressor(max_tokens=1000, min_similarity=0.5).compress_documents([PLANNING, NETWORK], "storage")
+    assert [doc.id for doc in compressed] == ["planning", "network"]
+    assert compressed[0].page_content == (
+        "Storage quotas are reviewed every quarter by the team. Storage growth drives most of the hardware budget."
+    )
+    assert compressed[0].metadata == {"sentences_kept": 2, "sentences_total": 3}
+    assert compressed[1].page_content == "Old storage arrays are retired after five years of service."
+
+    # A chunk without a matching sentence is dropped entirely
+    only_network = rag.SentenceCompressor(max_tokens=1000, min_similarity=0.5).compress_documents([PLANNING, NETWORK], "network")
+    assert [doc.page_content for doc in only_network] == ["Network upgrades happen at night to avoid outages."]
+
+
+@_with_compression
+def test_compressor_budget_and_threshold(model):
+    # Nothing clears the threshold, but the best sentence is still kept
+    strict = rag.SentenceCompressor(max_tokens=1000, min_similarity=0.99).compress_documents([PLANNING, NETWORK], "budget storage")
+    assert [doc.page_content for doc in strict] == ["Storage growth drives most of the hardware budget."]
+
+    # The token budget stops at the sentences that fit, skipping longer ones
+    best = "Storage growth drives most of the hardware budget."
+    budget = rag.estimate_tokens(best)
+    fitted = rag.SentenceCompressor(max_tokens=budget, min_similarity=0.0).compress_documents([PLANNING, NETWORK], "budget storage")
+    assert sum(rag.estimate_tokens(doc.page_content) for doc in fitted) <= budget
+    assert fitted[0].page_content.startswith(best)
+
+    # A budget smaller than the best sentence truncates it instead of returning nothing
+    tiny = rag.SentenceCompressor(max_tokens=3, min_similarity=0.0).compress_documents([PLANNING], "budget storage")
+    assert len(tiny) == 1 and 0 < rag.estimate_tokens(tiny[0].page_content) <= 3
+
+
+@_with_compression
+def test_compressor_falls_back_when_stored_vectors_do_not_match(model):
+    # Vectors stored for an older version of the chunk have a different sentence count
+    rag.sentence_vectors.put_many([("planning", np.ones((2, 5), dtype=np.float32))])
+    rag.sentence_vectors.put_many([("network", np.asarray(model.embed_documents(rag.split_sentences(NETWORK.page_content))))])
+    model.calls.clear()
+
+    compressed = rag.SentenceCompressor(max_tokens=1000, min_similarity=0.5).compress_documents([PLANNING, NETWORK], "storage")
+    assert [doc.metadata["sentences_kept"] for doc in compressed] == [2, 1]
+    # Besides the query, only the mismatched chunk was embedded; the other came from the store
+    assert model.calls == [["storage"], rag.split_sentences(PLANNING.page_content)]
+    assert rag.compression_stats["chunks_from_store"] >= 1
+
+
+if __name__ == "__main__":
+    test_concurrent_queries_share_one_model_call()
+    test_cached_queries_skip_the_model()
+    test_reranker_skips_while_timed_out_job_runs()
+    test_compact_store_recall_matches_exact_search()
+    test_compact_store_remove_then_rebuild()
+    test_compact_store_cuts_uncommitted_rows()
+    test_compressor_keeps_relevant_sentences_in_order()
+    test_compressor_budget_and_threshold()
+    test_compressor_falls_back_when_stored_vectors_do_not_match()
+    print("✅ RAG component tests passed")
@@ -0,0 +1,201 @@
+# tests/test_rag_writes.py
+# Exercises rag-mcp live document writes and the loader's pruning against a temporary Chroma directory.
+
+import asyncio
+import hashlib
+import importlib
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+from langchain_core.embeddings import Embeddings
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("GROQ_API_KEY", "test")
+rag = importlib.import_module("mcp-servers.rag-mcp.server")
+# Chroma caches its client per path, and PERSIST_DIRECTORY is relative, so all tests share one directory
+STORE_DIRECTORY = tempfile.mkdtemp()
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words vectors, so the tests need no model download."""
+    def _embed(self, text: str) -> list:
+        vector = [0.0] * 32
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 32] += 1.0
+        return vector
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def _open_store():
+    """Opens Chroma and the indexes the way RagStartup does, minus the models."""
+    os.chdir(STORE_DIRECTORY)
+    if rag.vectordb is not None:
+        return
+    os.makedirs(rag.PERSIST_DIRECTORY)  # the volume mount in the deployment
+    rag.embedding_service.model = HashEmbeddings()
+    rag.open_chroma()
+    rag.build_indexes()
+
+
+def _upsert(doc_id: str, content: str, metadata: dict | None = None) -> dict:
+    op = {"action": "upsert", "doc_id": doc_id, "chunks": rag.document_chunks(doc_id, content, metadata)}
+    return rag.DocumentWriter()._apply([op])[0]
+
+
+def test_document_writes():
+    cwd = os.getcwd()
+    try:
+        _open_store()
+        collection = rag.vectordb._collection
+
+        added = _upsert("notes", "Quarterly planning notes for the storage team.", {"team": "storage"})
+        assert added["status"] == "success" and added["chunks_written"] == 1
+        chunk_id = collection.get(where={"doc_id": "notes"})["ids"][0]
+
+        # Same text: nothing is embedded again
+        again = _upsert("notes", "Quarterly planning notes for the storage team.", {"team": "storage"})
+        assert again["chunks_written"] == 0 and again["chunks_updated"] == 0
+
+        # Same text with new metadata: the stored metadata and the BM25 filters follow
+        moved = _upsert("notes", "Quarterly planning notes for the storage team.", {"owner": "infra"})
+        assert moved["chunks_written"] == 0 and moved["chunks_updated"] == 1
+        assert collection.get(ids=[chunk_id])["metadatas"][0] == {"owner": "infra", "doc_id": "notes"}
+        assert rag.bm25_index.search("planning", 5, {"owner": "infra"})
+        assert not rag.bm25_index.search("planning", 5, {"team": "storage"})
+
+        # New text replaces the old chunk
+        changed = _upsert("notes", "Hiring plan for the network team.", {"owner": "infra"})
+        assert changed["chunks_written"] == 1 and changed["chunks_deleted"] == 1
+        assert chunk_id not in collection.get(where={"doc_id": "notes"})["ids"]
+
+        deleted = rag.DocumentWriter()._apply([{"action": "delete", "doc_id": "notes"}])[0]
+        assert deleted["chunks_deleted"] == 1
+        assert not collection.get(where={"doc_id": "notes"})["ids"]
+    finally:
+        os.chdir(cwd)
+
+
+def test_prune_keeps_api_documents():
+    spec = importlib.util.spec_from_file_location("load_initial_rag_data", os.path.join(ROOT, "scripts", "load_initial_rag_data.py"))
+    loader = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(loader)
+    cwd = os.getcwd()
+    try:
+        _open_store()
+        _upsert("api-doc", "Written through the rag-mcp API.")
+        rag.vectordb.add_texts(["Left over from an old loader run."], ids=["orphan"])
+        rag.vectordb.add_texts(["Owned by a file in the manifest."], ids=["managed"])
+        manifest = {"files": {"data/a.txt": {"chunk_ids": ["managed"]}}}
+
+        assert loader.prune_unmanaged_chunks(rag.vectordb, None, manifest) == 1
+        remaining = set(rag.vectordb._collection.get()["ids"])
+        assert "orphan" not in remaining and "managed" in remaining
+        assert rag.vectordb._collection.get(where={"doc_id": "api-doc"})["ids"]
+    finally:
+        os.chdir(cwd)
+
+
+def test_web_cache_keeps_pages_over_snippets():
+    cwd = os.getcwd()
+    try:
+        _open_store()
+        url = "https://example.com/raft"
+        page = {"url": url, "title": "Raft", "text": "Raft elects a leader with randomized election timeouts.", "kind": "page"}
+        assert rag.ingest_web_results([page], "raft") == 1
+        snippet = {"url": url, "title": "Raft", "text": "Raft consensus explained in one snippet."}
+        assert rag.ingest_web_results([snippet], "raft") == 0
+        kinds = rag.web_vectordb._collection.get(where={"url": url})["metadatas"]
+        assert [metadata["kind"] for metadata in kinds] == ["page"]
+
+        # Once the page has expired, neither search nor the page check sees it any more
+        rag.web_vectordb._collection.update(ids=rag.web_vectordb._collection.get(where={"url": url})["ids"],
+                                            metadatas=[{"expires_at": time.time() - 1}])
+        assert not rag.search_web_results("leader election timeouts", k=5)
+        assert rag.ingest_web_results([snippet], "raft") == 1
+        hits = rag.search_web_results("raft consensus snippet", k=5)
+        assert [hit["metadata"]["kind"] for hit in hits] == ["snippet"]
+    finally:
+        os.chdir(cwd)
+
+
+def test_dense_search_keeps_negative_relevance():
+    cwd = os.getcwd()
+    try:
+        _open_store()
+        _upsert("far", "Completely unrelated words about gardening tomatoes.")
+        query_vector = rag.embedding_service.embed_query("quarterly storage budget review meeting")
+        # HashEmbeddings are not normalized, so squared-L2 relevance is negative here
+        scored = rag.dense_search(query_vector, 50)
+        assert any(score < 0 for _, score in scored)
+        assert len(scored) == len(rag.search_documents("quarterly storage budget review meeting", 50, mode="dense"))
+        assert all(score >= 0.5 for _, score in rag.dense_search(query_vector, 50, score_threshold=0.5))
+    finally:
+        os.chdir(cwd)
+
+
+def test_other_workers_follow_metadata_updates():
+    cwd = os.getcwd()
+    try:
+        _open_store()
+        _upsert("runbook", "Restart the ingest service after a disk alert.", {"team": "storage"})
+        # A second worker process keeps its own BM25 index and only syncs from Chroma
+        worker_index = rag.BM25Index()
+        worker_index.sync(rag.vectordb._collection, force=True)
+        assert worker_index.search("ingest disk", 5, {"team": "storage"})
+
+        moved = _upsert("runbook", "Restart the ingest service after a disk alert.", {"team": "network"})
+        assert moved["chunks_written"] == 0 and moved["chunks_updated"] == 1
+        worker_index.sync(rag.vectordb._collection, force=True)
+        assert not worker_index.search("ingest disk", 5, {"team": "storage"})
+        assert worker_index.search("ingest disk", 5, {"team": "network"})
+    finally:
+        os.chdir(cwd)
+
+
+def test_spool_serves_writes_and_web_cache_searches():
+    cwd = os.getcwd()
+    workers = rag.WORKERS
+    try:
+        _open_store()
+        os.makedirs(rag.write_spool.results, exist_ok=True)
+        rag.ingest_web_results([{"url": "https://example.com/paxos", "text": "Paxos reaches consensus with a quorum of acceptors."}], "paxos")
+
+        async def as_other_worker():
+            rag.document_writer.start()
+            consumer = asyncio.create_task(rag.consume_spool())
+            try:
+                op = {"action": "upsert", "doc_id": "spooled", "chunks": rag.document_chunks("spooled", "Written by another worker.", None)}
+                written = await rag.spool_write(op, wait=True)
+                # Without the writer lock, searches go through the writer's up-to-date Chroma index
+                found = await rag.web_cache_lookup("paxos quorum acceptors", 3, 24)
+                return written, found
+            finally:
+                consumer.cancel()
+        rag.WORKERS = 2
+        written, found = asyncio.run(as_other_worker())
+        assert written["status"] == "success" and written["chunks_written"] == 1
+        assert found["status"] == "success"
+        assert "https://example.com/paxos" in [hit["metadata"]["url"] for hit in found["results"]]
+        assert not [name for name in os.listdir(rag.write_spool.directory) if name.endswith(".json")]
+    finally:
+        rag.WORKERS = workers
+        os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    test_document_writes()
+    test_prune_keeps_api_documents()
+    test_web_cache_keeps_pages_over_snippets()
+    test_dense_search_keeps_negative_relevance()
+    test_other_workers_follow_metadata_updates()
+    test_spool_serves_writes_and_web_cache_searches()
+    print("✅ RAG write tests passed")
@@ -0,0 +1,141 @@
+# tests/test_web_fetch.py
+# Exercises the web-mcp fetch_page tool against a local HTTP server.
+
+import asyncio
+import importlib
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+for key in ("SERPAPI_KEY", "RAPIDAPI_KEY", "STACKEXCHANGE_KEY", "NEWSAPI_KEY", "OPENWEATHER_API_KEY"):
+    os.environ.setdefault(key, "test")
+web = importlib.import_module("mcp-servers.web-mcp.server")
+
+ARTICLE = (
+    "<html><head><title>Test Article</title><style>body { color: red; }</style></head><body>"
+    "<nav>Home | About</nav><script>var tracking = true;</script>"
+    "<h1>Heading</h1><p>First paragraph of the article.</p><p>Second paragraph.</p>"
+    "</body></html>"
+).encode()
+LONG_PAGE = ("<html><body>" + "<p>This sentence repeats to make a long page.</p>" * 20000 + "</body></html>").encode()
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    requests = []
+    hosts = []
+
+    def do_GET(self):
+        PageHandler.requests.append((self.path, self.headers.get("If-None-Match")))
+        PageHandler.hosts.append(self.headers.get("Host"))
+        if self.path == "/article":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = ARTICLE
+        elif self.path == "/long":
+            body = LONG_PAGE
+        elif self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/article")
+            self.end_headers()
+            return
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client stopped reading early
+
+    def log_message(self, *args):
+        pass
+
+
+def test_fetch_page_against_local_server():
+    # The test server is on loopback, which fetch_page refuses by default
+    web.WEB_FETCH_ALLOW_PRIVATE = True
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        page = asyncio.run(web.fetch_page(f"{base}/article"))
+        assert page["title"] == "Test Article"
+        assert "First paragraph of the article." in page["content"]
+        assert "tracking" not in page["content"] and "Home" not in page["content"]
+        assert not page["truncated"] and not page["cached"]
+
+        # Within the TTL the page is served from memory without a request
+        assert asyncio.run(web.fetch_page(f"{base}/article"))["cached"]
+        assert len(PageHandler.requests) == 1
+
+        # After the TTL the page is revalidated with its ETag
+        web.page_cache[f"{base}/article"]["fetched_at"] = 0
+        revalidated = asyncio.run(web.fetch_page(f"{base}/article"))
+        assert revalidated["cached"] and revalidated["content"] == page["content"]
+        assert PageHandler.requests[-1] == ("/article", '"v1"')
+
+        # Long pages stop streaming once the token budget is covered
+        long_page = asyncio.run(web.fetch_page(f"{base}/long", max_tokens=100))
+        assert long_page["truncated"] and long_page["tokens"] <= 100
+        assert web.page_cache[f"{base}/long"]["bytes_read"] < len(LONG_PAGE)
+
+        # Redirects are followed hop by hop
+        moved = asyncio.run(web.fetch_page(f"{base}/moved"))
+        assert moved["final_url"] == f"{base}/article" and "First paragraph" in moved["content"]
+    finally:
+        server.shutdown()
+        web.WEB_FETCH_ALLOW_PRIVATE = False
+
+
+def test_fetch_page_refuses_private_addresses():
+    for url in ("http://127.0.0.1:9000/", "http://169.254.169.254/latest/meta-data/", "http://10.0.0.1/", "http://[::1]/"):
+        result = asyncio.run(web.fetch_page(url))
+        assert "non-public address" in result["error"], url
+
+
+def test_fetch_page_connects_to_the_vetted_address():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    lookups, served = [], len(PageHandler.hosts)
+
+    async def fetch(url):
+        # rebind.test only exists in this resolver, so a second lookup by the connection layer would fail
+        loop = asyncio.get_running_loop()
+        real_getaddrinfo = loop.getaddrinfo
+
+        async def getaddrinfo(host, *args, **kwargs):
+            lookups.append(host)
+            return await real_getaddrinfo("127.0.0.1" if host == "rebind.test" else host, *args, **kwargs)
+        loop.getaddrinfo = getaddrinfo
+        return await web.fetch_page(url)
+
+    try:
+        refused = asyncio.run(fetch(f"http://rebind.test:{port}/article"))
+        assert "non-public address 127.0.0.1" in refused["error"]
+        assert lookups == ["rebind.test"] and len(PageHandler.hosts) == served
+
+        web.WEB_FETCH_ALLOW_PRIVATE = True
+        page = asyncio.run(fetch(f"http://rebind.test:{port}/article"))
+        assert page["title"] == "Test Article"
+        assert lookups == ["rebind.test", "rebind.test"] and PageHandler.hosts[-1] == f"rebind.test:{port}"
+    finally:
+        server.shutdown()
+        web.WEB_FETCH_ALLOW_PRIVATE = False
+        web.page_cache.clear()
+
+
+if __name__ == "__main__":
+    test_fetch_page_against_local_server()
+    test_fetch_page_refuses_private_addresses()
+    test_fetch_page_connects_to_the_vetted_address()
+    print("✅ fetch_page test passed")
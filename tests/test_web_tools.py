@@ -0,0 +1,228 @@
+# tests/test_web_tools.py
+# Exercises web-mcp's response cache and search tools against mocked providers.
+
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+import httpx
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+for key in ("SERPAPI_KEY", "RAPIDAPI_KEY", "STACKEXCHANGE_KEY", "NEWSAPI_KEY", "OPENWEATHER_API_KEY"):
+    os.environ.setdefault(key, "test")
+web = importlib.import_module("mcp-servers.web-mcp.server")
+
+
+class FakeClock:
+    """Stands in for the `time` module so TTLs can expire without sleeping."""
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+def _with_clock(test):
+    def run():
+        real_time, web.time = web.time, FakeClock()
+        try:
+            test(web.time)
+        finally:
+            web.time = real_time
+    run.__name__ = test.__name__
+    return run
+
+
+def test_response_cache_normalizes_keys():
+    cache = web.ResponseCache(10, {"serpapi": 60})
+    cache.set("serpapi", "  Python   ASYNCIO ", ["a", "b"], fetched=2)
+    assert cache.get("serpapi", "python asyncio", 2) == ["a", "b"]
+    assert cache.get("serpapi", "PYTHON\tasyncio", 1) == ["a"]
+    assert cache.get("serpapi", "python asyncio tutorial", 1) is None
+    assert cache.stats["serpapi"] == {"hits": 2, "misses": 1}
+
+
+@_with_clock
+def test_response_cache_expires_per_provider(clock):
+    cache = web.ResponseCache(10, {"serpapi": 60, "newsapi": 10})
+    cache.set("serpapi", "q", ["s"])
+    cache.set("newsapi", "q", ["n"])
+    clock.now += 30
+    assert cache.get("serpapi", "q") == ["s"]
+    assert cache.get("newsapi", "q") is None
+    assert cache.report()["entries"] == 1  # the expired entry is dropped on lookup
+    clock.now += 31
+    assert cache.get("serpapi", "q") is None
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = web.ResponseCache(2, {"google": 60})
+    cache.set("google", "first", ["1"])
+    cache.set("google", "second", ["2"])
+    assert cache.get("google", "first") == ["1"]  # now the most recently used
+    cache.set("google", "third", ["3"])
+    assert cache.get("google", "second") is None
+    assert cache.get("google", "first") == ["1"] and cache.get("google", "third") == ["3"]
+
+
+def test_response_cache_serves_only_what_was_fetched():
+    cache = web.ResponseCache(10, {"serpapi": 60, "weather": 60})
+    cache.set("serpapi", "full", ["a", "b", "c"], fetched=3)
+    assert cache.get("serpapi", "full", 3) == ["a", "b", "c"]
+    # More results than were fetched upstream needs a new request
+    assert cache.get("serpapi", "full", 5) is None
+    # Upstream returned fewer than asked for, so any larger request is already answered
+    cache.set("serpapi", "rare", ["a", "b"], fetched=10)
+    assert cache.get("serpapi", "rare", 50) == ["a", "b"]
+    # Non-list values, like weather, are stored and returned whole
+    cache.set("weather", "id:1", {"temperature": 20})
+    assert cache.get("weather", "id:1") == {"temperature": 20}
+
+
+def _mock_upstream(handler):
+    """Routes the module's httpx clients to `handler` until the returned restore function is called."""
+    real_client = httpx.AsyncClient
+    web.httpx.AsyncClient = lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+    def restore():
+        web.httpx.AsyncClient = real_client
+    return restore
+
+
+def test_web_search_failure_hides_provider_urls():
+    def handler(request):
+        if request.url.host == "serpapi.com":
+            return httpx.Response(500, json={"error": "upstream"})
+        raise httpx.ConnectError(f"cannot reach {request.url}", request=request)
+
+    restore = _mock_upstream(handler)
+    try:
+        asyncio.run(web.web_search("both providers down", num_results=3, max_age_hours=0))
+    except RuntimeError as e:
+        message = str(e)
+    else:
+        raise AssertionError("web_search succeeded without a provider")
+    finally:
+        restore()
+    assert "HTTPStatusError (HTTP 500)" in message and "ConnectError" in message
+    assert "serpapi" in message and "google" in message
+    assert "://" not in message and "api_key" not in message
+
+
+def test_weather_cache_uses_canonical_locations():
+    requests = []
+
+    def handler(request):
+        requests.append(dict(request.url.params))
+        if request.url.params.get("q") == "atlantis":
+            return httpx.Response(404, json={"cod": "404", "message": "city not found"})
+        return httpx.Response(200, json={
+            "id": 2988507, "name": "Paris", "sys": {"country": "FR"},
+            "weather": [{"description": "clear sky"}], "main": {"temp": 21.5, "humidity": 40}
+        })
+
+    previous_cache, web.response_cache = web.response_cache, web.ResponseCache(10, web.CACHE_TTLS)
+    web._weather_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    web.location_aliases.clear()
+    try:
+        first = asyncio.run(web.get_weather_batch(["Paris"]))
+        assert first["cache_hits"] == 0 and first["results"][0]["location_id"] == 2988507
+        # The response taught "paris,fr" the same id, so the spelled-out form is a hit
+        second = asyncio.run(web.get_weather_batch(["paris, FR", "PARIS"]))
+        assert second["cache_hits"] == 2 and len(requests) == 1
+        assert web.response_cache.stats["weather"] == {"hits": 2, "misses": 1}
+
+        unknown = asyncio.run(web.get_weather_batch(["Atlantis"]))
+        assert unknown["results"][0]["error"] == "Weather lookup failed with HTTP 404"
+        assert "appid" not in unknown["results"][0]["error"]
+        assert web.response_cache.stats["weather"] == {"hits": 2, "misses": 2}
+        assert "atlantis" not in web.location_aliases
+    finally:
+        web._weather_client = None
+        web.response_cache = previous_cache
+        web.location_aliases.clear()
+
+
+def _tracker(limits: dict):
+    return web.QuotaTracker(os.path.join(tempfile.mkdtemp(), "quota.json"), limits)
+
+
+@_with_clock
+def test_quota_rolls_over_monthly(clock):
+    clock.now = datetime(2025, 12, 31, 23, 59, tzinfo=timezone.utc).timestamp()
+    tracker = _tracker({"serpapi": "2/month"})
+    asyncio.run(tracker.acquire("serpapi"))
+    asyncio.run(tracker.acquire("serpapi"))
+    try:
+        asyncio.run(tracker.acquire("serpapi"))
+    except web.QuotaExceeded as e:
+        assert "2026-01-01T00:00:00+00:00" in str(e)
+    else:
+        raise AssertionError("a third call fit in a quota of two")
+
+    clock.now = datetime(2026, 1, 1, 0, 1, tzinfo=timezone.utc).timestamp()
+    assert tracker.remaining("serpapi") == 2
+    asyncio.run(tracker.acquire("serpapi"))
+    assert tracker.state["serpapi"]["used"] == 1
+    assert tracker.state["serpapi"]["period_start"] == datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+@_with_clock
+def test_quota_reserves_slots_under_the_lock(clock):
+    # One second before the daily reset with 100 calls left, calls are spaced about 10 ms apart
+    clock.now = datetime(2026, 3, 2, 23, 59, 59, tzinfo=timezone.utc).timestamp()
+    tracker = _tracker({"newsapi": "1000/day"})
+    tracker.state["newsapi"]["used"] = 900
+
+    async def burst():
+        await asyncio.gather(*(tracker.acquire("newsapi") for _ in range(3)))
+    asyncio.run(burst())
+    state = tracker.state["newsapi"]
+    assert state["used"] == 903
+    # Each caller queued behind the slot reserved by the one before it
+    assert 0.02 < state["last_call"] - clock.now < 0.03
+
+
+@_with_clock
+def test_quota_throttles_near_exhaustion(clock):
+    clock.now = datetime(2026, 3, 2, 12, tzinfo=timezone.utc).timestamp()
+    tracker = _tracker({"serpapi": "10/day", "google": "10/day"})
+    tracker.state["serpapi"].update(used=9, last_call=clock.now - 10)
+    try:
+        asyncio.run(tracker.acquire("serpapi"))
+    except web.QuotaExceeded as e:
+        assert "throttled" in str(e)
+    else:
+        raise AssertionError("the last call of the day was not paced")
+    assert tracker.state["serpapi"]["used"] == 9  # a refused call is not counted
+    assert tracker.report()["serpapi"]["throttled"]
+
+    # Malformed provider headers are ignored instead of failing a paid call
+    for remaining in ("1.0", "", "n/a", None):
+        tracker.observe("google", remaining=remaining, backoff="soon")
+        assert tracker.state["google"]["remote_remaining"] is None
+    tracker.observe("google", remaining="4")
+    assert tracker.remaining("google") == 4
+
+    previous, web.quota_tracker = web.quota_tracker, tracker
+    try:
+        result = asyncio.run(web.serpapi_search("quota test query"))
+    finally:
+        web.quota_tracker = previous
+    assert result["status"] == "error" and "throttled" in result["message"]
+
+
+if __name__ == "__main__":
+    test_response_cache_normalizes_keys()
+    test_response_cache_expires_per_provider()
+    test_response_cache_evicts_least_recently_used()
+    test_response_cache_serves_only_what_was_fetched()
+    test_web_search_failure_hides_provider_urls()
+    test_weather_cache_uses_canonical_locations()
+    test_quota_rolls_over_monthly()
+    test_quota_reserves_slots_under_the_lock()
+    test_quota_throttles_near_exhaustion()
+    print("✅ web tool tests passed")